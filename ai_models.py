@@ -1,9 +1,16 @@
 import logging
 from typing import Dict, Optional
 from config import OPENROUTER_API_KEY
+from token_usage import token_usage_tracker
 
 logger = logging.getLogger(__name__)
 
+# Adaptive max_tokens: cap replies near the observed reply-length distribution
+ADAPTIVE_MIN_SAMPLES = 20  # Use the tier ceiling until this many replies are seen
+ADAPTIVE_PERCENTILE = 0.95
+ADAPTIVE_HEADROOM = 1.25
+MIN_REPLY_TOKENS = 256  # Never go below this, even when the daily budget is spent
+
 class AIModelManager:
     def __init__(self):
         # Define AI models for different tiers
@@ -13,6 +20,7 @@ class AIModelManager:
                 "name": "Venice",
                 "description": "Good quality responses for free characters",
                 "max_tokens": 2000,
+                "daily_token_budget": 20000,
                 "temperature": 0.7
             },
             "premium": {
@@ -20,6 +28,7 @@ class AIModelManager:
                 "name": "Mistral",
                 "description": "High-quality responses for premium characters",
                 "max_tokens": 3000,
+                "daily_token_budget": 60000,
                 "temperature": 0.8
             },
             "ultra_premium": {
@@ -27,6 +36,7 @@ class AIModelManager:
                 "name": "Mythomax",
                 "description": "Ultra-high quality responses for top-tier characters",
                 "max_tokens": 5000,
+                "daily_token_budget": 100000,
                 "temperature": 0.9
             }
         }
@@ -38,15 +48,43 @@ class AIModelManager:
             "ultra_premium": [120, 150]  # Top-tier premium
         }
     
-    def get_model_for_character(self, character_price: int) -> Dict:
-        """Get AI model configuration based on character price"""
+    def get_model_for_character(self, character_price: int, user_id: Optional[int] = None) -> Dict:
+        """Get AI model configuration based on character price
+        
+        When user_id is given, max_tokens is sized from the observed reply lengths
+        for the model and the user's remaining daily token budget.
+        """
+        model_config = None
         for tier, prices in self.character_tiers.items():
             if character_price in prices:
-                return self.models[tier]
+                model_config = self.models[tier]
+                break
+        
+        if model_config is None:
+            # Default to premium if price not found
+            logger.warning(f"Character price {character_price} not found in tiers, defaulting to premium")
+            model_config = self.models["premium"]
+        
+        if user_id is None:
+            return model_config
+        
+        return dict(model_config, max_tokens=self._adaptive_max_tokens(model_config, user_id))
+    
+    def _adaptive_max_tokens(self, model_config: Dict, user_id: int) -> int:
+        """Choose max_tokens from the reply-length distribution and the user's budget"""
+        ceiling = model_config["max_tokens"]
+        max_tokens = ceiling
+        
+        observed = token_usage_tracker.get_reply_length_percentile(
+            model_config["model"], ADAPTIVE_PERCENTILE, ADAPTIVE_MIN_SAMPLES
+        )
+        if observed is not None:
+            max_tokens = int(observed * ADAPTIVE_HEADROOM)
+        
+        remaining = model_config["daily_token_budget"] - token_usage_tracker.get_tokens_used_today(user_id)
+        max_tokens = min(max_tokens, remaining)
         
-        # Default to premium if price not found
-        logger.warning(f"Character price {character_price} not found in tiers, defaulting to premium")
-        return self.models["premium"]
+        return max(MIN_REPLY_TOKENS, min(max_tokens, ceiling))
     
     def get_model_info(self, character_price: int) -> Dict:
         """Get model information for display purposes"""
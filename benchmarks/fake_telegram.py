@@ -0,0 +1,535 @@
+#!/usr/bin/env python3
+"""
+Fake Telegram Bot API Server
+A local stand-in for api.telegram.org (and the OpenRouter chat endpoint) for
+load-testing the bot's handlers. Scripted synthetic users send /start, pick a
+character, chat and optionally buy a locked character with Stars; each user
+sends its next update once the bot has answered the previous one. Responses
+are delayed by a configurable latency and send methods can fail with 429.
+Recorded traffic (traffic_recorder.py) can be replayed instead of scripts.
+
+Point the bot at it through base_url:
+    python -m benchmarks.fake_telegram --port 8081 --users 20
+    TELEGRAM_API_BASE_URL=http://127.0.0.1:8081/bot \
+    OPENROUTER_API_URL=http://127.0.0.1:8081/api/v1/chat/completions python bot.py
+
+benchmarks/load_driver.py runs both in one process and reports throughput.
+"""
+
+import argparse
+import asyncio
+import email
+import email.policy
+import itertools
+import json
+import random
+import time
+from collections import Counter, deque
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+from flood_control import TokenBucket, GLOBAL_RATE, GLOBAL_BURST, LIMITED_ENDPOINTS
+from metrics import LatencyStats
+
+BOT_USER = {"id": 1000000001, "is_bot": True, "first_name": "Load Test Bot", "username": "fake_load_bot"}
+SYNTHETIC_USER_BASE_ID = 5000000000
+MAX_HEADER_BYTES = 16 * 1024
+# Seconds a user waits for an answer before moving on to its next step
+STEP_TIMEOUT = 30.0
+
+# Times a user looks again (every think time) for a keyboard button or invoice
+# that may still be on its way before skipping the step
+STEP_RETRIES = 10
+
+# Form fields that are plain strings even when they look like JSON
+STRING_FIELDS = {"text", "caption", "title", "description", "payload", "currency", "photo", "parse_mode", "provider_token", "start_parameter"}
+
+# Answer methods and the parameter naming the query they answer
+QUERY_ANSWERS = {
+    "answerCallbackQuery": "callback_query_id",
+    "answerPreCheckoutQuery": "pre_checkout_query_id",
+    "answerInlineQuery": "inline_query_id"
+}
+
+WORDS = "hey hi babe what are you doing today tell me about yourself i missed you so much how was your day".split()
+
+def build_script(messages: int, buy: bool) -> List[Tuple]:
+    """Steps of a synthetic user: (kind, argument)"""
+    steps = [("command", "/start"), ("callback", "select_char:")]
+    steps += [("text", None)] * messages
+    if buy:
+        steps += [("command", "/characters"), ("callback", "unlock_char:"), ("callback", "pay_character:"), ("pay", None)]
+    return steps
+
+def replay_text(key: str, length: int) -> str:
+    """Stand-in text of a recorded length, the same for the same text hash"""
+    rng = random.Random(key)
+    text = ""
+    while len(text) < length:
+        text += rng.choice(WORDS) + " "
+    return text[:length].strip() or "hi"
+
+class SyntheticUser:
+    """A scripted user that answers the bot's keyboards and invoices"""
+    
+    def __init__(self, user_id: int, script: List[Tuple], rng: random.Random, think_time: float):
+        self.id = user_id
+        self.script = deque(script)
+        self.rng = rng
+        self.think_time = think_time
+        self.profile = {"id": user_id, "is_bot": False, "first_name": f"User{user_id % 100000}"}
+        # Latest inline keyboard sent to the user: (message_id, callback data list)
+        self.keyboard: Tuple[int, List[str]] = (0, [])
+        self.invoice: Optional[Dict] = None
+        # Updates not answered yet: [sent at, kind, query id]
+        self.waiting: deque = deque()
+        self.ready_at = 0.0
+        self.retries = 0
+        self.messages = itertools.count(1)
+    
+    @property
+    def done(self) -> bool:
+        return not self.script and not self.waiting
+
+class FakeTelegramServer:
+    """Minimal Bot API over asyncio HTTP (keep-alive), serving getUpdates from synthetic users"""
+    
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.02, jitter: float = 0.01,
+                 flood_rate: float = 0.0, enforce_limits: bool = True, llm_latency: float = 0.5, seed: int = 1):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.llm_latency = llm_latency
+        self.rng = random.Random(seed)
+        self.global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_BURST) if enforce_limits else None
+        self.server = None
+        self.users: Dict[int, SyntheticUser] = {}
+        self.updates: deque = deque()
+        self.new_updates = asyncio.Event()
+        self.update_ids = itertools.count(1)
+        self.bot_message_ids = itertools.count(1)
+        self.query_ids = itertools.count(1)
+        self.queries: Dict[str, int] = {}
+        self.served_up_to = 0
+        self.connections = set()
+        self.driver_task = None
+        self.started = None
+        self.calls = Counter()
+        self.stats = {"updates": 0, "answered": 0, "timeouts": 0, "flood_limited": 0, "llm_requests": 0, "skipped": 0}
+        self.reply_latency = LatencyStats(window=100000)
+        self.kind_latency: Dict[str, LatencyStats] = {}
+        # Replayed traces (benchmarks/replay_traffic.py) bring their own payment messages
+        self.auto_payments = True
+        self.trace: deque = deque()
+        self.speed = 1.0
+        self.replay_task = None
+    
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+    
+    def add_users(self, count: int, messages: int = 5, buy_fraction: float = 0.0, think_time: float = 1.0):
+        """Create scripted users (ids are stable across runs with the same seed)"""
+        for _ in range(count):
+            user_id = SYNTHETIC_USER_BASE_ID + len(self.users)
+            script = build_script(messages, self.rng.random() < buy_fraction)
+            self.users[user_id] = SyntheticUser(user_id, script, random.Random(self.rng.random()), think_time)
+    
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port, limit=MAX_HEADER_BYTES)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.started = time.monotonic()
+        self.driver_task = asyncio.create_task(self._drive_users())
+        if self.trace:
+            self.replay_task = asyncio.create_task(self._replay())
+    
+    async def stop(self):
+        for task in (self.driver_task, self.replay_task):
+            if task is not None:
+                task.cancel()
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        # Long polls still waiting for updates
+        for task in self.connections:
+            task.cancel()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+    
+    def finished(self) -> bool:
+        return not self.trace and all(user.done for user in self.users.values())
+    
+    # Synthetic users
+    
+    async def _drive_users(self):
+        """Emit each user's next step once it got an answer (or gave up waiting)"""
+        while True:
+            now = time.monotonic()
+            for user in self.users.values():
+                while user.waiting and now - user.waiting[0][0] >= STEP_TIMEOUT:
+                    user.waiting.popleft()
+                    self.stats["timeouts"] += 1
+                if user.script and not user.waiting and now >= user.ready_at:
+                    self._next_step(user)
+            await asyncio.sleep(0.01)
+    
+    # Recorded traffic
+    
+    def add_trace(self, events: List[Dict], speed: float = 1.0):
+        """Replay recorded events (traffic_recorder.py) at their offsets divided by speed
+        
+        Hashed users map to synthetic ids in order of appearance and texts are
+        regenerated with the recorded length (the same hash gives the same
+        text), so a trace always replays as the same sequence of updates.
+        """
+        ids = {}
+        for event in events:
+            if event["user"] not in ids:
+                ids[event["user"]] = SYNTHETIC_USER_BASE_ID + len(self.users)
+                user_id = ids[event["user"]]
+                self.users[user_id] = SyntheticUser(user_id, [], random.Random(user_id), 0.0)
+            self.trace.append((event["t"], self.users[ids[event["user"]]], event))
+        self.speed = speed
+        self.auto_payments = False
+    
+    async def _replay(self):
+        started = time.monotonic()
+        while self.trace:
+            offset, user, event = self.trace[0]
+            delay = started + offset / self.speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.trace.popleft()
+            self._emit(user, event)
+    
+    def _emit(self, user: SyntheticUser, event: Dict):
+        """Turn a recorded event back into an update"""
+        kind = event["kind"]
+        if kind == "command":
+            # Hashed arguments stay unreadable tokens
+            text = " ".join([event["command"]] + [arg.lstrip("#") for arg in event["args"]])
+            self._push(user, "message", message=self._message(user, text, command=True))
+        elif kind == "text":
+            self._push(user, "message", message=self._message(user, replay_text(event["text"], event["length"])))
+        elif kind == "callback":
+            self._push_callback(user, event["data"].replace("{user}", str(user.id)))
+        elif kind == "pre_checkout":
+            self._push_pre_checkout(user, event["currency"], event["amount"], event["payload"].replace("{user}", str(user.id)))
+        elif kind == "payment":
+            message = self._message(user, "")
+            del message["text"]
+            message["successful_payment"] = {
+                "currency": event["currency"],
+                "total_amount": event["amount"],
+                "invoice_payload": event["payload"].replace("{user}", str(user.id)),
+                "telegram_payment_charge_id": f"replay_charge_{user.id}_{next(self.query_ids)}",
+                "provider_payment_charge_id": ""
+            }
+            self._push(user, "payment", message=message)
+        elif kind == "inline":
+            query_id = self._query_id(user)
+            self._push(user, "inline", query_id, inline_query={
+                "id": query_id, "from": user.profile, "query": replay_text(event["text"], event["length"]), "offset": event["offset"]
+            })
+        else:
+            # Photos (screenshots can't be reproduced) and rare update types
+            self.stats["skipped"] += 1
+    
+    def _retry_later(self, user: SyntheticUser, step: Tuple):
+        """The bot's answer came before the keyboard or invoice the step needs"""
+        user.retries += 1
+        if user.retries > STEP_RETRIES:
+            user.retries = 0
+            return
+        user.script.appendleft(step)
+        user.ready_at = time.monotonic() + user.think_time
+    
+    def _next_step(self, user: SyntheticUser):
+        kind, argument = user.script.popleft()
+        if kind == "command":
+            self._push(user, "message", message=self._message(user, argument, command=True))
+        elif kind == "text":
+            length = user.rng.randint(1, 12)
+            self._push(user, "message", message=self._message(user, " ".join(user.rng.choices(WORDS, k=length))))
+        elif kind == "callback":
+            message_id, buttons = user.keyboard
+            choices = [data for data in buttons if data.startswith(argument)]
+            if not choices:
+                # Skipped after the retries if the bot never offers it (e.g. nothing locked left)
+                self._retry_later(user, (kind, argument))
+                return
+            self._push_callback(user, user.rng.choice(choices))
+        elif kind == "pay":
+            if user.invoice is None:
+                self._retry_later(user, (kind, argument))
+                return
+            self._push_pre_checkout(
+                user, user.invoice.get("currency", "XTR"),
+                sum(price["amount"] for price in user.invoice.get("prices", [])), user.invoice.get("payload", "")
+            )
+    
+    def _push_callback(self, user: SyntheticUser, data: str):
+        query_id = self._query_id(user)
+        message_id = user.keyboard[0]
+        self._push(user, "callback", query_id, callback_query={
+            "id": query_id,
+            "from": user.profile,
+            "chat_instance": str(user.id),
+            "data": data,
+            "message": {"message_id": message_id, "date": int(time.time()), "chat": self._chat(user), "from": BOT_USER, "text": "keyboard"}
+        })
+    
+    def _push_pre_checkout(self, user: SyntheticUser, currency: str, amount: int, payload: str):
+        query_id = self._query_id(user)
+        self._push(user, "pre_checkout", query_id, pre_checkout_query={
+            "id": query_id, "from": user.profile, "currency": currency, "total_amount": amount, "invoice_payload": payload
+        })
+    
+    def _query_id(self, user: SyntheticUser) -> str:
+        query_id = str(next(self.query_ids))
+        self.queries[query_id] = user.id
+        return query_id
+    
+    @staticmethod
+    def _chat(user: SyntheticUser) -> Dict:
+        return {"id": user.id, "type": "private", "first_name": user.profile["first_name"]}
+    
+    def _message(self, user: SyntheticUser, text: str, command: bool = False) -> Dict:
+        message = {"message_id": next(user.messages), "date": int(time.time()), "chat": self._chat(user), "from": user.profile, "text": text}
+        if command:
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return message
+    
+    def _push(self, user: SyntheticUser, kind: str, query_id: str = None, **payload):
+        user.retries = 0
+        self.updates.append({"update_id": next(self.update_ids), **payload})
+        user.waiting.append([time.monotonic(), kind, query_id])
+        self.new_updates.set()
+    
+    def _answered(self, user_id: Optional[int], query_id: str = None):
+        """Reply to a waiting update: the answer to a query, or the user's oldest unanswered message"""
+        user = self.users.get(user_id)
+        if user is None:
+            return
+        entry = next((entry for entry in user.waiting if entry[2] == query_id), None)
+        if entry is None:
+            return
+        user.waiting.remove(entry)
+        seconds = time.monotonic() - entry[0]
+        self.reply_latency.record(seconds)
+        self.kind_latency.setdefault(entry[1], LatencyStats(window=100000)).record(seconds)
+        self.stats["answered"] += 1
+        user.ready_at = time.monotonic() + user.rng.uniform(0.5, 1.5) * user.think_time
+    
+    # HTTP
+    
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self.connections.add(task)
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except asyncio.IncompleteReadError:
+                    return
+                lines = head.decode("latin-1").split("\r\n")
+                path = lines[0].split(" ")[1]
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                status, response = await self._route(path, headers.get("content-type", ""), body)
+                payload = json.dumps(response).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(payload)}\r\n\r\n".encode("latin-1") + payload
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, asyncio.CancelledError):
+            pass
+        finally:
+            self.connections.discard(task)
+            writer.close()
+    
+    @staticmethod
+    def _parse_params(content_type: str, body: bytes) -> Dict:
+        """Decode python-telegram-bot's form (or multipart, with files) parameters"""
+        if content_type.startswith("application/json"):
+            return json.loads(body or b"{}")
+        if content_type.startswith("multipart/form-data"):
+            message = email.message_from_bytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body, policy=email.policy.HTTP)
+            fields = [(part.get_param("name", header="content-disposition"), part.get_content()) for part in message.iter_parts()]
+        else:
+            fields = parse_qsl(body.decode())
+        params = {}
+        for name, value in fields:
+            if isinstance(value, str) and name not in STRING_FIELDS:
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+            params[name] = value
+        return params
+    
+    async def _route(self, path: str, content_type: str, body: bytes) -> Tuple[int, Dict]:
+        params = self._parse_params(content_type, body)
+        if path.endswith("/chat/completions"):
+            return 200, await self._completion(params)
+        
+        method = path.rsplit("/", 1)[-1].split("?", 1)[0]
+        self.calls[method] += 1
+        if method == "getUpdates":
+            return 200, {"ok": True, "result": await self._get_updates(params)}
+        
+        await asyncio.sleep(max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter)))
+        if method in LIMITED_ENDPOINTS:
+            limited = self.rng.random() < self.flood_rate
+            if self.global_bucket is not None:
+                limited = limited or self.global_bucket.delay() > 0
+                if not limited:
+                    self.global_bucket.reserve()
+            if limited:
+                self.stats["flood_limited"] += 1
+                retry_after = self.rng.randint(1, 3)
+                return 429, {
+                    "ok": False, "error_code": 429,
+                    "description": f"Too Many Requests: retry after {retry_after}",
+                    "parameters": {"retry_after": retry_after}
+                }
+        return 200, {"ok": True, "result": self._call(method, params)}
+    
+    async def _get_updates(self, params: Dict) -> List[Dict]:
+        offset = int(params.get("offset") or 0)
+        while self.updates and self.updates[0]["update_id"] < offset:
+            self.updates.popleft()
+        if not self.updates:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        result = list(itertools.islice(self.updates, int(params.get("limit") or 100)))
+        # Updates are served again until the next offset confirms them, count them once
+        self.stats["updates"] += sum(1 for update in result if update["update_id"] >= self.served_up_to)
+        if result:
+            self.served_up_to = max(self.served_up_to, result[-1]["update_id"] + 1)
+        return result
+    
+    def _call(self, method: str, params: Dict):
+        if method == "getMe":
+            return {**BOT_USER, "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": True}
+        
+        user_id = params.get("chat_id")
+        query_id = None
+        if method in QUERY_ANSWERS:
+            query_id = str(params.get(QUERY_ANSWERS[method]))
+            user_id = self.queries.pop(query_id, None)
+        self._answered(user_id, query_id)
+        if method == "answerPreCheckoutQuery" and params.get("ok") and self.auto_payments and user_id in self.users:
+            self._successful_payment(self.users[user_id])
+        
+        user = self.users.get(user_id)
+        if user is None or method not in LIMITED_ENDPOINTS:
+            return True
+        
+        markup = params.get("reply_markup") or {}
+        message_id = params.get("message_id") or next(self.bot_message_ids)
+        buttons = [button["callback_data"] for row in markup.get("inline_keyboard", []) for button in row if "callback_data" in button]
+        if buttons:
+            user.keyboard = (message_id, buttons)
+        if method == "sendInvoice":
+            user.invoice = params
+        
+        message = {"message_id": message_id, "date": int(time.time()), "chat": self._chat(user), "from": BOT_USER}
+        if method == "sendPhoto":
+            message["photo"] = [{"file_id": "photo", "file_unique_id": "photo", "width": 512, "height": 512}]
+            message["caption"] = params.get("caption", "")
+        elif method == "sendInvoice":
+            message["invoice"] = {
+                "title": params.get("title", ""), "description": params.get("description", ""),
+                "start_parameter": params.get("start_parameter", ""), "currency": params.get("currency", "XTR"),
+                "total_amount": sum(price["amount"] for price in params.get("prices", []))
+            }
+        else:
+            message["text"] = params.get("text", "")
+        if markup:
+            message["reply_markup"] = markup
+        return message
+    
+    def _successful_payment(self, user: SyntheticUser):
+        """Telegram sends the payment message right after an approved pre-checkout"""
+        invoice = user.invoice or {}
+        message = self._message(user, "")
+        del message["text"]
+        message["successful_payment"] = {
+            "currency": invoice.get("currency", "XTR"),
+            "total_amount": sum(price["amount"] for price in invoice.get("prices", [])),
+            "invoice_payload": invoice.get("payload", ""),
+            "telegram_payment_charge_id": f"fake_charge_{user.id}_{next(self.query_ids)}",
+            "provider_payment_charge_id": ""
+        }
+        self._push(user, "payment", message=message)
+    
+    async def _completion(self, params: Dict) -> Dict:
+        """Stand-in for the OpenRouter chat completion endpoint"""
+        self.stats["llm_requests"] += 1
+        await asyncio.sleep(max(0.0, self.llm_latency * self.rng.uniform(0.5, 1.5)))
+        words = self.rng.randint(8, 40)
+        return {
+            "choices": [{"message": {"role": "assistant", "content": " ".join(self.rng.choices(WORDS, k=words))}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(str(params.get("messages", ""))) // 4, "completion_tokens": words}
+        }
+    
+    def get_stats(self) -> Dict:
+        elapsed = time.monotonic() - self.started if self.started else 0.0
+        return {
+            **self.stats,
+            "elapsed": elapsed,
+            "updates_per_second": self.stats["updates"] / elapsed if elapsed else 0.0,
+            "reply_latency": self.reply_latency.summary(),
+            "by_kind": {kind: stats.summary() for kind, stats in sorted(self.kind_latency.items())},
+            "calls": dict(self.calls.most_common())
+        }
+
+async def serve(args):
+    server = FakeTelegramServer(args.host, args.port, args.latency, args.jitter, args.flood_rate, not args.no_limits, args.llm_latency, args.seed)
+    server.add_users(args.users, args.messages, args.buy_fraction, args.think_time)
+    await server.start()
+    print(f"Fake Bot API on {server.url}/bot<token>/, chat completions on {server.url}/api/v1/chat/completions")
+    try:
+        while not server.finished():
+            await asyncio.sleep(1)
+    finally:
+        await server.stop()
+    print(json.dumps(server.get_stats(), indent=2))
+
+def add_user_arguments(parser: argparse.ArgumentParser):
+    """Scripted user options"""
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=5, help="chat messages per user")
+    parser.add_argument("--buy-fraction", type=float, default=0.2, help="share of users that buy a character")
+    parser.add_argument("--think-time", type=float, default=1.0, help="seconds between a reply and the next update")
+
+def add_server_arguments(parser: argparse.ArgumentParser):
+    """Latency and flood options (shared with the load driver and the replayer)"""
+    parser.add_argument("--latency", type=float, default=0.02, help="Bot API response latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="share of sends answered with 429")
+    parser.add_argument("--no-limits", action="store_true", help="don't enforce the global 30 msgs/s limit")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="mean chat completion latency (s)")
+    parser.add_argument("--seed", type=int, default=1)
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Run a fake Telegram Bot API server with synthetic users")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    add_user_arguments(parser)
+    add_server_arguments(parser)
+    asyncio.run(serve(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
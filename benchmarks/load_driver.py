@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Load Driver for the Bot's Handlers
+Runs the real Application (build_application from bot.py, with its update
+lanes, flood control and persistence) against benchmarks/fake_telegram.py in
+one process, and reports updates/sec and reply latency per update kind
+(message, callback, pre-checkout, payment).
+
+The bot runs in a temporary folder with a copy of characters.json, so the
+real database is never touched. Chat replies come from the fake server's
+chat completion endpoint.
+
+Run from the project folder:
+    python -m benchmarks.load_driver --users 200 --messages 5 --think-time 0.5
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from benchmarks.fake_telegram import FakeTelegramServer, add_user_arguments, add_server_arguments
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+def print_latency(name: str, summary: dict):
+    print(
+        f"  {name:<14}{summary['count']:>8}{summary['avg_ms']:>10.1f}{summary['p50_ms']:>10.1f}"
+        f"{summary['p95_ms']:>10.1f}{summary['p99_ms']:>10.1f}{summary['max_ms']:>10.1f}"
+    )
+
+async def run_bot(server: FakeTelegramServer, duration: float) -> dict:
+    """Run the bot against the server until its users are done or duration passes"""
+    await server.start()
+    
+    # config reads these when bot is imported
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": "123456:LOADTEST",
+        "TELEGRAM_API_BASE_URL": f"{server.url}/bot",
+        "OPENROUTER_API_KEY": "load-test",
+        "OPENROUTER_API_URL": f"{server.url}/api/v1/chat/completions",
+        "BOT_MODE": "polling",
+        "SHARD_WORKERS": "1",
+        "TRAFFIC_RECORD_PATH": "",
+        "LOG_FORMAT": "text"
+    })
+    from bot import build_application
+    from startup import initialize_services
+    from flood_control import flood_control
+    from update_processor import update_processor
+    from logging_pipeline import log_pipeline
+    
+    log_pipeline.start()
+    initialize_services()
+    app = build_application()
+    started = time.monotonic()
+    async with app:
+        await app.post_init(app)
+        await app.updater.start_polling(poll_interval=0, timeout=10)
+        await app.start()
+        
+        deadline = started + duration
+        while not server.finished() and time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+        elapsed = time.monotonic() - started
+        
+        await app.updater.stop()
+        await app.stop()
+        await app.post_stop(app)
+    await app.post_shutdown(app)
+    await server.stop()
+    log_pipeline.stop()
+    
+    return {
+        "elapsed": elapsed,
+        "server": server.get_stats(),
+        "flood_control": flood_control.get_stats(),
+        "lanes": update_processor.get_stats(),
+        "unfinished": sum(1 for user in server.users.values() if not user.done)
+    }
+
+def run_isolated(server: FakeTelegramServer, duration: float, verbose: bool = False) -> dict:
+    """run_bot in a temporary folder (fresh database), with the bot's log hidden unless verbose"""
+    with tempfile.TemporaryDirectory() as workdir:
+        shutil.copy(PROJECT_DIR / "characters.json", workdir)
+        os.chdir(workdir)
+        # Keep the report readable: the bot's log only shows warnings unless verbose
+        logging.disable(logging.NOTSET if verbose else logging.WARNING)
+        try:
+            return asyncio.run(run_bot(server, duration))
+        finally:
+            os.chdir(PROJECT_DIR)
+
+def print_report(result: dict, heading: str):
+    server = result["server"]
+    print("=" * 74)
+    print(heading)
+    print(f"Updates: {server['updates']} in {result['elapsed']:.1f}s = {server['updates'] / result['elapsed']:.1f} updates/s")
+    print(f"Answered: {server['answered']}, timed out: {server['timeouts']}, unfinished users: {result['unfinished']}, "
+          f"429s sent: {server['flood_limited']}, LLM requests: {server['llm_requests']}")
+    print("-" * 74)
+    print(f"  {'Reply latency':<14}{'count':>8}{'avg ms':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    print_latency("all", server["reply_latency"])
+    for kind, summary in server["by_kind"].items():
+        print_latency(kind, summary)
+    print("-" * 74)
+    print(f"Bot API calls: {server['calls']}")
+    limiter = result["flood_control"]
+    print(f"Flood control: {limiter['sent']} sent, {limiter['retries']} retries, {limiter['gave_up']} gave up")
+    print(f"Update lanes: {result['lanes']}")
+    print("=" * 74)
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Load-test the bot's handlers against a fake Bot API")
+    add_user_arguments(parser)
+    add_server_arguments(parser)
+    parser.add_argument("--duration", type=float, default=300, help="stop after this many seconds")
+    parser.add_argument("--verbose", action="store_true", help="show the bot's log")
+    args = parser.parse_args()
+    
+    server = FakeTelegramServer(
+        "127.0.0.1", 0, args.latency, args.jitter, args.flood_rate, not args.no_limits, args.llm_latency, args.seed
+    )
+    server.add_users(args.users, args.messages, args.buy_fraction, args.think_time)
+    result = run_isolated(server, args.duration, args.verbose)
+    print_report(result, f"Users: {args.users}, {args.messages} messages each, {args.buy_fraction:.0%} buying")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Payment Matcher Microbenchmark
+Compares the token-level PaymentMatcher with the previous difflib-based
+has_paid on synthetic OCR text of increasing length, with false positives
+(wrong amount or UPI ID accepted) and false negatives for both. Exits with an
+error if the matcher accepts any wrong receipt.
+
+Run from the project folder:
+    python -m benchmarks.matcher_benchmark
+"""
+
+import argparse
+import difflib
+import random
+import string
+import sys
+import timeit
+from payment_matcher import PaymentMatcher
+
+EXPECTED_AMOUNT = 49
+EXPECTED_UPI_ID = "yourupi@upi"
+
+# Confusions applied to simulate OCR noise
+OCR_NOISE = {"0": "O", "1": "l", "5": "S", "@": " @ ", "i": "1", "o": "0"}
+
+def legacy_is_fuzzy_match(text, pattern, threshold=0.6):
+    return difflib.SequenceMatcher(None, text.lower(), pattern.lower()).ratio() > threshold
+
+def legacy_has_paid(text: str) -> bool:
+    """has_paid as implemented before PaymentMatcher"""
+    amount_match = any(legacy_is_fuzzy_match(word.strip("₹₹Rs."), str(EXPECTED_AMOUNT)) for word in text.split())
+    upi_match = legacy_is_fuzzy_match(text, EXPECTED_UPI_ID)
+    return amount_match and upi_match
+
+def add_noise(rng: random.Random, text: str, rate: float) -> str:
+    """Replace some characters with common OCR misreads"""
+    return "".join(OCR_NOISE[c] if c in OCR_NOISE and rng.random() < rate else c for c in text)
+
+def random_word(rng: random.Random) -> str:
+    return "".join(rng.choices(string.ascii_letters + string.digits, k=rng.randint(2, 12)))
+
+def make_receipt_text(rng: random.Random, filler_lines: int, valid: bool) -> str:
+    """Synthetic OCR output of a receipt with filler lines around the payment details"""
+    amount, upi_id = EXPECTED_AMOUNT, EXPECTED_UPI_ID
+    if not valid:
+        if rng.random() < 0.5:
+            amount = rng.choice([4, 9, 94, 149, 490, 59])
+        else:
+            upi_id = "".join(rng.choices(string.ascii_lowercase, k=8)) + "@ybl"
+    
+    lines = [" ".join(random_word(rng) for _ in range(rng.randint(2, 8))) for _ in range(filler_lines)]
+    details = [
+        "Payment Successful",
+        rng.choice([f"Rs. {amount}", f"₹{amount}.00", f"Rs{amount}"]),
+        add_noise(rng, f"UPI ID: {upi_id}", 0.15),
+        f"UPI transaction ID: {rng.randint(10**11, 10**12 - 1)}"
+    ]
+    for line in details:
+        lines.insert(rng.randint(0, len(lines)), line)
+    return "\n".join(lines)
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Benchmark payment text matching")
+    parser.add_argument("--samples", type=int, default=200, help="texts per size")
+    parser.add_argument("--seed", type=int, default=49)
+    args = parser.parse_args()
+    
+    rng = random.Random(args.seed)
+    matcher = PaymentMatcher(EXPECTED_AMOUNT, EXPECTED_UPI_ID)
+    
+    matcher_false_positives = 0
+    print("=" * 100)
+    print(f"{'Lines':>6}{'Legacy us':>12}{'Matcher us':>12}{'Speedup':>10}"
+          f"{'Legacy acc':>13}{'Matcher acc':>13}{'Legacy FP':>11}{'Legacy FN':>11}{'Matcher FP':>12}{'Matcher FN':>12}")
+    print("-" * 100)
+    for filler_lines in [5, 20, 80, 300]:
+        samples = [(make_receipt_text(rng, filler_lines, i % 2 == 0), i % 2 == 0) for i in range(args.samples)]
+        texts = [text for text, _ in samples]
+        
+        legacy_seconds = timeit.timeit(lambda: [legacy_has_paid(t) for t in texts], number=1)
+        matcher_seconds = timeit.timeit(lambda: [matcher.matches(t) for t in texts], number=3) / 3
+        
+        legacy_correct = sum(legacy_has_paid(t) == valid for t, valid in samples)
+        matcher_correct = sum(matcher.matches(t) == valid for t, valid in samples)
+        legacy_false_positives = sum(legacy_has_paid(t) and not valid for t, valid in samples)
+        legacy_false_negatives = sum(not legacy_has_paid(t) and valid for t, valid in samples)
+        false_positives = sum(matcher.matches(t) and not valid for t, valid in samples)
+        false_negatives = sum(not matcher.matches(t) and valid for t, valid in samples)
+        matcher_false_positives += false_positives
+        
+        print(f"{filler_lines:>6}"
+              f"{legacy_seconds / len(texts) * 1e6:>12.1f}"
+              f"{matcher_seconds / len(texts) * 1e6:>12.1f}"
+              f"{legacy_seconds / matcher_seconds:>9.1f}x"
+              f"{legacy_correct / len(samples):>13.0%}"
+              f"{matcher_correct / len(samples):>13.0%}"
+              f"{legacy_false_positives:>11}"
+              f"{legacy_false_negatives:>11}"
+              f"{false_positives:>12}"
+              f"{false_negatives:>12}")
+    print("=" * 100)
+    
+    # A false positive lets a wrong-amount (or wrong-payee) screenshot through the payment check
+    if matcher_false_positives:
+        sys.exit(f"FAIL: the matcher accepted {matcher_false_positives} wrong receipts")
+
+if __name__ == "__main__":
+    main()
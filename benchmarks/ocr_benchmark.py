@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+OCR Benchmark for Payment Screenshots
+Generates a corpus of synthetic UPI receipts with Pillow and reports OCR time
+and verification accuracy with and without screenshot preprocessing, plus the
+share of pixels left for OCR after preprocessing. With --corpus it runs on a
+folder of real screenshots instead, labelled in labels.json like the
+generated corpus ({"file", "amount", "upi_id", "valid"} per screenshot).
+Preprocessing (OCR_PREPROCESS=1) is an opt-in experiment with no recorded
+run yet; it should only become the default once this shows it matching or
+beating raw OCR accuracy on real screenshots.
+
+Run from the project folder:
+    python -m benchmarks.ocr_benchmark --count 40
+    python -m benchmarks.ocr_benchmark --corpus path/to/screenshots
+"""
+
+import argparse
+import json
+import random
+import statistics
+import string
+import time
+from pathlib import Path
+from PIL import Image, ImageDraw, ImageFont
+from payment import extract_text_from_image, preprocess_screenshot, has_paid, EXPECTED_AMOUNT, EXPECTED_UPI_ID
+
+CORPUS_DIR = Path(__file__).parent / "corpus"
+SCREEN_SIZE = (1080, 2340)  # Typical phone screenshot
+
+# Receipt layouts: (background, text, header background, header text, amount in header)
+THEMES = {
+    "light": ("white", (32, 33, 36), (26, 115, 232), "white", False),
+    "banner": ("white", (40, 40, 40), (95, 37, 159), "white", True),
+    "dark": ((18, 18, 18), (232, 234, 237), (40, 40, 40), (232, 234, 237), False)
+}
+
+NAMES = ["Rahul Sharma", "Priya Patel", "Amit Kumar", "Sneha Reddy", "Vikram Singh", "Anjali Gupta"]
+
+def random_upi_id(rng: random.Random) -> str:
+    """Random UPI handle that is not the expected one"""
+    handle = "".join(rng.choices(string.ascii_lowercase, k=rng.randint(5, 10)))
+    return f"{handle}@{rng.choice(['okaxis', 'ybl', 'paytm', 'oksbi', 'upi'])}"
+
+def draw_receipt(rng: random.Random, amount: int, upi_id: str, theme: str) -> Image.Image:
+    """Draw a synthetic UPI payment receipt"""
+    background, text_color, header_color, header_text, amount_in_header = THEMES[theme]
+    image = Image.new("RGB", SCREEN_SIZE, background)
+    draw = ImageDraw.Draw(image)
+    width = SCREEN_SIZE[0]
+    
+    title_font = ImageFont.load_default(size=56)
+    amount_font = ImageFont.load_default(size=120)
+    body_font = ImageFont.load_default(size=44)
+    
+    # Status bar and colored header banner
+    draw.rectangle((0, 0, width, 80), fill=header_color)
+    header_bottom = 900 if amount_in_header else 420
+    draw.rectangle((0, 80, width, header_bottom), fill=header_color)
+    draw.text((80, 200), "Payment Successful", font=title_font, fill=header_text)
+    
+    amount_text = rng.choice([f"Rs. {amount}", f"Rs {amount}.00", f"Rs.{amount}"])
+    if amount_in_header:
+        draw.text((80, 500), amount_text, font=amount_font, fill=header_text)
+        y = header_bottom + 80
+    else:
+        draw.text((80, header_bottom + 80), amount_text, font=amount_font, fill=text_color)
+        y = header_bottom + 320
+    
+    # Decorative avatar block, like a payee photo
+    draw.ellipse((width - 300, y, width - 100, y + 200), fill=header_color)
+    
+    details = [
+        f"To: {rng.choice(NAMES)}",
+        f"UPI ID: {upi_id}",
+        f"UPI transaction ID: {rng.randint(10**11, 10**12 - 1)}",
+        f"From: {random_upi_id(rng)}",
+        f"{rng.randint(1, 28)} Oct 2026, {rng.randint(1, 12)}:{rng.randint(0, 59):02d} pm"
+    ]
+    for line in details:
+        draw.text((80, y), line, font=body_font, fill=text_color)
+        y += 110
+    
+    return image
+
+def generate_corpus(count: int, seed: int) -> list:
+    """Generate receipts and labels, half of them valid payments"""
+    rng = random.Random(seed)
+    CORPUS_DIR.mkdir(exist_ok=True)
+    samples = []
+    
+    for i in range(count):
+        valid = i % 2 == 0
+        amount, upi_id = EXPECTED_AMOUNT, EXPECTED_UPI_ID
+        if not valid:
+            # Invalid receipts get a wrong amount, a wrong UPI ID, or both
+            mismatch = rng.choice(["amount", "upi", "both"])
+            if mismatch in ("amount", "both"):
+                amount = rng.choice([a for a in range(10, 500) if a != EXPECTED_AMOUNT])
+            if mismatch in ("upi", "both"):
+                upi_id = random_upi_id(rng)
+        
+        theme = rng.choice(list(THEMES))
+        path = CORPUS_DIR / f"receipt_{i:03d}.jpg"
+        draw_receipt(rng, amount, upi_id, theme).save(path, quality=rng.randint(60, 90))
+        samples.append({"file": path.name, "amount": amount, "upi_id": upi_id, "theme": theme, "valid": valid})
+    
+    with open(CORPUS_DIR / "labels.json", "w") as f:
+        json.dump(samples, f, indent=2)
+    return samples
+
+def run_mode(corpus_dir: Path, samples: list, preprocess: bool) -> dict:
+    """OCR every receipt and score the results"""
+    timings = []
+    pixel_shares = []
+    correct = amount_found = upi_found = 0
+    
+    for sample in samples:
+        image = Image.open(corpus_dir / sample["file"])
+        if preprocess:
+            processed = preprocess_screenshot(image)
+            pixel_shares.append(processed.width * processed.height / (image.width * image.height))
+        started = time.perf_counter()
+        text = extract_text_from_image(image, preprocess=preprocess)
+        timings.append(time.perf_counter() - started)
+        
+        compact = "".join(text.split()).lower()
+        correct += has_paid(text) == sample["valid"]
+        amount_found += str(sample["amount"]) in compact
+        upi_found += sample["upi_id"].lower() in compact
+    
+    timings.sort()
+    total = len(samples)
+    return {
+        "mean_ms": statistics.mean(timings) * 1000,
+        "p95_ms": timings[min(total - 1, int(total * 0.95))] * 1000,
+        "accuracy": correct / total,
+        "pixels": statistics.mean(pixel_shares) if pixel_shares else 1.0,
+        "amount_recall": amount_found / total,
+        "upi_recall": upi_found / total
+    }
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Benchmark payment screenshot OCR")
+    parser.add_argument("--count", type=int, default=40, help="number of synthetic receipts")
+    parser.add_argument("--seed", type=int, default=49, help="random seed for the corpus")
+    parser.add_argument("--generate-only", action="store_true", help="only write the corpus")
+    parser.add_argument("--corpus", help="folder of real screenshots with a labels.json (skips generation)")
+    args = parser.parse_args()
+    
+    if args.corpus:
+        corpus_dir = Path(args.corpus)
+        with open(corpus_dir / "labels.json") as f:
+            samples = json.load(f)
+        print(f"📁 Loaded {len(samples)} labelled screenshots from {corpus_dir}")
+    else:
+        corpus_dir = CORPUS_DIR
+        samples = generate_corpus(args.count, args.seed)
+        print(f"📁 Generated {len(samples)} receipts in {CORPUS_DIR}")
+    if args.generate_only:
+        return
+    
+    print("=" * 82)
+    print(f"{'Mode':<14}{'Mean ms':>10}{'P95 ms':>10}{'Accuracy':>12}{'Amount':>12}{'UPI ID':>12}{'Pixels':>10}")
+    print("-" * 82)
+    results = {}
+    for name, preprocess in [("raw", False), ("preprocessed", True)]:
+        result = results[name] = run_mode(corpus_dir, samples, preprocess)
+        print(f"{name:<14}{result['mean_ms']:>10.0f}{result['p95_ms']:>10.0f}"
+              f"{result['accuracy']:>12.0%}{result['amount_recall']:>12.0%}{result['upi_recall']:>12.0%}"
+              f"{result['pixels']:>10.0%}")
+    print("=" * 82)
+    if results["preprocessed"]["accuracy"] >= results["raw"]["accuracy"]:
+        print("✅ Preprocessing keeps accuracy on this corpus")
+    else:
+        print("❌ Preprocessing loses accuracy on this corpus, keep OCR_PREPROCESS off")
+
+if __name__ == "__main__":
+    main()
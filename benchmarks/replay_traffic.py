@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Traffic Replay Benchmark
+Replays an anonymized trace recorded with TRAFFIC_RECORD_PATH (see
+traffic_recorder.py) through the fake Bot API server against the real
+Application, at the recorded pace or accelerated, and reports throughput and
+reply latency like benchmarks/load_driver.py. The same trace and seed always
+produce the same updates at the same offsets, so releases can be compared on
+realistic bursts, character switching and payment flows.
+
+Payment screenshots (photos) are counted but not replayed. The bot starts with
+an empty database, so recorded users start without a selected character.
+
+Run from the project folder:
+    python -m benchmarks.replay_traffic traffic.jsonl --speed 10
+"""
+
+import argparse
+import json
+from collections import Counter
+from typing import Dict, List
+from benchmarks.fake_telegram import FakeTelegramServer, add_server_arguments
+from benchmarks.load_driver import run_isolated, print_report
+
+# Seconds allowed after the last event for the remaining replies
+DRAIN_SECONDS = 60
+
+def load_trace(path: str, index: int = -1) -> List[Dict]:
+    """Events of one recording in a trace file (each start appends a recording, default the last)"""
+    traces = []
+    with open(path, encoding="utf-8") as trace_file:
+        for line in trace_file:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            if "trace" in event:
+                traces.append([])
+            elif traces:
+                traces[-1].append(event)
+    if not traces:
+        raise ValueError(f"No recordings in {path}")
+    return traces[index]
+
+def describe_trace(events: List[Dict]) -> str:
+    """Duration, users, peak rate and event mix of a recording"""
+    duration = events[-1]["t"] if events else 0.0
+    per_second = Counter(int(event["t"]) for event in events)
+    kinds = Counter(event["kind"] for event in events)
+    return (
+        f"Trace: {len(events)} updates from {len({event['user'] for event in events})} users over {duration:.0f}s, "
+        f"peak {max(per_second.values(), default=0)}/s\n"
+        f"Mix: {', '.join(f'{kind} {count}' for kind, count in kinds.most_common())}"
+    )
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Replay recorded traffic against the bot")
+    parser.add_argument("trace", help="file written by the traffic recorder")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed (10 = ten times faster)")
+    parser.add_argument("--recording", type=int, default=-1, help="which recording in the file (default: last)")
+    parser.add_argument("--verbose", action="store_true", help="show the bot's log")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    
+    events = load_trace(args.trace, args.recording)
+    server = FakeTelegramServer(
+        "127.0.0.1", 0, args.latency, args.jitter, args.flood_rate, not args.no_limits, args.llm_latency, args.seed
+    )
+    server.add_trace(events, args.speed)
+    duration = (events[-1]["t"] if events else 0.0) / args.speed + DRAIN_SECONDS
+    result = run_isolated(server, duration, args.verbose)
+    print_report(result, f"{describe_trace(events)}\nReplayed at {args.speed:g}x, {result['server']['skipped']} updates skipped")
+
+if __name__ == "__main__":
+    main()
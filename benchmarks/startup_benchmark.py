@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Startup Benchmark for the Bot Process
+Starts fresh interpreters that import bot and run initialize_services(), and
+reports import and initialization time per project module (median of runs),
+the heaviest third-party imports and whether the OCR stack got loaded.
+
+Each run uses a temporary folder with a copy of characters.json and, if it
+exists, sextbot.db, so the real database is never touched.
+
+Run from the project folder:
+    python -m benchmarks.startup_benchmark --runs 5
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+PROJECT_MODULES = {path.stem for path in PROJECT_DIR.glob("*.py")}
+
+# Only needed for screenshot verification, should not load at startup
+HEAVY_MODULES = ["PIL", "pytesseract", "qrcode", "difflib"]
+
+CHILD_SCRIPT = f"""
+import json, sys, time
+started = time.perf_counter()
+import bot
+imported = time.perf_counter()
+from startup import initialize_services
+timings = initialize_services()
+print(json.dumps({{
+    "import": imported - started,
+    "init": timings,
+    "total": time.perf_counter() - started,
+    "heavy": [name for name in {HEAVY_MODULES!r} if name in sys.modules]
+}}))
+"""
+
+def parse_importtime(stderr: str) -> dict:
+    """Map module name -> (self us, cumulative us) from -X importtime output"""
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+def run_once(db_path: Path) -> dict:
+    """Import and initialize the bot in a fresh interpreter"""
+    with tempfile.TemporaryDirectory() as workdir:
+        shutil.copy(PROJECT_DIR / "characters.json", workdir)
+        if db_path.exists():
+            shutil.copy(db_path, Path(workdir) / "sextbot.db")
+        env = dict(os.environ, PYTHONPATH=str(PROJECT_DIR), TELEGRAM_BOT_TOKEN=os.getenv("TELEGRAM_BOT_TOKEN", "0:benchmark"))
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", CHILD_SCRIPT],
+            cwd=workdir, env=env, capture_output=True, text=True
+        )
+    if result.returncode != 0:
+        raise RuntimeError(f"Startup failed:\n{result.stderr[-2000:]}")
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    report["imports"] = parse_importtime(result.stderr)
+    return report
+
+def median_ms(values) -> float:
+    return statistics.median(values) / 1000 if values else 0.0
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Benchmark bot import and initialization time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--db", default=str(PROJECT_DIR / "sextbot.db"), help="database copied into each run")
+    parser.add_argument("--top", type=int, default=8, help="third-party packages to list")
+    args = parser.parse_args()
+    
+    runs = [run_once(Path(args.db)) for _ in range(args.runs)]
+    
+    modules = sorted(
+        {name for run in runs for name in run["imports"] if name in PROJECT_MODULES} | set(runs[0]["init"]),
+        key=lambda name: -median_ms([run["imports"].get(name, (0, 0))[1] for run in runs])
+    )
+    print("=" * 62)
+    print(f"{'Module':<22}{'Import self':>12}{'Import cum':>12}{'Init':>10}   (ms)")
+    print("-" * 62)
+    for name in modules:
+        self_ms = median_ms([run["imports"].get(name, (0, 0))[0] for run in runs])
+        cumulative_ms = median_ms([run["imports"].get(name, (0, 0))[1] for run in runs])
+        init_ms = statistics.median(run["init"].get(name, 0.0) for run in runs) * 1000
+        print(f"{name:<22}{self_ms:>12.1f}{cumulative_ms:>12.1f}{init_ms:>10.1f}")
+    
+    # Top-level third-party and stdlib packages, wherever they were first imported
+    packages = {name for run in runs for name in run["imports"] if "." not in name and name not in PROJECT_MODULES}
+    heaviest = sorted(packages, key=lambda name: -median_ms([run["imports"].get(name, (0, 0))[1] for run in runs]))
+    print("-" * 62)
+    print("Heaviest packages (cumulative import ms):")
+    for name in heaviest[:args.top]:
+        print(f"  {name:<20}{median_ms([run['imports'].get(name, (0, 0))[1] for run in runs]):>10.1f}")
+    
+    print("-" * 62)
+    print(f"Import bot:        {statistics.median(run['import'] for run in runs) * 1000:8.1f} ms")
+    print(f"Initialize:        {statistics.median(sum(run['init'].values()) for run in runs) * 1000:8.1f} ms")
+    print(f"Ready (total):     {statistics.median(run['total'] for run in runs) * 1000:8.1f} ms")
+    heavy = sorted({name for run in runs for name in run["heavy"]})
+    print(f"OCR stack loaded:  {', '.join(heavy) if heavy else 'no'}")
+    print("=" * 62)
+
+if __name__ == "__main__":
+    main()
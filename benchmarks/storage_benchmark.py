@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Storage Microbenchmark at Production Scale
+Generates a synthetic database (users, chat_history, archived message counts,
+character unlocks and active characters) at a chosen scale and times the
+storage functions on the chat hot path: memory.get_last_messages,
+memory.get_user_message_count, CharacterManager.is_character_unlocked and
+CharacterManager.get_active_character. Reports latency percentiles for a cold
+pass (fresh connection, database file evicted from the OS page cache where
+posix_fadvise is available) and warm passes over the same users, plus the
+EXPLAIN QUERY PLAN of every statement each function runs.
+
+The schema comes from the real startup (initialize_services on an empty
+database), so migrations and index changes are measured as shipped. Message
+traffic is skewed towards a minority of heavy users like real chats, and only
+the last ARCHIVE_AFTER_DAYS of history stays in chat_history (older messages
+are represented by archived_message_counts, as after maintenance).
+Generated databases are kept in --data-dir and reused until --rebuild.
+
+Run from the project folder:
+    python -m benchmarks.storage_benchmark --scale small
+    python -m benchmarks.storage_benchmark --users 1000000 --messages 10000000
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import string
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+# (users, chat_history rows)
+SCALES = {
+    "small": (10_000, 100_000),
+    "medium": (100_000, 1_000_000),
+    "production": (1_000_000, 10_000_000)
+}
+# Synthetic user ids start here (real Telegram ids are of this size)
+USER_BASE_ID = 100_000_000
+# Higher values concentrate messages on fewer users (user = users * random() ** SKEW)
+SKEW = 3
+# Rows per executemany batch while generating
+BATCH_ROWS = 100_000
+# Message lengths (characters): users write short messages, characters reply longer
+USER_MESSAGE_LENGTH = (10, 120)
+REPLY_LENGTH = (80, 600)
+PERSONAS = ["Sweet", "Flirty", "Shy", "Bold"]
+
+def skewed_user(users: int) -> int:
+    return USER_BASE_ID + int(users * random.random() ** SKEW)
+
+def batched(rows, size: int = BATCH_ROWS):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def chat_rows(users: int, messages: int, days: float):
+    """User message and reply pairs in time order, spread over the last `days`"""
+    text = "".join(random.choices(string.ascii_lowercase + "      ", k=1 << 20))
+    now = time.time()
+    step = days * 86400 / max(1, messages)
+    started = now - days * 86400
+    for i in range(0, messages, 2):
+        user_id = skewed_user(users)
+        for is_user in (1, 0)[:messages - i]:
+            low, high = USER_MESSAGE_LENGTH if is_user else REPLY_LENGTH
+            length = random.randint(low, high)
+            offset = random.randrange(len(text) - length)
+            stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(started + (i + 1 - is_user) * step))
+            yield user_id, text[offset:offset + length], is_user, stamp
+
+def populate(args, characters: List[Dict]):
+    """Fill the freshly initialized sextbot.db in the current folder"""
+    from maintenance import ARCHIVE_AFTER_DAYS, ANALYZE_LIMIT
+    
+    conn = sqlite3.connect("sextbot.db")
+    conn.execute("PRAGMA journal_mode=DELETE")
+    conn.execute("PRAGMA synchronous=OFF")
+    # Indexes are built once at the end, much faster than row by row
+    indexes = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'chat_history' AND sql IS NOT NULL"
+    ).fetchall()
+    for name, _ in indexes:
+        conn.execute(f"DROP INDEX {name}")
+    
+    started = time.perf_counter()
+    conn.executemany(
+        "INSERT INTO users (user_id, username, persona, paid) VALUES (?, ?, ?, ?)",
+        ((USER_BASE_ID + i, f"user{i}", random.choice(PERSONAS), int(random.random() < args.paid_fraction))
+         for i in range(args.users))
+    )
+    conn.commit()
+    
+    inserted = 0
+    for batch in batched(chat_rows(args.users, args.messages, ARCHIVE_AFTER_DAYS)):
+        conn.executemany("INSERT INTO chat_history (user_id, message, is_user, timestamp) VALUES (?, ?, ?, ?)", batch)
+        conn.commit()
+        inserted += len(batch)
+        print(f"\r  chat_history: {inserted:,}/{args.messages:,} rows", end="", flush=True)
+    print()
+    
+    conn.executemany(
+        "INSERT INTO archived_message_counts (user_id, user_messages) VALUES (?, ?)",
+        ((USER_BASE_ID + i, random.randint(1, 200)) for i in range(args.users) if random.random() < args.archived_fraction)
+    )
+    locked = [char["id"] for char in characters if char["is_locked"]]
+    conn.executemany(
+        "INSERT OR IGNORE INTO character_unlocks (user_id, character_id) VALUES (?, ?)",
+        ((USER_BASE_ID + i, character_id) for i in range(args.users) if random.random() < args.unlock_fraction
+         for character_id in random.sample(locked, random.randint(1, min(3, len(locked)))))
+    )
+    conn.executemany(
+        "INSERT INTO user_active_character (user_id, character_id) VALUES (?, ?)",
+        ((USER_BASE_ID + i, random.choice(characters)["id"]) for i in range(args.users) if random.random() < args.active_fraction)
+    )
+    conn.commit()
+    
+    for name, sql in indexes:
+        print(f"  building {name}")
+        conn.execute(sql)
+    # Statistics as the maintenance window keeps them
+    conn.execute(f"PRAGMA analysis_limit = {ANALYZE_LIMIT}")
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.close()
+    print(f"  generated in {time.perf_counter() - started:.0f}s")
+
+def evict_page_cache() -> bool:
+    """Drop the database files from the OS page cache (Linux), False where unsupported"""
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    for path in ("sextbot.db", "sextbot.db-wal"):
+        if os.path.exists(path):
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            finally:
+                os.close(fd)
+    return True
+
+def captured_queries(call: Callable[[int], object], user_id: int) -> List[str]:
+    """SQL statements (with their values) a storage function runs for a user"""
+    import memory
+    statements = []
+    connect = sqlite3.connect
+    
+    def traced_connect(*args, **kwargs):
+        conn = connect(*args, **kwargs)
+        conn.set_trace_callback(statements.append)
+        return conn
+    
+    sqlite3.connect = traced_connect
+    memory.db.set_trace_callback(statements.append)
+    try:
+        call(user_id)
+    finally:
+        sqlite3.connect = connect
+        memory.db.set_trace_callback(None)
+    return [" ".join(sql.split()) for sql in statements if sql.lstrip().upper().startswith(("SELECT", "WITH"))]
+
+def query_plan(sql: str) -> List[str]:
+    """EXPLAIN QUERY PLAN as an indented tree"""
+    conn = sqlite3.connect("sextbot.db")
+    rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    conn.close()
+    depth = {0: -1}
+    lines = []
+    for node, parent, _, detail in rows:
+        depth[node] = depth.get(parent, -1) + 1
+        lines.append(f"{'   ' * depth[node]}{detail}")
+    return lines
+
+def percentile(ordered: List[float], percentile: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+def run_pass(call: Callable[[int], object], user_ids: List[int], rounds: int) -> Dict:
+    """Latency summary in microseconds (sub-millisecond lookups need finer units than metrics.py)"""
+    samples = []
+    for _ in range(rounds):
+        for user_id in user_ids:
+            started = time.perf_counter()
+            call(user_id)
+            samples.append(time.perf_counter() - started)
+    samples.sort()
+    return {
+        "count": len(samples),
+        "avg_us": sum(samples) / len(samples) * 1e6,
+        "p50_us": percentile(samples, 50) * 1e6,
+        "p95_us": percentile(samples, 95) * 1e6,
+        "p99_us": percentile(samples, 99) * 1e6,
+        "max_us": samples[-1] * 1e6
+    }
+
+def print_latency(name: str, summary: dict):
+    print(
+        f"  {name:<30}{summary['count']:>8}{summary['avg_us']:>9.1f}{summary['p50_us']:>9.1f}"
+        f"{summary['p95_us']:>9.1f}{summary['p99_us']:>9.1f}{summary['max_us']:>9.1f}"
+    )
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Benchmark storage functions on a synthetic production-size database")
+    parser.add_argument("--scale", choices=SCALES, default="production", help="preset users/messages")
+    parser.add_argument("--users", type=int, help="users (overrides --scale)")
+    parser.add_argument("--messages", type=int, help="chat_history rows (overrides --scale)")
+    parser.add_argument("--paid-fraction", type=float, default=0.05)
+    parser.add_argument("--unlock-fraction", type=float, default=0.1, help="users with unlocked characters")
+    parser.add_argument("--active-fraction", type=float, default=0.8, help="users with an active character")
+    parser.add_argument("--archived-fraction", type=float, default=0.3, help="users with archived messages")
+    parser.add_argument("--samples", type=int, default=1000, help="distinct users looked up per pass")
+    parser.add_argument("--rounds", type=int, default=5, help="warm passes over the same users")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "tgbot-storage-benchmark"))
+    parser.add_argument("--rebuild", action="store_true", help="regenerate the database even if it exists")
+    args = parser.parse_args()
+    args.users = args.users or SCALES[args.scale][0]
+    args.messages = args.messages or SCALES[args.scale][1]
+    
+    random.seed(args.seed)
+    params = {
+        name: getattr(args, name)
+        for name in ("users", "messages", "paid_fraction", "unlock_fraction", "active_fraction", "archived_fraction", "seed")
+    }
+    workdir = Path(args.data_dir) / f"{args.users}u-{args.messages}m-s{args.seed}"
+    marker = workdir / "generated.json"
+    generate = args.rebuild or not marker.exists() or json.loads(marker.read_text()) != params
+    if generate:
+        shutil.rmtree(workdir, ignore_errors=True)
+        workdir.mkdir(parents=True)
+    shutil.copy(PROJECT_DIR / "characters.json", workdir)
+    # The bot's databases live in the current folder (initialize_services opens them)
+    os.chdir(workdir)
+    import memory
+    from startup import initialize_services
+    from characters import character_manager
+    
+    initialize_services()
+    if generate:
+        print(f"Generating {args.users:,} users and {args.messages:,} messages in {workdir}")
+        # The journal mode can only change without other connections
+        memory.close_db()
+        populate(args, character_manager.characters)
+        marker.write_text(json.dumps(params))
+    
+    locked = next((char["id"] for char in character_manager.characters if char["is_locked"]), None)
+    functions = {
+        "get_last_messages": memory.get_last_messages,
+        "get_user_message_count": memory.get_user_message_count,
+        "is_character_unlocked": lambda user_id: character_manager.is_character_unlocked(user_id, locked),
+        "get_active_character": character_manager.get_active_character
+    }
+    # Lookups follow the message skew: heavy users are looked up most, like in real traffic
+    user_ids = set()
+    while len(user_ids) < min(args.samples, args.users):
+        user_ids.add(skewed_user(args.users))
+    user_ids = list(user_ids)
+    
+    started = time.perf_counter()
+    character_manager.entitlements.load()
+    entitlements_ms = (time.perf_counter() - started) * 1000
+    
+    results = {}
+    for name, call in functions.items():
+        evicted = evict_page_cache()
+        # Fresh connection for memory.py, with an empty SQLite page cache
+        memory.open_db()
+        results[name] = (run_pass(call, user_ids, 1), run_pass(call, user_ids, args.rounds))
+    
+    db_size = sum(path.stat().st_size for path in workdir.glob("sextbot.db*"))
+    print("=" * 84)
+    print(f"Scale: {args.users:,} users, {args.messages:,} chat_history rows, database {db_size / 1e6:,.0f} MB")
+    print(f"Lookups: {len(user_ids)} users, cold pass {'after page cache eviction' if evicted else 'on a fresh connection'}, "
+          f"{args.rounds} warm passes")
+    print(f"Entitlements load (once per process): {entitlements_ms:.0f} ms")
+    print("-" * 84)
+    print(f"  {'Latency (us)':<30}{'count':>8}{'avg':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for name, (cold, warm) in results.items():
+        print_latency(f"{name} cold", cold)
+        print_latency(f"{name} warm", warm)
+    print("-" * 84)
+    print("Query plans:")
+    for name, call in functions.items():
+        print(f"  {name}")
+        queries = captured_queries(call, user_ids[0])
+        if not queries:
+            print("      (no queries, answered from memory)")
+        for sql in queries:
+            print(f"    {sql}")
+            for line in query_plan(sql):
+                print(f"      {line}")
+    print("=" * 84)
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,34 @@
 import logging
-from telegram import Update, ReplyKeyboardMarkup, InputFile, InlineKeyboardButton, InlineKeyboardMarkup, PreCheckoutQuery, LabeledPrice
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, ConversationHandler, CallbackQueryHandler, PreCheckoutQueryHandler
-from config import TELEGRAM_BOT_TOKEN
-from memory import save_user, save_message, get_persona, get_user_message_count, is_user_paid, mark_user_paid
+import asyncio
+from functools import partial
+from telegram import Update, ReplyKeyboardMarkup, InputFile, InlineKeyboardButton, InlineKeyboardMarkup, PreCheckoutQuery, LabeledPrice, InlineQueryResultArticle, InputTextMessageContent
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, ConversationHandler, CallbackQueryHandler, PreCheckoutQueryHandler, InlineQueryHandler
+from config import (
+    TELEGRAM_BOT_TOKEN, TELEGRAM_API_BASE_URL, ADMIN_USER_IDS, BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_LISTEN,
+    WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_MAX_BODY, SHARD_WORKERS
+)
+from memory import save_user, save_message, get_persona, get_user_message_count, close_db
 from chat_engine import build_prompt, get_llm_reply
-from payment import is_user_paid_upi
+from payment import verify_payment_screenshot_async
+from ocr_service import ocr_service
+from update_processor import update_processor
+from flood_control import flood_control, PRIORITY_PAYMENT, PRIORITY_REPLY
+from usage_stats import usage_stats
+from webhook_server import run_webhook
+from sqlite_persistence import bot_persistence, LazyConversationHandler
+from shutdown import shutdown_coordinator
+from startup import initialize_services
+from sharding import shard_supervisor, owns_user
+from maintenance import maintenance_scheduler
+from traffic_recorder import traffic_recorder
+from profiler import sampling_profiler, loop_stall_monitor, format_profile
+from logging_pipeline import log_pipeline
+from broadcast import broadcast_engine, character_announcement, format_report
 from characters import character_manager
 from stars_payment import stars_payment_manager
 from ai_models import ai_model_manager
 
-# Set up logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Logging is routed through log_pipeline in main() (and in each shard worker)
 logger = logging.getLogger(__name__)
 
 # Conversation states
@@ -23,6 +38,18 @@ CHATTING = 2
 # Payment settings
 FREE_MESSAGE_LIMIT = 10
 
+# Inline search settings
+INLINE_RESULTS_PER_PAGE = 20
+INLINE_CACHE_TIME = 300  # Seconds Telegram may cache inline results
+
+# /stats limits
+STATS_MAX_DAYS = 90
+STATS_TOP_CHARACTERS = 5
+
+# /profile limits (seconds)
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_MAX_SECONDS = 300
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Start the bot and show character selection"""
     user_id = update.effective_user.id
@@ -30,6 +57,12 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     
     logger.info(f"User {user_id} ({user_name}) started the bot")
     
+    # Deep link from inline search: /start char_<character_id>
+    if context.args and context.args[0].startswith("char_"):
+        char = character_manager.get_character_by_id(context.args[0][len("char_"):])
+        if char:
+            return await show_searched_character(update, context, char)
+    
     # Check if user has an active character
     active_char = character_manager.get_active_character(user_id)
     
@@ -68,6 +101,91 @@ async def show_characters(update: Update, context: ContextTypes.DEFAULT_TYPE, pa
             parse_mode='Markdown'
         )
 
+async def show_searched_character(update: Update, context: ContextTypes.DEFAULT_TYPE, char: dict) -> int:
+    """Select or offer to unlock a character picked from inline search"""
+    user_id = update.effective_user.id
+    
+    if character_manager.set_active_character(user_id, char["id"]):
+        await update.message.reply_text(
+            f"✅ **{char['name']} selected!**\n\n"
+            f"🎭 Role: {char['role']}\n"
+            f"📍 Region: {char['region']}\n"
+            f"💬 Language: {char['language']}\n\n"
+            f"Start chatting with {char['name']} now! 😘\n\n"
+            f"Send /characters to change characters",
+            parse_mode='Markdown'
+        )
+        return CHATTING
+    
+    # Character is locked for this user - show unlock options
+    keyboard = stars_payment_manager.create_unlock_keyboard(
+        char["id"], char["name"], char["price_stars"]
+    )
+    ai_benefits = ai_model_manager.get_character_tier_benefits(char["price_stars"])
+    
+    await update.message.reply_text(
+        f"🔒 **Unlock {char['name']}**\n\n"
+        f"💫 Price: {char['price_stars']} Stars\n"
+        f"🎭 Role: {char['role']}\n"
+        f"📍 Region: {char['region']}\n"
+        f"💬 Language: {char['language']}\n"
+        f"🤖 {ai_benefits}\n\n"
+        f"📝 {char['description']}\n\n"
+        f"Click below to unlock with Telegram Stars!",
+        reply_markup=keyboard,
+        parse_mode='Markdown'
+    )
+    return CHOOSING_PERSONA
+
+async def inline_character_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle inline queries: search characters by name, role, region, language or tier"""
+    query = update.inline_query
+    
+    try:
+        offset = int(query.offset or 0)
+    except ValueError:
+        offset = 0
+    
+    chars, next_offset = character_manager.search_characters(
+        query.query, offset, INLINE_RESULTS_PER_PAGE
+    )
+    
+    results = []
+    for char in chars:
+        price_text = f"💫 {char['price_stars']} Stars" if char['is_locked'] else "🆓 Free"
+        ai_benefits = ai_model_manager.get_character_tier_benefits(char['price_stars'])
+        
+        results.append(InlineQueryResultArticle(
+            id=char["id"],
+            title=f"{char['name']} ({char['role']})",
+            description=f"{price_text} • {char['region']} • {char['language']}",
+            thumbnail_url=char["image_url"] if char["image_url"].startswith("http") else None,
+            input_message_content=InputTextMessageContent(
+                f"🌟 **{char['name']}** ({char['age']})\n"
+                f"🎭 {char['role']}\n"
+                f"📍 {char['region']}\n"
+                f"💬 {char['language']}\n"
+                f"💰 {price_text}\n"
+                f"🤖 {ai_benefits}\n"
+                f"📝 {char['description']}",
+                parse_mode='Markdown'
+            ),
+            reply_markup=InlineKeyboardMarkup([[
+                InlineKeyboardButton(
+                    f"💬 Chat with {char['name']}",
+                    url=f"https://t.me/{context.bot.username}?start=char_{char['id']}"
+                )
+            ]])
+        ))
+    
+    # Results are the same for every user, so Telegram can cache them globally
+    await query.answer(
+        results,
+        cache_time=INLINE_CACHE_TIME,
+        is_personal=False,
+        next_offset=str(next_offset) if next_offset else ""
+    )
+
 async def handle_character_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle character selection and unlock callbacks"""
     query = update.callback_query
@@ -169,7 +287,7 @@ async def handle_character_callback(update: Update, context: ContextTypes.DEFAUL
     # Handle character payment requests
     elif data.startswith("pay_character:"):
         parts = data.split(":")
-        character_id = int(parts[1])
+        character_id = parts[1]
         stars_amount = int(parts[2])
         
         char = character_manager.get_character_by_id(character_id)
@@ -359,37 +477,53 @@ async def characters_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await show_characters(update, context)
     return CHOOSING_PERSONA
 
+async def generate_reply(user_id: int, character_prompt: str, character_id: str, character_price: int) -> str:
+    """Generate the character's reply to the user's latest message
+    
+    Callers save it with save_message only once it has been sent: a reply cut
+    off by a shutdown is regenerated on the next start, from a history that
+    must not already contain it.
+    """
+    prompt = build_prompt(user_id, character_prompt)
+    # Blocking HTTP call runs in a thread so the event loop keeps serving other users
+    return await asyncio.to_thread(get_llm_reply, prompt, character_price, user_id, character_id)
+
+async def send_reply(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, **kwargs):
+    """Send a character's reply ahead of menu traffic when we're near Telegram's rate limits"""
+    return await context.bot.send_message(update.effective_chat.id, text, rate_limit_args=PRIORITY_REPLY, **kwargs)
+
 async def chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     msg = update.message.text
-    logger.info(f"Chat message received from user {user_id}: {msg[:50]}...")
-    
-    # Check if user has paid (check both systems for compatibility)
-    is_paid = is_user_paid(user_id) or is_user_paid_upi(user_id)
     
-    # Debug logging
+    # Check if user has paid (Stars or UPI), answered from memory
+    is_paid = character_manager.entitlements.is_paid(user_id)
     message_count = get_user_message_count(user_id)
-    logger.info(f"DEBUG: User {user_id} - Messages: {message_count}, Paid: {is_paid}")
+    # Hot path: a DEBUG record with fields (off at the default level, thinned by LOG_SAMPLE_RATES)
+    logger.debug("Chat message", extra={"user_id": user_id, "length": len(msg), "messages": message_count, "paid": is_paid})
     
-    # Check if user has paid
-    if is_paid:
-        # Paid user - unlimited messages
-        logger.info(f"User {user_id} is paid, processing message")
-        save_message(user_id, msg, is_user=1)
-        
-        # Get character-specific prompt and price
-        character_prompt = character_manager.get_character_prompt(user_id)
-        active_char = character_manager.get_active_character(user_id)
-        character_price = active_char["price_stars"] if active_char else 0
-        
-        prompt = build_prompt(user_id, character_prompt)
-        reply = get_llm_reply(prompt, character_price)
-        save_message(user_id, reply, is_user=0)
-        await update.message.reply_text(reply)
-        return CHATTING
+    # Active character, or None for the default persona
+    active_char = character_manager.get_active_character(user_id)
+    character_price = active_char["price_stars"] if active_char else 0
+    character_id = active_char["id"] if active_char else None
     
-    # Free user - check message limit
-    if message_count >= FREE_MESSAGE_LIMIT:
+    # Locked characters answer only users who unlocked them; free users get FREE_MESSAGE_LIMIT messages
+    if not character_manager.entitlements.can_chat(user_id, character_id, message_count, FREE_MESSAGE_LIMIT):
+        if character_id is not None and not character_manager.entitlements.has_character(user_id, character_id):
+            # Active character is locked for this user - show unlock options
+            logger.info(f"User {user_id} messaged locked character {character_id}, showing unlock")
+            keyboard = stars_payment_manager.create_unlock_keyboard(
+                character_id, active_char["name"], character_price
+            )
+            await update.message.reply_text(
+                f"🔒 **Unlock {active_char['name']}**\n\n"
+                f"💫 Price: {character_price} Stars\n\n"
+                f"Click below to unlock with Telegram Stars, or send /characters to pick a free character!",
+                reply_markup=keyboard,
+                parse_mode='Markdown'
+            )
+            return CHATTING
+        
         # User has reached free message limit - show Stars payment option
         logger.info(f"User {user_id} reached message limit, showing Stars payment")
         
@@ -408,33 +542,43 @@ async def chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return CHATTING
     
-    # Free user within limit - process the message
-    logger.info(f"User {user_id} processing message {message_count + 1}/{FREE_MESSAGE_LIMIT}")
-    save_message(user_id, msg, is_user=1)
-    
-    # Get character-specific prompt and price
     character_prompt = character_manager.get_character_prompt(user_id)
-    active_char = character_manager.get_active_character(user_id)
-    character_price = active_char["price_stars"] if active_char else 0
     
-    prompt = build_prompt(user_id, character_prompt)
-    reply = get_llm_reply(prompt, character_price)
-    save_message(user_id, reply, is_user=0)
+    # Check if user has paid
+    if is_paid:
+        # Paid user - unlimited messages
+        save_message(user_id, msg, 1, character_id, character_price)
+        
+        # A shutdown waits for this reply, or records it to be resumed after the restart
+        async with shutdown_coordinator.generation(user_id, update.effective_chat.id, character_id, character_price):
+            reply = await generate_reply(user_id, character_prompt, character_id, character_price)
+            await send_reply(update, context, reply)
+            save_message(user_id, reply, 0, character_id, character_price)
+        return CHATTING
     
-    # Check if this was the last free message
-    remaining_messages = FREE_MESSAGE_LIMIT - (message_count + 1)
-    if remaining_messages <= 0:
-        await update.message.reply_text(
-            f"{reply}\n\n💋 That was your last free message! "
-            f"Send /pay to unlock unlimited access to me! 😘"
-        )
-    elif remaining_messages <= 3:
-        await update.message.reply_text(
-            f"{reply}\n\n💋 Only {remaining_messages} free messages left! "
-            f"Send /pay to unlock unlimited access! 😘"
-        )
-    else:
-        await update.message.reply_text(reply)
+    # Free user within limit - process the message
+    save_message(user_id, msg, 1, character_id, character_price)
+    
+    async with shutdown_coordinator.generation(user_id, update.effective_chat.id, character_id, character_price):
+        reply = await generate_reply(user_id, character_prompt, character_id, character_price)
+        
+        # Check if this was the last free message
+        remaining_messages = FREE_MESSAGE_LIMIT - (message_count + 1)
+        if remaining_messages <= 0:
+            await send_reply(
+                update, context,
+                f"{reply}\n\n💋 That was your last free message! "
+                f"Send /pay to unlock unlimited access to me! 😘"
+            )
+        elif remaining_messages <= 3:
+            await send_reply(
+                update, context,
+                f"{reply}\n\n💋 Only {remaining_messages} free messages left! "
+                f"Send /pay to unlock unlimited access! 😘"
+            )
+        else:
+            await send_reply(update, context, reply)
+        save_message(user_id, reply, 0, character_id, character_price)
     
     return CHATTING
 
@@ -444,7 +588,7 @@ async def pay(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.info(f"Pay command received from user {user_id}")
     
     # Check if user has paid
-    is_paid = is_user_paid(user_id) or is_user_paid_upi(user_id)
+    is_paid = character_manager.entitlements.is_paid(user_id)
     
     if is_paid:
         await update.message.reply_text("💋 You're already unlocked! Enjoy unlimited access to me! 😘")
@@ -470,6 +614,38 @@ async def pay(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 
+async def handle_payment_screenshot(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Verify a UPI payment screenshot sent as a photo"""
+    user_id = update.effective_user.id
+    logger.info(f"Payment screenshot received from user {user_id}")
+    
+    if character_manager.entitlements.is_paid(user_id):
+        await update.message.reply_text("💋 You're already unlocked! Enjoy unlimited access to me! 😘")
+        return CHATTING
+    
+    photo_file = await update.message.photo[-1].get_file()
+    image_bytes = bytes(await photo_file.download_as_bytearray())
+    
+    # OCR runs in the worker pool so other users keep getting replies
+    verified = await verify_payment_screenshot_async(image_bytes, user_id)
+    
+    if verified is None:
+        await update.message.reply_text(
+            "⏳ I couldn't check your screenshot right now. Please send it again in a minute!"
+        )
+    elif verified:
+        logger.info(f"UPI payment verified for user {user_id}")
+        character_manager.entitlements.apply_event("upi_paid", user_id)
+        await update.message.reply_text(
+            "🎉 Payment verified! You now have unlimited access to me! 😘"
+        )
+    else:
+        await update.message.reply_text(
+            "❌ I couldn't verify this payment. Make sure the amount and UPI ID are clearly visible "
+            "in the screenshot, or send /support for help."
+        )
+    return CHATTING
+
 async def handle_pre_checkout(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle pre-checkout for Stars payments (digital goods)"""
     query = update.pre_checkout_query
@@ -501,50 +677,63 @@ async def handle_successful_payment(update: Update, context: ContextTypes.DEFAUL
     payload_parts = payment_data.invoice_payload.split(":")
     payment_type = payload_parts[0]
     
-    if payment_type == "character_unlock":
+    if payment_type in ("character_unlock", "unlock_character"):
         # Handle character unlock payment
-        character_id = int(payload_parts[1])
+        # Payloads: "character_unlock:<character_id>" or "unlock_character:<user_id>:<character_id>"
+        character_id = payload_parts[-1]
         char = character_manager.get_character_by_id(character_id)
         
         if char:
-            # Record transaction
-            stars_payment_manager.record_transaction(
-                user_id, character_id, char["price_stars"], 
-                payment_data.total_amount, payment_data.telegram_payment_charge_id
+            # Record transaction and unlock the character atomically (ignores redelivered payments)
+            result = stars_payment_manager.record_payment(
+                user_id, "character_unlock", char["price_stars"], payment_data.total_amount,
+                payment_data.telegram_payment_charge_id, character_id
             )
             
-            # Unlock character for the user
-            if character_manager.unlock_character(user_id, character_id):
-                # Get AI model benefits
-                ai_benefits = ai_model_manager.get_character_tier_benefits(char["price_stars"])
-                
-                # Send character image with unlock confirmation
-                try:
-                    await context.bot.send_photo(
-                        chat_id=user_id,
-                        photo=char["image_url"],
-                        caption=f"🎉 **Payment Successful!**\n\n"
-                        f"You've unlocked **{char['name']}**!\n\n"
-                        f"💫 Amount: {payment_data.total_amount} Stars\n"
-                        f"🎭 Character: {char['name']} ({char['role']})\n"
-                        f"🤖 {ai_benefits}\n\n"
-                        f"Send /characters to select her and start chatting! 😘\n\n"
-                        f"💡 **Support**: If you have any issues, send /support",
-                        parse_mode='Markdown'
-                    )
-                except Exception as e:
-                    logger.error(f"Error sending character image: {e}")
-                    # Fallback to text-only if image fails
-                    await update.message.reply_text(
-                        f"🎉 **Payment Successful!**\n\n"
-                        f"You've unlocked **{char['name']}**!\n\n"
-                        f"💫 Amount: {payment_data.total_amount} Stars\n"
-                        f"🎭 Character: {char['name']} ({char['role']})\n"
-                        f"🤖 {ai_benefits}\n\n"
-                        f"Send /characters to select her and start chatting! 😘\n\n"
-                        f"💡 **Support**: If you have any issues, send /support",
-                        parse_mode='Markdown'
-                    )
+            if not result["success"]:
+                await update.message.reply_text(
+                    "❌ We received your payment but couldn't unlock the character. "
+                    "Please contact support with /support and include your payment ID:\n"
+                    f"{payment_data.telegram_payment_charge_id}"
+                )
+                return
+            
+            character_manager.entitlements.apply_event("character_unlock", user_id, character_id)
+            
+            if result["duplicate"]:
+                logger.info(f"Duplicate payment {payment_data.telegram_payment_charge_id} from user {user_id} ignored")
+            
+            # Get AI model benefits
+            ai_benefits = ai_model_manager.get_character_tier_benefits(char["price_stars"])
+            
+            # Send character image with unlock confirmation
+            try:
+                await context.bot.send_photo(
+                    chat_id=user_id,
+                    photo=char["image_url"],
+                    caption=f"🎉 **Payment Successful!**\n\n"
+                    f"You've unlocked **{char['name']}**!\n\n"
+                    f"💫 Amount: {payment_data.total_amount} Stars\n"
+                    f"🎭 Character: {char['name']} ({char['role']})\n"
+                    f"🤖 {ai_benefits}\n\n"
+                    f"Send /characters to select her and start chatting! 😘\n\n"
+                    f"💡 **Support**: If you have any issues, send /support",
+                    parse_mode='Markdown',
+                    rate_limit_args=PRIORITY_PAYMENT
+                )
+            except Exception as e:
+                logger.error(f"Error sending character image: {e}")
+                # Fallback to text-only if image fails
+                await update.message.reply_text(
+                    f"🎉 **Payment Successful!**\n\n"
+                    f"You've unlocked **{char['name']}**!\n\n"
+                    f"💫 Amount: {payment_data.total_amount} Stars\n"
+                    f"🎭 Character: {char['name']} ({char['role']})\n"
+                    f"🤖 {ai_benefits}\n\n"
+                    f"Send /characters to select her and start chatting! 😘\n\n"
+                    f"💡 **Support**: If you have any issues, send /support",
+                    parse_mode='Markdown'
+                )
         else:
             await update.message.reply_text(
                 "❌ Character not found. Please contact support with /support"
@@ -554,16 +743,24 @@ async def handle_successful_payment(update: Update, context: ContextTypes.DEFAUL
         # Handle unlimited access payment
         stars_amount = int(payload_parts[1])
         
-        # Mark user as paid for unlimited access
-        mark_user_paid(user_id)
-        
-        # Record transaction
-        stars_payment_manager.record_unlimited_access_transaction(
-            user_id, stars_amount, payment_data.total_amount, 
+        # Record transaction and mark user as paid atomically (ignores redelivered payments)
+        result = stars_payment_manager.record_payment(
+            user_id, "unlimited_access", stars_amount, payment_data.total_amount,
             payment_data.telegram_payment_charge_id
         )
         
-        await update.message.reply_text(
+        if not result["success"]:
+            await update.message.reply_text(
+                "❌ We received your payment but couldn't activate unlimited access. "
+                "Please contact support with /support and include your payment ID:\n"
+                f"{payment_data.telegram_payment_charge_id}"
+            )
+            return
+        
+        character_manager.entitlements.apply_event("unlimited_access", user_id)
+        
+        await context.bot.send_message(
+            user_id,
             f"🎉 **Unlimited Access Unlocked!**\n\n"
             f"🌟 **Welcome to Premium!**\n\n"
             f"💫 Amount: {payment_data.total_amount} Stars\n"
@@ -574,7 +771,8 @@ async def handle_successful_payment(update: Update, context: ContextTypes.DEFAUL
             f"• Priority support\n\n"
             f"Send /characters to explore all characters! 😘\n\n"
             f"💡 **Support**: If you have any issues, send /support",
-            parse_mode='Markdown'
+            parse_mode='Markdown',
+            rate_limit_args=PRIORITY_PAYMENT
         )
     
     else:
@@ -613,28 +811,193 @@ async def terms_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode='Markdown'
     )
 
-def main():
-    logger.info("Starting bot...")
-    app = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /stats [days] for admins: revenue and usage from the daily aggregates"""
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        return
+    
+    days = 1
+    if context.args and context.args[0].isdigit():
+        days = min(max(int(context.args[0]), 1), STATS_MAX_DAYS)
+    summary = usage_stats.get_summary(days)
+    
+    def character_name(character_id):
+        char = character_manager.get_character_by_id(character_id) if character_id else None
+        return char["name"] if char else (character_id or "No character")
+    
+    lines = [f"📊 Stats for the last {days} day(s)" if days > 1 else "📊 Stats for today", ""]
+    
+    lines.append(f"💫 Stars earned: {sum(summary['stars_by_tier'].values())}")
+    for tier, stars in sorted(summary["stars_by_tier"].items(), key=lambda item: -item[1]):
+        lines.append(f"• {tier}: {stars}")
+    for row in summary["revenue"][:STATS_TOP_CHARACTERS]:
+        if row["character_id"]:
+            lines.append(f"  - {character_name(row['character_id'])}: {row['stars']} ({row['payments']} unlocks)")
+    
+    lines.append("")
+    lines.append(f"💬 User messages: {sum(summary['messages_by_tier'].values())}")
+    for tier, count in sorted(summary["messages_by_tier"].items(), key=lambda item: -item[1]):
+        lines.append(f"• {tier}: {count}")
+    for row in summary["messages"][:STATS_TOP_CHARACTERS]:
+        lines.append(f"  - {character_name(row['character_id'])}: {row['user_messages']}")
+    
+    await update.message.reply_text("\n".join(lines))
+
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /broadcast for admins: <text>, character <id>, status [id] or cancel"""
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        return
+    
+    action = context.args[0].lower() if context.args else ""
+    if action == "status":
+        broadcast_id = int(context.args[1]) if len(context.args) > 1 and context.args[1].isdigit() else None
+        report = broadcast_engine.get_report(broadcast_id)
+        await update.message.reply_text(format_report(report) if report else "No broadcasts yet")
+        return
+    if action == "cancel":
+        broadcast_id = broadcast_engine.cancel()
+        await update.message.reply_text(f"Broadcast #{broadcast_id} cancelled" if broadcast_id else "No broadcast is running")
+        return
+    
+    if broadcast_engine.is_running():
+        await update.message.reply_text(f"Broadcast #{broadcast_engine.broadcast_id} is still running, see /broadcast status")
+        return
+    
+    character_id = None
+    if action == "character" and len(context.args) > 1:
+        char = character_manager.get_character_by_id(context.args[1])
+        if not char:
+            await update.message.reply_text(f"Unknown character: {context.args[1]}")
+            return
+        character_id = char["id"]
+        text = character_announcement(char)
+    else:
+        # Everything after the command, keeping the admin's line breaks
+        text = update.message.text.partition(" ")[2].strip()
+    if not text:
+        await update.message.reply_text(
+            "Usage:\n/broadcast <text>\n/broadcast character <character_id>\n/broadcast status [id]\n/broadcast cancel"
+        )
+        return
+    
+    broadcast_id = broadcast_engine.create(text, update.effective_user.id, character_id)
+    broadcast_engine.start(context.application, broadcast_id)
+    await update.message.reply_text(f"📣 Broadcast #{broadcast_id} started, you'll get a report when it's done")
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /profile [seconds] for admins: sample CPU by stack and handler, then report"""
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        return
+    
+    seconds = PROFILE_DEFAULT_SECONDS
+    if context.args and context.args[0].isdigit():
+        seconds = min(max(int(context.args[0]), 1), PROFILE_MAX_SECONDS)
+    task = sampling_profiler.start(context.application, seconds)
+    if task is None:
+        await update.message.reply_text("A profile is already running")
+        return
+    await update.message.reply_text(f"🔬 Profiling for {seconds}s...")
+    
+    async def report():
+        try:
+            summary = await task
+        except Exception as e:
+            logger.error(f"Profiling failed: {e}")
+            await context.bot.send_message(update.effective_chat.id, f"Profiling failed: {e}")
+            return
+        await context.bot.send_message(update.effective_chat.id, format_profile(summary))
+    
+    # Not awaited: the admin's lane stays free while profiling
+    context.application.create_task(report())
+
+async def resume_reply(app: Application, item: dict):
+    """Regenerate and send a reply interrupted by the last shutdown"""
+    user_id = item["user_id"]
+    character_prompt = character_manager.get_character_prompt(user_id)
+    reply = await generate_reply(user_id, character_prompt, item["character_id"], item["character_price"])
+    await app.bot.send_message(item["chat_id"], reply, rate_limit_args=PRIORITY_REPLY)
+    save_message(user_id, reply, 0, item["character_id"], item["character_price"])
+
+def updates_in_flight() -> int:
+    return update_processor.in_flight
+
+async def on_startup(app: Application):
+    """Install the draining shutdown and finish replies and broadcasts cut off by the last one"""
+    if BOT_MODE != "webhook" and app.updater is not None:
+        # run_webhook and shard workers drain in their own stop sequence
+        shutdown_coordinator.install_signal_handlers(app, updates_in_flight)
+    shutdown_coordinator.resume_task = asyncio.create_task(
+        shutdown_coordinator.resume(lambda item: resume_reply(app, item), owns_user, partial(update_processor.run_in_lane, take_slot=False))
+    )
+    loop_stall_monitor.start()
+    await broadcast_engine.resume(app)
+    if app.job_queue is not None:
+        maintenance_scheduler.schedule(app)
+    else:
+        logger.warning("JobQueue unavailable (APScheduler not installed), maintenance jobs disabled")
+
+async def on_stop(app: Application):
+    """Pause a running broadcast while the bot can still send (it resumes on the next start)"""
+    await broadcast_engine.stop()
+    loop_stall_monitor.stop()
+
+async def on_shutdown(app: Application):
+    """Release background resources when the bot stops"""
+    ocr_service.shutdown()
+    close_db()
+    logger.info(f"Update lanes: {update_processor.get_stats()}")
+    logger.info(f"Outbound messages: {flood_control.get_stats()}")
+    logger.info(f"Maintenance: {maintenance_scheduler.get_stats()}")
+    logger.info(f"Broadcast: {broadcast_engine.get_stats()}")
+    logger.info(f"Event loop stalls: {loop_stall_monitor.get_stats()}")
+    logger.info(f"Logging: {log_pipeline.get_stats()}")
+
+def build_application(updater: bool = True) -> Application:
+    """Create the bot application with all handlers
+    
+    Shard workers pass updater=False: their updates come from the supervisor.
+    """
+    # Users are served in parallel, each user's updates in order (keeps the per (chat, user)
+    # conversation state consistent); payment updates skip the lanes entirely
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .base_url(TELEGRAM_API_BASE_URL)
+        .concurrent_updates(update_processor)
+        .rate_limiter(flood_control)
+        .persistence(bot_persistence)
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+    )
+    if not updater:
+        builder = builder.updater(None)
+    app = builder.build()
     
     # Create conversation handler
-    conv_handler = ConversationHandler(
+    # Conversation states survive restarts; each is loaded on the user's first update
+    conv_handler = LazyConversationHandler(
         entry_points=[CommandHandler("start", start)],
         states={
             CHOOSING_PERSONA: [
                 CommandHandler("characters", characters_command),
                 CallbackQueryHandler(handle_character_callback),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, chat)
+                MessageHandler(filters.TEXT & ~filters.COMMAND, chat),
+                MessageHandler(filters.PHOTO, handle_payment_screenshot)
             ],
             CHATTING: [
                 CommandHandler("characters", characters_command),
                 CommandHandler("pay", pay),
                 CallbackQueryHandler(handle_character_callback),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, chat)
+                MessageHandler(filters.TEXT & ~filters.COMMAND, chat),
+                MessageHandler(filters.PHOTO, handle_payment_screenshot)
             ]
         },
         fallbacks=[CommandHandler("start", start)],
-        per_message=False
+        per_message=False,
+        name="main_conversation",
+        persistent=True,
+        persistence=bot_persistence
     )
     
     app.add_handler(conv_handler)
@@ -643,12 +1006,56 @@ def main():
     app.add_handler(MessageHandler(filters.SUCCESSFUL_PAYMENT, handle_successful_payment))
     app.add_handler(PreCheckoutQueryHandler(handle_pre_checkout))
     
+    # Inline character search (@botname <query>)
+    app.add_handler(InlineQueryHandler(inline_character_search))
+    
     # Add support and terms commands (available in all states)
     app.add_handler(CommandHandler("support", support_command))
     app.add_handler(CommandHandler("terms", terms_command))
+    app.add_handler(CommandHandler("stats", stats_command))
+    app.add_handler(CommandHandler("broadcast", broadcast_command))
+    app.add_handler(CommandHandler("profile", profile_command))
+    return app
+
+def main():
+    log_pipeline.start()
+    logger.info("Starting bot...")
+    # Also runs migrations once before any shard worker starts
+    initialize_services()
+    
+    if SHARD_WORKERS > 1:
+        # This process only receives updates; each user's updates go to one worker process
+        app = shard_supervisor.build_ingress(TELEGRAM_BOT_TOKEN)
+        before_stop = None
+        extra_health = shard_supervisor.get_stats
+    else:
+        app = build_application()
+        before_stop = lambda: shutdown_coordinator.drain(app, updates_in_flight)
+        extra_health = None
     
-    logger.info("Bot started successfully!")
-    app.run_polling()
+    if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+        raise RuntimeError("WEBHOOK_SECRET must be set when BOT_MODE=webhook")
+    
+    # Records where updates arrive: here, or in the supervisor when sharded
+    traffic_recorder.start()
+    try:
+        if BOT_MODE == "webhook":
+            logger.info("Bot started successfully (webhook mode)!")
+            asyncio.run(run_webhook(
+                app, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_MAX_BODY, WEBHOOK_URL,
+                before_stop=before_stop, extra_health=extra_health
+            ))
+        elif SHARD_WORKERS > 1:
+            logger.info(f"Bot started successfully ({SHARD_WORKERS} workers)!")
+            # Workers drain their own in-flight replies when the supervisor stops them
+            app.run_polling()
+        else:
+            logger.info("Bot started successfully!")
+            # run_polling removes a webhook left over from webhook mode; SIGINT/SIGTERM
+            # are handled by shutdown_coordinator so in-flight replies get drained first
+            app.run_polling(stop_signals=None)
+    finally:
+        traffic_recorder.stop()
 
 if __name__ == '__main__':
     main()
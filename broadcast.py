@@ -0,0 +1,368 @@
+import time
+import sqlite3
+import asyncio
+import logging
+from collections import Counter
+from typing import AsyncIterator, Dict, List, Optional
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import Forbidden, TelegramError
+from telegram.ext import Application
+from config import BROADCAST_RATE, BROADCAST_CONCURRENCY, BROADCAST_CHUNK_SIZE
+from migrations import apply_migrations
+from metrics import latency
+from flood_control import flood_control, TokenBucket, PRIORITY_BULK
+from sharding import owns_user
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_MIGRATIONS = [
+    [
+        # status: running, done or cancelled; cursor is the last users.user_id queued
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            character_id TEXT,
+            created_by INTEGER,
+            audience INTEGER DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'running',
+            cursor INTEGER NOT NULL DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            finished_at DATETIME
+        )
+        """,
+        # status: pending, sent, blocked (bot blocked or account deleted) or failed
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            broadcast_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            error TEXT,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (broadcast_id, user_id)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_broadcast_recipients_status ON broadcast_recipients (broadcast_id, status, user_id)"
+    ]
+]
+
+# Broadcasts never take more than this share of the process's global send limit,
+# the rest is left for replies (which also go first, broadcasts have the lowest priority)
+MAX_GLOBAL_SHARE = 2 / 3
+# Recipient results written to SQLite at once
+FLUSH_SIZE = 100
+# Seconds between progress lines in the log
+PROGRESS_LOG_INTERVAL = 30.0
+# Distinct error messages listed in a report
+REPORT_TOP_ERRORS = 3
+
+def character_announcement(char: Dict) -> str:
+    """Announcement text for a new character"""
+    return (
+        f"✨ New character: {char['name']} ({char['role']})\n\n"
+        f"{char['description']}\n\n"
+        f"Tap below to start chatting with {char['name']}! 💕"
+    )
+
+def format_report(report: Dict) -> str:
+    """Human-readable broadcast progress (for the admin command and the final notice)"""
+    counts = report["counts"]
+    done = counts.get("sent", 0) + counts.get("blocked", 0) + counts.get("failed", 0)
+    lines = [
+        f"📣 Broadcast #{report['id']} ({report['status']})",
+        f"Recipients: {done}/{report['audience']} processed",
+        f"✅ Sent: {counts.get('sent', 0)}",
+        f"🚫 Blocked: {counts.get('blocked', 0)}",
+        f"⚠️ Failed: {counts.get('failed', 0)}"
+    ]
+    if report.get("rate"):
+        lines.append(f"⏱ {report['rate']:.1f} msgs/s over {report['elapsed']:.0f}s")
+    for error, count in report["errors"]:
+        lines.append(f"  - {error}: {count}")
+    return "\n".join(lines)
+
+class BroadcastEngine:
+    """Sends a message to every user without starving live traffic
+    
+    Recipients are read from the users table in user_id order, one chunk at a
+    time (keyset pagination, so no large OFFSET scans or result sets), and
+    recorded in broadcast_recipients before they are sent. Worker tasks send
+    with the lowest flood-control priority through a bucket capped below the
+    global limit. Results are written in batches, so after a crash or restart
+    the broadcast continues where it stopped; only messages in flight at that
+    moment may be sent twice.
+    """
+    
+    def __init__(self, db_path: str = "sextbot.db", rate: float = BROADCAST_RATE,
+                 concurrency: int = BROADCAST_CONCURRENCY, chunk_size: int = BROADCAST_CHUNK_SIZE):
+        self.db_path = db_path
+        self.rate = rate
+        self.concurrency = max(1, concurrency)
+        self.chunk_size = max(1, chunk_size)
+        self.task: Optional[asyncio.Task] = None
+        self.broadcast_id: Optional[int] = None
+        # Counters of the current (or last) run in this process
+        self.run: Dict = {}
+        self.send_latency = latency("broadcast_send")
+    
+    def init_database(self):
+        """Create the broadcast tables"""
+        apply_migrations(self.db_path, "broadcast", BROADCAST_MIGRATIONS)
+    
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+    
+    def create(self, text: str, created_by: int, character_id: str = None) -> int:
+        """Record a new broadcast to all current users, returns its id"""
+        conn = self._connect()
+        audience = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        cursor = conn.execute(
+            "INSERT INTO broadcasts (text, character_id, created_by, audience) VALUES (?, ?, ?, ?)",
+            (text, character_id, created_by, audience)
+        )
+        conn.commit()
+        conn.close()
+        return cursor.lastrowid
+    
+    def _get_broadcast(self, broadcast_id: int) -> Optional[Dict]:
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        row = conn.execute("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()
+        conn.close()
+        return dict(row) if row else None
+    
+    def _set_status(self, broadcast_id: int, status: str):
+        conn = self._connect()
+        conn.execute(
+            "UPDATE broadcasts SET status = ?, finished_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (status, broadcast_id)
+        )
+        conn.commit()
+        conn.close()
+    
+    def _pending_chunk(self, broadcast_id: int, after: int) -> List[int]:
+        """Recipients queued but not sent before the last stop"""
+        conn = self._connect()
+        rows = conn.execute("""
+            SELECT user_id FROM broadcast_recipients
+            WHERE broadcast_id = ? AND status = 'pending' AND user_id > ?
+            ORDER BY user_id LIMIT ?
+        """, (broadcast_id, after, self.chunk_size)).fetchall()
+        conn.close()
+        return [row[0] for row in rows]
+    
+    def _claim_chunk(self, broadcast_id: int) -> List[int]:
+        """Queue the next users after the broadcast's cursor and advance it"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            position = conn.execute("SELECT cursor FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()[0]
+            user_ids = [row[0] for row in conn.execute(
+                "SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                (position, self.chunk_size)
+            )]
+            if user_ids:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO broadcast_recipients (broadcast_id, user_id) VALUES (?, ?)",
+                    [(broadcast_id, user_id) for user_id in user_ids]
+                )
+                conn.execute("UPDATE broadcasts SET cursor = ? WHERE id = ?", (user_ids[-1], broadcast_id))
+            conn.commit()
+            return user_ids
+        finally:
+            conn.close()
+    
+    def _record_results(self, broadcast_id: int, results: List[tuple]):
+        """Store (user_id, status, error) results"""
+        conn = self._connect()
+        conn.executemany("""
+            UPDATE broadcast_recipients SET status = ?, error = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE broadcast_id = ? AND user_id = ?
+        """, [(status, error, broadcast_id, user_id) for user_id, status, error in results])
+        conn.commit()
+        conn.close()
+    
+    async def _recipients(self, broadcast_id: int) -> AsyncIterator[int]:
+        """Leftover recipients of an interrupted run first, then new chunks of users"""
+        after = 0
+        while True:
+            chunk = await asyncio.to_thread(self._pending_chunk, broadcast_id, after)
+            if not chunk:
+                break
+            for user_id in chunk:
+                yield user_id
+            after = chunk[-1]
+        while True:
+            chunk = await asyncio.to_thread(self._claim_chunk, broadcast_id)
+            if not chunk:
+                break
+            for user_id in chunk:
+                yield user_id
+    
+    def start(self, app: Application, broadcast_id: int) -> bool:
+        """Run a broadcast in the background (one at a time), False if one is running"""
+        if self.is_running():
+            return False
+        self.broadcast_id = broadcast_id
+        self.task = asyncio.create_task(self._run(app, broadcast_id))
+        return True
+    
+    def is_running(self) -> bool:
+        return self.task is not None and not self.task.done()
+    
+    async def resume(self, app: Application):
+        """Continue a broadcast interrupted by the last stop (in the process that started it)"""
+        conn = self._connect()
+        rows = conn.execute("SELECT id, created_by FROM broadcasts WHERE status = 'running' ORDER BY id").fetchall()
+        conn.close()
+        for broadcast_id, created_by in rows:
+            if owns_user(created_by or 0):
+                logger.info(f"Resuming broadcast {broadcast_id}")
+                self.start(app, broadcast_id)
+                # Later ones start when the admin asks again
+                return
+    
+    def cancel(self) -> Optional[int]:
+        """Stop the running broadcast for good, returns its id"""
+        if not self.is_running():
+            return None
+        self._set_status(self.broadcast_id, "cancelled")
+        self.task.cancel()
+        return self.broadcast_id
+    
+    async def stop(self):
+        """Interrupt the running broadcast at shutdown (it resumes on the next start)"""
+        if self.is_running():
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+    
+    async def _run(self, app: Application, broadcast_id: int):
+        broadcast = await asyncio.to_thread(self._get_broadcast, broadcast_id)
+        if broadcast is None or broadcast["status"] != "running":
+            return
+        
+        markup = None
+        if broadcast["character_id"]:
+            url = f"https://t.me/{app.bot.username}?start=char_{broadcast['character_id']}"
+            markup = InlineKeyboardMarkup([[InlineKeyboardButton("💬 Start chatting", url=url)]])
+        
+        # Capped below this process's share of the global limit (smaller when sharded)
+        bucket = TokenBucket(min(self.rate, flood_control.global_bucket.rate * MAX_GLOBAL_SHARE), 1)
+        self.run = {"id": broadcast_id, "started": time.monotonic(), "sent": 0, "blocked": 0, "failed": 0}
+        errors = Counter()
+        results = []
+        queue = asyncio.Queue(maxsize=self.chunk_size)
+        
+        async def send_one(user_id: int):
+            wait = bucket.reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            started = time.monotonic()
+            try:
+                await app.bot.send_message(user_id, broadcast["text"], reply_markup=markup, rate_limit_args=PRIORITY_BULK)
+                status, error = "sent", None
+            except Forbidden as e:
+                status, error = "blocked", e.message
+            except TelegramError as e:
+                # BadRequest (chat not found, ...), or still flood-limited after the retries
+                status, error = "failed", e.message
+            except Exception as e:
+                logger.error(f"Broadcast {broadcast_id} to user {user_id} failed: {e}")
+                status, error = "failed", str(e)
+            self.send_latency.record(time.monotonic() - started)
+            self.run[status] += 1
+            if error:
+                errors[error] += 1
+            results.append((user_id, status, error))
+        
+        async def worker():
+            while True:
+                user_id = await queue.get()
+                try:
+                    await send_one(user_id)
+                finally:
+                    queue.task_done()
+        
+        async def flush():
+            if results:
+                batch = results[:]
+                del results[:]
+                await asyncio.to_thread(self._record_results, broadcast_id, batch)
+        
+        logger.info(f"Broadcast {broadcast_id} started ({broadcast['audience']} users, {bucket.rate:.1f} msgs/s max)")
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        last_log = time.monotonic()
+        finished = False
+        try:
+            async for user_id in self._recipients(broadcast_id):
+                await queue.put(user_id)
+                if len(results) >= FLUSH_SIZE:
+                    await flush()
+                if time.monotonic() - last_log >= PROGRESS_LOG_INTERVAL:
+                    last_log = time.monotonic()
+                    logger.info(f"Broadcast {broadcast_id}: {self._progress()}")
+            await queue.join()
+            finished = True
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            # Keep what was sent even when cancelled, so a resumed run skips it
+            await asyncio.shield(flush())
+        
+        if finished:
+            await asyncio.to_thread(self._set_status, broadcast_id, "done")
+            report = await asyncio.to_thread(self.get_report, broadcast_id)
+            logger.info(f"Broadcast {broadcast_id} finished: {self._progress()}, errors: {dict(errors.most_common(REPORT_TOP_ERRORS))}")
+            if broadcast["created_by"]:
+                try:
+                    await app.bot.send_message(broadcast["created_by"], format_report(report))
+                except TelegramError as e:
+                    logger.warning(f"Could not send the broadcast report: {e}")
+    
+    def _progress(self) -> str:
+        elapsed = time.monotonic() - self.run["started"]
+        done = self.run["sent"] + self.run["blocked"] + self.run["failed"]
+        return (
+            f"{self.run['sent']} sent, {self.run['blocked']} blocked, {self.run['failed']} failed "
+            f"in {elapsed:.0f}s ({done / elapsed if elapsed else 0:.1f} msgs/s)"
+        )
+    
+    def get_report(self, broadcast_id: int = None) -> Optional[Dict]:
+        """Recipient counts by status and the commonest errors of a broadcast (default: the latest)"""
+        conn = self._connect()
+        if broadcast_id is None:
+            row = conn.execute("SELECT MAX(id) FROM broadcasts").fetchone()
+            broadcast_id = row[0]
+        row = conn.execute("SELECT status, audience FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()
+        if row is None:
+            conn.close()
+            return None
+        counts = dict(conn.execute("""
+            SELECT status, COUNT(*) FROM broadcast_recipients WHERE broadcast_id = ? GROUP BY status
+        """, (broadcast_id,)).fetchall())
+        top_errors = conn.execute("""
+            SELECT error, COUNT(*) FROM broadcast_recipients
+            WHERE broadcast_id = ? AND error IS NOT NULL
+            GROUP BY error ORDER BY COUNT(*) DESC LIMIT ?
+        """, (broadcast_id, REPORT_TOP_ERRORS)).fetchall()
+        conn.close()
+        
+        report = {"id": broadcast_id, "status": row[0], "audience": row[1], "counts": counts, "errors": top_errors}
+        if self.run.get("id") == broadcast_id:
+            # Throughput of this process's run (since the last resume)
+            elapsed = time.monotonic() - self.run["started"]
+            done = self.run["sent"] + self.run["blocked"] + self.run["failed"]
+            report["elapsed"] = elapsed
+            report["rate"] = done / elapsed if elapsed else 0.0
+        return report
+    
+    def get_stats(self) -> Dict:
+        """Counters of the current or last run and send latency"""
+        stats = {key: value for key, value in self.run.items() if key != "started"}
+        stats["running"] = self.is_running()
+        stats["send"] = self.send_latency.summary()
+        return stats
+
+# Global broadcast engine (resumed from bot.on_startup)
+broadcast_engine = BroadcastEngine()
@@ -0,0 +1,152 @@
+import re
+import bisect
+import logging
+from collections import OrderedDict
+from typing import List, Dict, Tuple
+from ai_models import ai_model_manager
+
+logger = logging.getLogger(__name__)
+
+# Field weights used for ranking matches
+FIELD_WEIGHTS = {
+    "name": 5.0,
+    "role": 3.0,
+    "tier": 2.0,
+    "region": 2.0,
+    "language": 2.0,
+    "description": 1.0
+}
+
+# Query filters in the form "key:value" (e.g. "lang:hindi tier:free")
+FILTER_ALIASES = {
+    "name": "name",
+    "role": "role",
+    "tier": "tier",
+    "region": "region",
+    "lang": "language",
+    "language": "language"
+}
+
+# Prefix matches score lower than exact token matches
+PREFIX_MATCH_FACTOR = 0.5
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def tokenize(text) -> List[str]:
+    """Split text into lowercase alphanumeric tokens"""
+    return TOKEN_RE.findall(str(text).lower())
+
+class CharacterSearchIndex:
+    def __init__(self, characters: List[Dict], cache_size: int = 256):
+        self.characters = characters
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self.build()
+
+    def build(self):
+        """Build the inverted index over the character catalog"""
+        # token -> {character ordinal: score}, one posting map per field
+        self.postings = {field: {} for field in FIELD_WEIGHTS}
+        # token -> {character ordinal: score} across all fields
+        self.combined = {}
+
+        for ordinal, char in enumerate(self.characters):
+            for field, weight in FIELD_WEIGHTS.items():
+                for token in set(tokenize(self._field_value(char, field))):
+                    field_postings = self.postings[field].setdefault(token, {})
+                    field_postings[ordinal] = weight
+                    combined_postings = self.combined.setdefault(token, {})
+                    combined_postings[ordinal] = combined_postings.get(ordinal, 0.0) + weight
+
+        # Sorted vocabularies make prefix lookups a bisect + range scan
+        self.vocabulary = sorted(self.combined)
+        self.field_vocabulary = {field: sorted(tokens) for field, tokens in self.postings.items()}
+        self._cache.clear()
+        logger.info(f"Character search index built: {len(self.characters)} characters, {len(self.vocabulary)} tokens")
+
+    def _field_value(self, char: Dict, field: str) -> str:
+        """Get the indexed text for a character field"""
+        if field == "tier":
+            # Index tier name plus "free"/"locked" so users can filter by price tier
+            tier = ai_model_manager._get_tier_name(char.get("price_stars", 0))
+            return f"{tier} {'locked' if char.get('is_locked') else 'free'}"
+        return char.get(field, "")
+
+    def _expand_prefix(self, vocabulary: List[str], prefix: str) -> List[str]:
+        """Get all tokens in a sorted vocabulary starting with prefix"""
+        start = bisect.bisect_left(vocabulary, prefix)
+        end = bisect.bisect_left(vocabulary, prefix + "\uffff")
+        return vocabulary[start:end]
+
+    def _match_term(self, term: str, field: str = None) -> Dict[int, float]:
+        """Score characters matching a single query term"""
+        if field:
+            vocabulary = self.field_vocabulary[field]
+            postings = self.postings[field]
+        else:
+            vocabulary = self.vocabulary
+            postings = self.combined
+
+        scores = {}
+        for token in self._expand_prefix(vocabulary, term):
+            factor = 1.0 if token == term else PREFIX_MATCH_FACTOR
+            for ordinal, score in postings[token].items():
+                scores[ordinal] = max(scores.get(ordinal, 0.0), score * factor)
+        return scores
+
+    def _parse_query(self, query: str) -> Tuple[List[str], List[Tuple[str, str]], int]:
+        """Split a query into free-text terms, field filters and a price ceiling"""
+        terms = []
+        filters = []
+        max_price = None
+
+        for part in query.lower().split():
+            key, sep, value = part.partition(":")
+            if sep and key == "max" and value.isdigit():
+                max_price = int(value)
+            elif sep and key in FILTER_ALIASES:
+                filters.extend((FILTER_ALIASES[key], token) for token in tokenize(value))
+            else:
+                terms.extend(tokenize(part))
+
+        return terms, filters, max_price
+
+    def search(self, query: str) -> Tuple[int, ...]:
+        """Get ranked character ordinals matching a query"""
+        key = " ".join(query.lower().split())
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        terms, filters, max_price = self._parse_query(key)
+
+        # Every term and filter must match (AND semantics); scores add up
+        candidates = None
+        scores = {}
+        for term, field in [(t, None) for t in terms] + [(v, f) for f, v in filters]:
+            matches = self._match_term(term, field)
+            candidates = set(matches) if candidates is None else candidates & set(matches)
+            if not candidates:
+                break
+            for ordinal, score in matches.items():
+                scores[ordinal] = scores.get(ordinal, 0.0) + score
+
+        if candidates is None:
+            candidates = set(range(len(self.characters)))
+        if max_price is not None:
+            candidates = {o for o in candidates if self.characters[o].get("price_stars", 0) <= max_price}
+
+        # Highest score first, catalog order breaks ties
+        result = tuple(sorted(candidates, key=lambda o: (-scores.get(o, 0.0), o)))
+
+        self._cache[key] = result
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+    def search_characters(self, query: str, offset: int = 0, limit: int = 20) -> Tuple[List[Dict], int]:
+        """Get a page of matching characters and the next offset (0 when exhausted)"""
+        ordinals = self.search(query)
+        page = [self.characters[o] for o in ordinals[offset:offset + limit]]
+        next_offset = offset + limit if offset + limit < len(ordinals) else 0
+        return page, next_offset
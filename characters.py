@@ -5,14 +5,27 @@ from typing import List, Dict, Optional
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes
 from ai_models import ai_model_manager
+from character_search import CharacterSearchIndex
+from entitlements import EntitlementService
 
 logger = logging.getLogger(__name__)
 
 class CharacterManager:
     def __init__(self, db_path: str = "sextbot.db"):
         self.db_path = db_path
+        # Filled in by initialize()
+        self.characters: List[Dict] = []
+        self.characters_by_id: Dict[str, Dict] = {}
+        self.search_index: CharacterSearchIndex = None
+        self.entitlements: EntitlementService = None
+    
+    def initialize(self):
+        """Load the catalog, build the search index and create tables (called from startup)"""
         self.characters = self.load_characters()
+        self.characters_by_id = {char["id"]: char for char in self.characters}
+        self.search_index = CharacterSearchIndex(self.characters)
         self.init_database()
+        self.entitlements = EntitlementService(self.characters, self.db_path)
     
     def load_characters(self) -> List[Dict]:
         """Load characters from JSON file"""
@@ -50,50 +63,23 @@ class CharacterManager:
             )
         """)
         
-        # Table for Telegram Stars transactions
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS stars_transactions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                character_id TEXT,
-                stars_amount INTEGER,
-                telegram_payment_charge_id TEXT,
-                status TEXT DEFAULT 'pending',
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+        # Telegram Stars transactions live in stars_payment.py (versioned ledger)
         
         conn.commit()
         conn.close()
     
     def get_character_by_id(self, character_id: str) -> Optional[Dict]:
         """Get character by ID"""
-        for char in self.characters:
-            if char["id"] == character_id:
-                return char
-        return None
+        return self.characters_by_id.get(character_id)
+    
+    def search_characters(self, query: str, offset: int = 0, limit: int = 20):
+        """Search characters for inline mode, returns (characters, next_offset)"""
+        return self.search_index.search_characters(query, offset, limit)
     
     def is_character_unlocked(self, user_id: int, character_id: str) -> bool:
         """Check if user has unlocked a character"""
-        char = self.get_character_by_id(character_id)
-        if not char:
-            return False
-        
-        # Free characters are always unlocked
-        if not char["is_locked"]:
-            return True
-        
-        # Check database for paid unlocks
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT 1 FROM character_unlocks WHERE user_id = ? AND character_id = ?",
-            (user_id, character_id)
-        )
-        result = cursor.fetchone()
-        conn.close()
-        
-        return result is not None
+        # Free characters and paid unlocks, answered from memory
+        return self.entitlements.has_character(user_id, character_id)
     
     def unlock_character(self, user_id: int, character_id: str) -> bool:
         """Unlock a character for a user"""
@@ -112,6 +98,7 @@ class CharacterManager:
             conn.commit()
             success = cursor.rowcount > 0
             conn.close()
+            self.entitlements.apply_event("character_unlock", user_id, character_id)
             return success
         except Exception as e:
             logger.error(f"Error unlocking character: {e}")
@@ -170,9 +157,10 @@ class CharacterManager:
         
         keyboard = []
         
+        active_char = self.get_active_character(user_id)
+        
         for char in current_chars:
             is_unlocked = self.is_character_unlocked(user_id, char["id"])
-            active_char = self.get_active_character(user_id)
             is_active = active_char and active_char["id"] == char["id"]
             
             # Create button text
@@ -226,9 +214,10 @@ class CharacterManager:
         message = "🌟 **Choose Your AI Girlfriend** 🌟\n\n"
         message += f"Page {page + 1} of {(len(self.characters) + chars_per_page - 1) // chars_per_page}\n\n"
         
+        active_char = self.get_active_character(user_id)
+        
         for char in current_chars:
             is_unlocked = self.is_character_unlocked(user_id, char["id"])
-            active_char = self.get_active_character(user_id)
             is_active = active_char and active_char["id"] == char["id"]
             
             status_emoji = "✅" if is_unlocked else "🔒"
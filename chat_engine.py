@@ -1,12 +1,20 @@
+import time
+import logging
 import requests
-from config import OPENROUTER_API_KEY
-from memory import get_last_messages, get_persona
+from config import OPENROUTER_API_KEY, OPENROUTER_API_URL, LLM_TIMEOUT
+from memory import get_last_messages, get_persona, get_history_summary
 from ai_models import ai_model_manager
+from token_usage import token_usage_tracker
+
+logger = logging.getLogger(__name__)
 
 def build_prompt(user_id, character_prompt=None):
     persona = get_persona(user_id) or "Sweet"
     messages = get_last_messages(user_id)
     history = "\n".join([f"User: {m[0]}" if m[1] else f"Bot: {m[0]}" for m in messages])
+    summary = get_history_summary(user_id)
+    if summary:
+        history = f"(Earlier: {summary})\n{history}"
 
     # Use character-specific prompt if provided, otherwise use default persona
     if character_prompt:
@@ -24,7 +32,7 @@ Reply as the girlfriend:
 """
     return prompt
 
-def get_llm_reply(prompt, character_price=0):
+def get_llm_reply(prompt, character_price=0, user_id=None, character_id=None):
     """Get LLM reply using appropriate model based on character price"""
     try:
         # Check if API key is set
@@ -32,9 +40,10 @@ def get_llm_reply(prompt, character_price=0):
             return "Sorry, I'm having trouble connecting to my brain right now. Please check my configuration! 😔"
         
         # Get model configuration based on character price
-        model_config = ai_model_manager.get_model_for_character(character_price)
+        model_config = ai_model_manager.get_model_for_character(character_price, user_id)
         
-        response = requests.post("https://openrouter.ai/api/v1/chat/completions", json={
+        started = time.monotonic()
+        response = requests.post(OPENROUTER_API_URL, json={
             "model": model_config["model"],
             "messages": [{"role": "user", "content": prompt}],
             "max_tokens": model_config["max_tokens"],
@@ -42,30 +51,85 @@ def get_llm_reply(prompt, character_price=0):
         }, headers={
             "Authorization": f"Bearer {OPENROUTER_API_KEY}",
             "Content-Type": "application/json"
-        })
+        }, timeout=LLM_TIMEOUT)
+        latency_ms = int((time.monotonic() - started) * 1000)
         
         # Check if request was successful
         if response.status_code != 200:
-            print(f"API Error: Status {response.status_code}")
-            print(f"Response: {response.text}")
+            logger.error(f"API error: status {response.status_code}", extra={"user_id": user_id, "response": response.text[:500]})
             return f"Sorry, I'm having technical difficulties right now. Error: {response.status_code}"
         
         response_data = response.json()
         
         # Check if response has the expected structure
         if 'choices' not in response_data or not response_data['choices']:
-            print(f"Unexpected API response format: {response_data}")
+            logger.error("Unexpected API response format", extra={"user_id": user_id, "response": str(response_data)[:500]})
             return "Sorry, I received an unexpected response from my brain. Please try again!"
         
+        # Record token usage for accounting and adaptive max_tokens
+        usage = response_data.get('usage') or {}
+        if user_id is not None and usage:
+            token_usage_tracker.record_usage(
+                user_id, character_id, model_config["model"],
+                usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0),
+                latency_ms, model_config["max_tokens"],
+                truncated=response_data['choices'][0].get('finish_reason') == 'length'
+            )
+        
         return response_data['choices'][0]['message']['content']
         
     except requests.exceptions.RequestException as e:
-        print(f"Request error: {e}")
+        logger.error(f"Request error: {e}", extra={"user_id": user_id})
         return "Sorry, I'm having trouble connecting to my brain right now. Please try again later! 😔"
     except KeyError as e:
-        print(f"KeyError in response parsing: {e}")
-        print(f"Response data: {response_data if 'response_data' in locals() else 'No response data'}")
+        logger.error(
+            f"KeyError in response parsing: {e}",
+            extra={"user_id": user_id, "response": str(response_data)[:500] if 'response_data' in locals() else None}
+        )
         return "Sorry, I'm having trouble processing my response. Please try again!"
     except Exception as e:
-        print(f"Unexpected error: {e}")
-        return "Sorry, something unexpected happened. Please try again!"
\ No newline at end of file
+        logger.exception(f"Unexpected error: {e}", extra={"user_id": user_id})
+        return "Sorry, something unexpected happened. Please try again!"
+
+# Off-peak history summaries (maintenance.py)
+SUMMARY_MAX_TOKENS = 300
+SUMMARY_TEMPERATURE = 0.3
+
+def summarize_history(previous_summary, messages):
+    """Condense older chat messages (and the previous summary) into a short summary
+    
+    Returns None if the request fails; the caller retries in a later window.
+    """
+    if not OPENROUTER_API_KEY:
+        return None
+    
+    history = "\n".join([f"User: {m[0]}" if m[1] else f"Bot: {m[0]}" for m in messages])
+    prompt = f"""
+Summarize this conversation in at most 5 sentences. Keep names, facts about the
+user, preferences and open topics; leave out greetings and small talk.
+
+Previous summary:
+{previous_summary or "(none)"}
+
+Conversation:
+{history}
+
+Summary:
+"""
+    try:
+        response = requests.post(OPENROUTER_API_URL, json={
+            "model": ai_model_manager.get_model_for_character(0)["model"],
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": SUMMARY_MAX_TOKENS,
+            "temperature": SUMMARY_TEMPERATURE
+        }, headers={
+            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+            "Content-Type": "application/json"
+        }, timeout=LLM_TIMEOUT)
+        if response.status_code != 200:
+            logger.warning(f"Summary API error: status {response.status_code}")
+            return None
+        return response.json()['choices'][0]['message']['content'].strip() or None
+    except (requests.exceptions.RequestException, KeyError, IndexError, ValueError) as e:
+        logger.warning(f"Summary request error: {e}")
+        return None
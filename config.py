@@ -4,4 +4,70 @@ from dotenv import load_dotenv
 load_dotenv()
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
\ No newline at end of file
+OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+
+# API endpoints, overridable to point the bot at local stand-ins (benchmarks/fake_telegram.py)
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "https://api.telegram.org/bot")
+OPENROUTER_API_URL = os.getenv("OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions")
+
+# OCR worker pool for payment screenshots
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+OCR_TIMEOUT = float(os.getenv("OCR_TIMEOUT", "15"))  # Seconds per screenshot
+OCR_MAX_QUEUE = int(os.getenv("OCR_MAX_QUEUE", "32"))  # Max screenshots waiting or running
+
+# Telegram user IDs allowed to use admin commands such as /stats (comma separated)
+ADMIN_USER_IDS = {int(user_id) for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip()}
+
+# Run mode: "polling" (default) or "webhook" (local HTTP server behind nginx)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # Public HTTPS base URL; empty = don't register (local testing)
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8081"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # 1-256 chars: A-Z, a-z, 0-9, _ and -
+WEBHOOK_MAX_BODY = int(os.getenv("WEBHOOK_MAX_BODY", str(1024 * 1024)))  # Bytes
+
+# Users whose updates are processed at the same time (each user's own updates stay in order)
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "16"))
+
+# Seconds between writes of changed conversation/user data to SQLite
+PERSISTENCE_FLUSH_INTERVAL = float(os.getenv("PERSISTENCE_FLUSH_INTERVAL", "10"))
+
+# Off-peak maintenance window (archiving, summaries, ANALYZE, cache warming)
+MAINTENANCE_TIME = os.getenv("MAINTENANCE_TIME", "03:30")  # HH:MM window start
+MAINTENANCE_TIMEZONE = os.getenv("MAINTENANCE_TIMEZONE", "UTC")
+MAINTENANCE_HOURS = float(os.getenv("MAINTENANCE_HOURS", "3"))
+# Maintenance pauses while more updates than this are being processed
+MAINTENANCE_MAX_IN_FLIGHT = int(os.getenv("MAINTENANCE_MAX_IN_FLIGHT", "2"))
+
+# Announcements to all users: messages/second at most (also capped below the global
+# limit), concurrent sends, and users read from the database at a time
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "20"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "8"))
+BROADCAST_CHUNK_SIZE = int(os.getenv("BROADCAST_CHUNK_SIZE", "500"))
+
+# Opt-in anonymized traffic recording for benchmarks/replay_traffic.py (off when empty);
+# set the salt to keep user and text hashes comparable across recordings
+TRAFFIC_RECORD_PATH = os.getenv("TRAFFIC_RECORD_PATH", "")
+TRAFFIC_RECORD_SALT = os.getenv("TRAFFIC_RECORD_SALT", "")
+
+# Admin /profile output folder and sampling interval (seconds); event-loop stalls
+# longer than LOOP_STALL_THRESHOLD seconds are logged with their stack (0 turns it off)
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+LOOP_STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD", "0.25"))
+
+# Log level, output format ("json" lines or "text") and per-logger sampling of
+# DEBUG/INFO records ("logger=fraction kept", comma separated; warnings always pass)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "httpx=0.01")
+
+# Worker processes; above 1 an ingress process receives updates and hands each
+# user's updates to one worker (chosen by user id), so all CPU cores are used
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "1"))
+
+# Seconds to wait for in-flight replies when stopping (keep below systemd's TimeoutStopSec)
+SHUTDOWN_GRACE_SECONDS = float(os.getenv("SHUTDOWN_GRACE_SECONDS", "25"))
+# Seconds before an OpenRouter request is abandoned
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
@@ -69,6 +69,26 @@ DATABASE_PATH=./bot_data.db
 # Logging Configuration
 LOG_LEVEL=INFO
 LOG_FILE=./bot.log
+
+# OCR worker pool (payment screenshots)
+OCR_WORKERS=2
+OCR_TIMEOUT=15
+OCR_MAX_QUEUE=32
+
+# Users whose messages are processed at the same time
+UPDATE_CONCURRENCY=16
+
+# Worker processes (1 = single process; more spreads users over CPU cores)
+SHARD_WORKERS=1
+
+# Admin commands (/stats), comma separated Telegram user IDs
+ADMIN_USER_IDS=
+
+# Run mode: polling or webhook (webhook needs a public HTTPS URL pointing at nginx)
+BOT_MODE=polling
+WEBHOOK_URL=
+WEBHOOK_PORT=8081
+WEBHOOK_SECRET=$(openssl rand -hex 32)
 EOF
     print_warning "Created .env file. Please edit it with your actual API keys!"
     chmod 600 .env
@@ -112,6 +132,13 @@ server {
         add_header Cache-Control "public, immutable";
     }
 
+    # Telegram webhook (BOT_MODE=webhook), forwarded to the bot's local server
+    location /telegram {
+        proxy_pass http://127.0.0.1:8081;
+        client_max_body_size 1m;
+        proxy_read_timeout 30s;
+    }
+
     # Health check endpoint
     location /health {
         return 200 "OK";
@@ -0,0 +1,90 @@
+import sqlite3
+import logging
+from typing import List, Dict, Set
+from payment import upi_payment_store
+
+logger = logging.getLogger(__name__)
+
+class EntitlementService:
+    """Paid users and character unlocks kept in memory for O(1) access checks
+    
+    Unlocks are stored per user as an int bitset indexed by the character's
+    position in characters.json. The database stays the source of truth; the
+    service is loaded once and then kept current through apply_event().
+    """
+    
+    def __init__(self, characters: List[Dict], db_path: str = "sextbot.db"):
+        self.db_path = db_path
+        self.ordinals = {char["id"]: i for i, char in enumerate(characters)}
+        # Characters anyone can chat with
+        self.free_mask = 0
+        for i, char in enumerate(characters):
+            if not char["is_locked"]:
+                self.free_mask |= 1 << i
+        self.paid_users: Set[int] = None
+        self.unlocks: Dict[int, int] = {}
+    
+    def load(self):
+        """Load paid users and unlocks from all sources once"""
+        if self.paid_users is not None:
+            return
+        
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        # Stars unlimited access (memory.py)
+        cursor.execute("SELECT user_id FROM users WHERE paid = 1")
+        paid_users = {row[0] for row in cursor.fetchall()}
+        
+        # Character unlocks (characters.py)
+        cursor.execute("SELECT user_id, character_id FROM character_unlocks")
+        for user_id, character_id in cursor.fetchall():
+            self._set_unlock(user_id, character_id)
+        conn.close()
+        
+        # UPI payments (payment.py)
+        upi_payment_store.load()
+        paid_users |= upi_payment_store.paid
+        
+        self.paid_users = paid_users
+        logger.info(f"Entitlements loaded: {len(self.paid_users)} paid users, {len(self.unlocks)} users with unlocks")
+    
+    def _set_unlock(self, user_id: int, character_id: str):
+        ordinal = self.ordinals.get(character_id)
+        if ordinal is None:
+            logger.warning(f"Unlock for unknown character {character_id} (user {user_id})")
+            return
+        self.unlocks[user_id] = self.unlocks.get(user_id, 0) | (1 << ordinal)
+    
+    def apply_event(self, event_type: str, user_id: int, character_id: str = None):
+        """Apply a payment event that has already been committed to the database"""
+        self.load()
+        if event_type in ("unlimited_access", "upi_paid"):
+            self.paid_users.add(user_id)
+        elif event_type == "character_unlock":
+            self._set_unlock(user_id, character_id)
+        else:
+            logger.warning(f"Unknown entitlement event: {event_type}")
+    
+    def is_paid(self, user_id: int) -> bool:
+        """Check if user has unlimited messages (Stars or UPI)"""
+        self.load()
+        return user_id in self.paid_users
+    
+    def has_character(self, user_id: int, character_id: str) -> bool:
+        """Check if a character is free or unlocked by the user"""
+        self.load()
+        ordinal = self.ordinals.get(character_id)
+        if ordinal is None:
+            return False
+        return bool((self.free_mask | self.unlocks.get(user_id, 0)) >> ordinal & 1)
+    
+    def can_chat(self, user_id: int, character_id: str, message_count: int, free_message_limit: int) -> bool:
+        """Check if user can send another message to a character on its tier
+        
+        character_id None is the default persona (no character chosen), which
+        anyone can chat with.
+        """
+        if character_id is not None and not self.has_character(user_id, character_id):
+            return False
+        return self.is_paid(user_id) or message_count < free_message_limit
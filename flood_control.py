@@ -0,0 +1,217 @@
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from datetime import timedelta
+from typing import Any, Callable, Coroutine, Dict, Optional, Union
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from metrics import latency
+
+logger = logging.getLogger(__name__)
+
+# Request priorities (lower is sent first), passed as rate_limit_args=...
+PRIORITY_PAYMENT = 0  # Invoices and payment confirmations
+PRIORITY_REPLY = 1    # Direct replies to a user's message
+PRIORITY_DEFAULT = 2
+PRIORITY_MENU = 3     # Menu edits, can wait behind everything else
+PRIORITY_BULK = 4     # Broadcasts, only sent when nothing else is waiting
+PRIORITY_NAMES = {
+    PRIORITY_PAYMENT: "payment", PRIORITY_REPLY: "reply", PRIORITY_DEFAULT: "default",
+    PRIORITY_MENU: "menu", PRIORITY_BULK: "bulk"
+}
+
+# Telegram's documented limits: ~30 messages/second overall, ~1/second per
+# private chat (short bursts are tolerated) and 20/minute per group
+GLOBAL_RATE = 30.0
+GLOBAL_BURST = 30
+PRIVATE_CHAT_RATE = 1.0
+PRIVATE_CHAT_BURST = 3
+GROUP_CHAT_RATE = 20 / 60
+GROUP_CHAT_BURST = 5
+
+# Endpoints that count against the message limits; everything else (getUpdates,
+# answerCallbackQuery, answerPreCheckoutQuery, ...) is sent right away
+LIMITED_ENDPOINTS = {
+    "sendMessage", "sendPhoto", "sendDocument", "sendVideo", "sendAnimation", "sendAudio",
+    "sendVoice", "sendSticker", "sendMediaGroup", "sendInvoice", "copyMessage", "forwardMessage",
+    "editMessageText", "editMessageCaption", "editMessageMedia", "editMessageReplyMarkup"
+}
+ENDPOINT_PRIORITIES = {
+    "sendInvoice": PRIORITY_PAYMENT,
+    "editMessageText": PRIORITY_MENU,
+    "editMessageCaption": PRIORITY_MENU,
+    "editMessageMedia": PRIORITY_MENU,
+    "editMessageReplyMarkup": PRIORITY_MENU
+}
+
+MAX_RETRIES = 3
+# Drop idle per-chat buckets once this many are tracked
+MAX_CHAT_BUCKETS = 10000
+
+class TokenBucket:
+    """Token bucket that hands out reservations, so concurrent callers never oversubscribe it"""
+    
+    __slots__ = ("rate", "capacity", "tokens", "updated", "paused_until")
+    
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+    
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def delay(self) -> float:
+        """Seconds until a token is available"""
+        now = time.monotonic()
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.paused_until - now)
+    
+    def reserve(self) -> float:
+        """Take a token (possibly in advance) and return how long to wait before using it"""
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+        return max(wait, self.paused_until - now)
+    
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+    
+    def idle(self) -> bool:
+        now = time.monotonic()
+        self._refill(now)
+        return self.tokens >= self.capacity and self.paused_until <= now
+
+def _retry_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+
+class FloodControlLimiter(BaseRateLimiter[int]):
+    """Throttles outgoing messages to Telegram's limits, sending by priority
+    
+    Each message first waits for its chat's bucket (in order), then queues for
+    the global bucket where lower priority values go first. RetryAfter errors
+    pause the affected chat (or everything, for requests without a chat) and
+    the request is retried.
+    """
+    
+    def __init__(self, max_retries: int = MAX_RETRIES):
+        self.max_retries = max_retries
+        self.global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+        self.chat_buckets: Dict[Union[int, str], TokenBucket] = {}
+        # (priority, sequence, future) waiting for a global token
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.pump_task: Optional[asyncio.Task] = None
+        self.queue_latency = {priority: latency(f"send_queue_{name}") for priority, name in PRIORITY_NAMES.items()}
+        self.stats = {"sent": 0, "retries": 0, "gave_up": 0}
+    
+    async def initialize(self) -> None:
+        pass
+    
+    async def shutdown(self) -> None:
+        if self.pump_task is not None:
+            self.pump_task.cancel()
+            self.pump_task = None
+    
+    def share_global_limit(self, shares: int):
+        """Use 1/shares of the global limit (one share per worker process sending for this bot)"""
+        self.global_bucket = TokenBucket(GLOBAL_RATE / shares, max(1, GLOBAL_BURST // shares))
+    
+    def _chat_bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= MAX_CHAT_BUCKETS:
+                self.chat_buckets = {key: value for key, value in self.chat_buckets.items() if not value.idle()}
+            # Group and channel ids are negative (or @usernames)
+            if isinstance(chat_id, int) and chat_id > 0:
+                bucket = TokenBucket(PRIVATE_CHAT_RATE, PRIVATE_CHAT_BURST)
+            else:
+                bucket = TokenBucket(GROUP_CHAT_RATE, GROUP_CHAT_BURST)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+    
+    async def _acquire_global(self, priority: int):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiting, (priority, next(self.sequence), future))
+        if self.pump_task is None or self.pump_task.done():
+            self.pump_task = asyncio.create_task(self._pump())
+        await future
+    
+    async def _pump(self):
+        """Release global tokens to waiting requests, highest priority first"""
+        while self.waiting:
+            wait = self.global_bucket.delay()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            _, _, future = heapq.heappop(self.waiting)
+            if future.done():
+                # Caller gave up (cancelled) while queued
+                continue
+            self.global_bucket.reserve()
+            future.set_result(None)
+    
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict, list]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ) -> Union[bool, Dict, list]:
+        limited = endpoint in LIMITED_ENDPOINTS
+        chat_id = data.get("chat_id")
+        if rate_limit_args is not None:
+            priority = rate_limit_args
+        else:
+            priority = ENDPOINT_PRIORITIES.get(endpoint, PRIORITY_DEFAULT)
+        
+        for attempt in range(self.max_retries + 1):
+            if limited:
+                started = time.monotonic()
+                if chat_id is not None:
+                    wait = self._chat_bucket(chat_id).reserve()
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                await self._acquire_global(priority)
+                self.queue_latency.get(priority, self.queue_latency[PRIORITY_DEFAULT]).record(time.monotonic() - started)
+            
+            try:
+                result = await callback(*args, **kwargs)
+                self.stats["sent"] += 1
+                return result
+            except RetryAfter as e:
+                seconds = _retry_seconds(e)
+                if attempt == self.max_retries:
+                    self.stats["gave_up"] += 1
+                    logger.error(f"{endpoint} to chat {chat_id} still flood-limited after {attempt} retries")
+                    raise
+                self.stats["retries"] += 1
+                logger.warning(f"Flood control on {endpoint} (chat {chat_id}), retrying in {seconds:.0f}s")
+                if chat_id is not None:
+                    self._chat_bucket(chat_id).pause(seconds)
+                else:
+                    self.global_bucket.pause(seconds)
+                if not limited:
+                    await asyncio.sleep(seconds)
+    
+    def get_stats(self) -> Dict:
+        """Get send counters and queue latency per priority"""
+        return {
+            **self.stats,
+            "queued": len(self.waiting),
+            "chat_buckets": len(self.chat_buckets),
+            **{f"queue_{PRIORITY_NAMES[priority]}": stats.summary() for priority, stats in self.queue_latency.items()}
+        }
+
+# Global outbound limiter (passed to the application builder in bot.main)
+flood_control = FloodControlLimiter()
@@ -0,0 +1,145 @@
+import sys
+import copy
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+from typing import Dict, Optional
+from config import LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE_RATES
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+# Attributes every LogRecord has; anything else came in through `extra=`
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+def parse_sample_rates(value: str) -> Dict[str, float]:
+    """"bot=0.1,httpx=0.01" -> {"bot": 0.1, "httpx": 0.01}"""
+    rates = {}
+    for item in value.split(","):
+        name, _, rate = item.partition("=")
+        if name.strip() and rate.strip():
+            rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and any `extra=` fields"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "pid": record.process
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class SamplingFilter(logging.Filter):
+    """Keeps a fraction of the DEBUG/INFO records of chatty loggers
+    
+    Rates apply to a logger and its children ("telegram" covers
+    "telegram.ext"); warnings and errors always pass.
+    """
+    
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self.resolved: Dict[str, Optional[float]] = {}
+        self.dropped = 0
+    
+    def _rate(self, name: str) -> Optional[float]:
+        if name not in self.resolved:
+            parts = name.split(".")
+            self.resolved[name] = next(
+                (self.rates[".".join(parts[:i])] for i in range(len(parts), 0, -1) if ".".join(parts[:i]) in self.rates),
+                None
+            )
+        return self.resolved[name]
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        if rate is None or random.random() < rate:
+            return True
+        self.dropped += 1
+        return False
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting (JSON, tracebacks) to the listener thread
+    
+    The stock handler formats the whole record in the caller; here the caller
+    only merges the message arguments so the record can cross threads.
+    """
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # Traceback objects hold frames; keep the text only
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class LogPipeline:
+    """Logging that never writes from the caller's thread
+    
+    Loggers hand records to an in-memory queue (no I/O on the event loop);
+    a listener thread formats them as JSON lines (or the classic text
+    format with LOG_FORMAT=text) and writes them to stderr. Per-logger
+    sampling from LOG_SAMPLE_RATES thins hot-path DEBUG/INFO lines before
+    they're queued.
+    """
+    
+    def __init__(self, level: str = LOG_LEVEL, fmt: str = LOG_FORMAT, sample_rates: str = LOG_SAMPLE_RATES):
+        self.level = level.upper()
+        self.format = fmt
+        self.sampling = SamplingFilter(parse_sample_rates(sample_rates))
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.handler: Optional[logging.Handler] = None
+        self.listener: Optional[logging.handlers.QueueListener] = None
+    
+    def start(self):
+        """Route the root logger through the queue (call once per process, before logging)"""
+        if self.listener is not None:
+            return
+        output = logging.StreamHandler(sys.stderr)
+        output.setFormatter(JsonFormatter() if self.format == "json" else logging.Formatter(TEXT_FORMAT))
+        self.listener = logging.handlers.QueueListener(self.queue, output, respect_handler_level=True)
+        self.listener.start()
+        
+        self.handler = DeferredQueueHandler(self.queue)
+        self.handler.addFilter(self.sampling)
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+        root.setLevel(self.level)
+        # Records still queued at exit are written out
+        atexit.register(self.stop)
+    
+    def stop(self):
+        """Write out queued records and stop the listener thread"""
+        if self.listener is None:
+            return
+        logging.getLogger().removeHandler(self.handler)
+        self.handler = None
+        self.listener.stop()
+        self.listener = None
+        atexit.unregister(self.stop)
+    
+    def get_stats(self) -> Dict:
+        return {"format": self.format, "level": self.level, "sampled_out": self.sampling.dropped}
+
+# Global pipeline (started by bot.main and by each shard worker)
+log_pipeline = LogPipeline()
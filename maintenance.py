@@ -0,0 +1,400 @@
+import time
+import sqlite3
+import asyncio
+import logging
+from datetime import date, datetime, timedelta, time as day_time
+from zoneinfo import ZoneInfo
+from typing import Callable, Dict, List, Tuple
+from telegram.ext import Application, ContextTypes
+from config import MAINTENANCE_TIME, MAINTENANCE_TIMEZONE, MAINTENANCE_HOURS, MAINTENANCE_MAX_IN_FLIGHT
+from migrations import apply_migrations
+from metrics import latency
+from chat_engine import summarize_history
+from sharding import owns_user, is_primary_worker
+from update_processor import update_processor
+from characters import character_manager
+from payment import upi_payment_store
+from screenshot_hashes import screenshot_hash_index
+
+logger = logging.getLogger(__name__)
+
+MAINTENANCE_MIGRATIONS = [
+    [
+        # Progress of resumable jobs (last chat_history rowid handled, ...)
+        """
+        CREATE TABLE IF NOT EXISTS maintenance_state (
+            job TEXT PRIMARY KEY,
+            position INTEGER NOT NULL DEFAULT 0,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # Per-user activity rolled up from chat_history
+        """
+        CREATE TABLE IF NOT EXISTS user_activity (
+            user_id INTEGER PRIMARY KEY,
+            last_message_at DATETIME,
+            messages INTEGER DEFAULT 0,
+            unsummarized INTEGER DEFAULT 0
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_user_activity_last ON user_activity (last_message_at)",
+        """
+        CREATE TABLE IF NOT EXISTS history_summaries (
+            user_id INTEGER PRIMARY KEY,
+            summary TEXT NOT NULL,
+            through_rowid INTEGER NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS chat_history_archive (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            message TEXT,
+            is_user INTEGER,
+            timestamp DATETIME
+        )
+        """,
+        # Archived user messages still count towards the free message limit
+        """
+        CREATE TABLE IF NOT EXISTS archived_message_counts (
+            user_id INTEGER PRIMARY KEY,
+            user_messages INTEGER DEFAULT 0
+        )
+        """,
+        # Summaries and archiving read history per user (so does get_last_messages)
+        "CREATE INDEX IF NOT EXISTS idx_chat_history_user ON chat_history (user_id, timestamp)"
+    ]
+]
+
+# chat_history rows handled per step (one short write transaction)
+BATCH_ROWS = 5000
+# Messages older than this move to chat_history_archive
+ARCHIVE_AFTER_DAYS = 90
+# Users get a new summary once this many messages weren't summarized yet
+SUMMARY_MIN_MESSAGES = 30
+SUMMARY_ACTIVE_DAYS = 7
+# The latest messages stay out of the summary: the prompt includes them verbatim
+SUMMARY_KEEP_RECENT = 10
+SUMMARY_MAX_SOURCE_MESSAGES = 200
+SUMMARY_CANDIDATES = 200
+# Free pages released per incremental vacuum step
+VACUUM_PAGES = 2000
+# Rows sampled per index by ANALYZE (keeps it fast on large tables)
+ANALYZE_LIMIT = 1000
+# Recently active users whose history is read into the page cache before peak hours
+PREWARM_USERS = 500
+# Pause between steps, and while waiting for live traffic to calm down (seconds)
+STEP_PAUSE = 0.05
+BUSY_PAUSE = 1.0
+
+class MaintenanceJob:
+    """A resumable job made of short steps; step() returns (items handled, more work left)"""
+    
+    def __init__(self, name: str, step: Callable[[], Tuple[int, bool]], time_budget: float,
+                 cpu_budget: float, everywhere: bool = False):
+        self.name = name
+        self.step = step
+        self.time_budget = time_budget
+        self.cpu_budget = cpu_budget
+        # Run in every shard worker (for its own users), not only the primary one
+        self.everywhere = everywhere
+
+class MaintenanceScheduler:
+    """Heavy maintenance run off-peak through the application's JobQueue (APScheduler)
+    
+    Jobs run one after another in the daily window, in small steps on a worker
+    thread. Before each step they wait while live traffic is above
+    MAINTENANCE_MAX_IN_FLIGHT; a job stops when its wall-clock or CPU budget
+    (or the window) runs out and continues from its saved position next time.
+    """
+    
+    def __init__(self, db_path: str = "sextbot.db"):
+        self.db_path = db_path
+        self.running = False
+        # Users whose summary failed in this window (retried in the next one)
+        self.summary_failed = set()
+        self.jobs: List[MaintenanceJob] = [
+            MaintenanceJob("rollup_activity", self.rollup_activity, time_budget=1800, cpu_budget=600),
+            MaintenanceJob("summarize_history", self.summarize_history, time_budget=3600, cpu_budget=120, everywhere=True),
+            MaintenanceJob("archive_history", self.archive_history, time_budget=1800, cpu_budget=600),
+            MaintenanceJob("analyze", self.analyze, time_budget=300, cpu_budget=120),
+            MaintenanceJob("incremental_vacuum", self.incremental_vacuum, time_budget=600, cpu_budget=120)
+        ]
+        self.prewarm_job = MaintenanceJob("prewarm", self.prewarm_history, time_budget=120, cpu_budget=30, everywhere=True)
+        self.durations = {job.name: latency(f"job_{job.name}") for job in self.jobs + [self.prewarm_job]}
+        self.stats: Dict[str, Dict] = {
+            job.name: {"runs": 0, "completed": 0, "budget_stops": 0, "failed": 0, "items": 0,
+                       "cpu_seconds": 0.0, "yielded_seconds": 0.0, "last_outcome": None}
+            for job in self.jobs + [self.prewarm_job]
+        }
+    
+    def init_database(self):
+        """Create the maintenance tables (after memory's chat_history)"""
+        apply_migrations(self.db_path, "maintenance", MAINTENANCE_MIGRATIONS)
+    
+    def schedule(self, app: Application):
+        """Run the jobs daily in the maintenance window and warm caches as it ends"""
+        hour, minute = (int(part) for part in MAINTENANCE_TIME.split(":"))
+        start = day_time(hour, minute, tzinfo=ZoneInfo(MAINTENANCE_TIMEZONE))
+        warm = (datetime.combine(date.today(), start) + timedelta(hours=MAINTENANCE_HOURS)).timetz()
+        app.job_queue.run_daily(self._run_window, start, name="maintenance")
+        app.job_queue.run_daily(self._prewarm, warm, name="prewarm")
+        logger.info(f"Maintenance scheduled daily at {MAINTENANCE_TIME} {MAINTENANCE_TIMEZONE} for {MAINTENANCE_HOURS:g}h")
+    
+    async def _run_window(self, context: ContextTypes.DEFAULT_TYPE):
+        if self.running:
+            logger.warning("Previous maintenance window still running, skipping")
+            return
+        self.running = True
+        self.summary_failed.clear()
+        deadline = time.monotonic() + MAINTENANCE_HOURS * 3600
+        try:
+            for job in self.jobs:
+                if job.everywhere or is_primary_worker():
+                    await self.run_job(job, deadline)
+        finally:
+            self.running = False
+    
+    async def _prewarm(self, context: ContextTypes.DEFAULT_TYPE):
+        # In-memory caches are loaded on the event loop, as on first use
+        started = time.monotonic()
+        character_manager.entitlements.load()
+        upi_payment_store.load()
+        screenshot_hash_index.load()
+        logger.info(f"Caches loaded in {time.monotonic() - started:.1f}s")
+        await self.run_job(self.prewarm_job)
+    
+    async def run_job(self, job: MaintenanceJob, deadline: float = None) -> str:
+        """Run a job's steps until it's done or out of budget, returns the outcome"""
+        stats = self.stats[job.name]
+        stats["runs"] += 1
+        started = time.monotonic()
+        ends = started + job.time_budget if deadline is None else min(started + job.time_budget, deadline)
+        cpu_seconds, items = 0.0, 0
+        outcome = "completed"
+        
+        try:
+            while True:
+                stats["yielded_seconds"] += await self._wait_for_quiet(ends)
+                if time.monotonic() >= ends:
+                    outcome = "time budget"
+                    break
+                if cpu_seconds >= job.cpu_budget:
+                    outcome = "cpu budget"
+                    break
+                handled, more, step_cpu = await asyncio.to_thread(self._run_step, job)
+                items += handled
+                cpu_seconds += step_cpu
+                if not more:
+                    break
+                await asyncio.sleep(STEP_PAUSE)
+        except Exception as e:
+            outcome = "failed"
+            logger.error(f"Maintenance job {job.name} failed: {e}")
+        
+        elapsed = time.monotonic() - started
+        self.durations[job.name].record(elapsed)
+        stats["items"] += items
+        stats["cpu_seconds"] += cpu_seconds
+        stats["last_outcome"] = outcome
+        if outcome == "completed":
+            stats["completed"] += 1
+        elif outcome == "failed":
+            stats["failed"] += 1
+        else:
+            stats["budget_stops"] += 1
+        logger.info(f"Maintenance job {job.name}: {outcome}, {items} items in {elapsed:.1f}s ({cpu_seconds:.1f}s CPU)")
+        return outcome
+    
+    @staticmethod
+    def _run_step(job: MaintenanceJob) -> Tuple[int, bool, float]:
+        started = time.thread_time()
+        handled, more = job.step()
+        return handled, more, time.thread_time() - started
+    
+    async def _wait_for_quiet(self, ends: float) -> float:
+        """Yield to live traffic: wait while many updates are being processed"""
+        started = time.monotonic()
+        while update_processor.in_flight > MAINTENANCE_MAX_IN_FLIGHT and time.monotonic() < ends:
+            await asyncio.sleep(BUSY_PAUSE)
+        return time.monotonic() - started
+    
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+    
+    @staticmethod
+    def _get_position(conn: sqlite3.Connection, job: str) -> int:
+        row = conn.execute("SELECT position FROM maintenance_state WHERE job = ?", (job,)).fetchone()
+        return row[0] if row else 0
+    
+    @staticmethod
+    def _set_position(conn: sqlite3.Connection, job: str, position: int):
+        conn.execute("""
+            INSERT INTO maintenance_state (job, position) VALUES (?, ?)
+            ON CONFLICT (job) DO UPDATE SET position = excluded.position, updated_at = CURRENT_TIMESTAMP
+        """, (job, position))
+    
+    # Steps (run on a worker thread, each with its own connection)
+    
+    def rollup_activity(self) -> Tuple[int, bool]:
+        """Fold the next batch of chat_history rows into user_activity"""
+        conn = self._connect()
+        try:
+            position = self._get_position(conn, "rollup_activity")
+            last_rowid = conn.execute("SELECT MAX(rowid) FROM chat_history").fetchone()[0] or 0
+            upper = min(position + BATCH_ROWS, last_rowid)
+            if upper <= position:
+                return 0, False
+            with conn:
+                cursor = conn.execute("""
+                    INSERT INTO user_activity (user_id, last_message_at, messages, unsummarized)
+                    SELECT user_id, MAX(timestamp), COUNT(*), COUNT(*) FROM chat_history
+                    WHERE rowid > ? AND rowid <= ?
+                    GROUP BY user_id
+                    ON CONFLICT (user_id) DO UPDATE SET
+                        last_message_at = MAX(last_message_at, excluded.last_message_at),
+                        messages = messages + excluded.messages,
+                        unsummarized = unsummarized + excluded.unsummarized
+                """, (position, upper))
+                self._set_position(conn, "rollup_activity", upper)
+            return cursor.rowcount, upper < last_rowid
+        finally:
+            conn.close()
+    
+    def summarize_history(self) -> Tuple[int, bool]:
+        """Summarize one active user's older messages (one LLM request)"""
+        conn = self._connect()
+        try:
+            candidates = conn.execute("""
+                SELECT user_id FROM user_activity
+                WHERE unsummarized >= ? AND last_message_at >= datetime('now', ?)
+                ORDER BY last_message_at DESC LIMIT ?
+            """, (SUMMARY_MIN_MESSAGES, f"-{SUMMARY_ACTIVE_DAYS} days", SUMMARY_CANDIDATES)).fetchall()
+            user_id = next(
+                (row[0] for row in candidates if row[0] not in self.summary_failed and owns_user(row[0])), None
+            )
+            if user_id is None:
+                return 0, False
+            
+            previous = conn.execute(
+                "SELECT summary, through_rowid FROM history_summaries WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            summary, through_rowid = previous or (None, 0)
+            messages = conn.execute(
+                "SELECT rowid, message, is_user FROM chat_history WHERE user_id = ? AND rowid > ? ORDER BY rowid",
+                (user_id, through_rowid)
+            ).fetchall()
+            older = messages[:-SUMMARY_KEEP_RECENT]
+            
+            if older:
+                # No transaction is open during the request
+                new_summary = summarize_history(
+                    summary, [(message, is_user) for _, message, is_user in older[-SUMMARY_MAX_SOURCE_MESSAGES:]]
+                )
+                if new_summary is None:
+                    self.summary_failed.add(user_id)
+                    return 0, True
+                with conn:
+                    conn.execute("""
+                        INSERT INTO history_summaries (user_id, summary, through_rowid) VALUES (?, ?, ?)
+                        ON CONFLICT (user_id) DO UPDATE SET
+                            summary = excluded.summary, through_rowid = excluded.through_rowid, updated_at = CURRENT_TIMESTAMP
+                    """, (user_id, new_summary, older[-1][0]))
+            
+            with conn:
+                # Without older messages (e.g. archived) there's nothing left to summarize
+                conn.execute(
+                    "UPDATE user_activity SET unsummarized = MAX(0, unsummarized - ?) WHERE user_id = ?",
+                    (len(older) if older else SUMMARY_MIN_MESSAGES, user_id)
+                )
+            return 1, True
+        finally:
+            conn.close()
+    
+    def archive_history(self) -> Tuple[int, bool]:
+        """Move the next batch of old messages to chat_history_archive"""
+        conn = self._connect()
+        try:
+            cutoff = conn.execute("SELECT datetime('now', ?)", (f"-{ARCHIVE_AFTER_DAYS} days",)).fetchone()[0]
+            # Only rows already counted in user_activity
+            rolled_up = self._get_position(conn, "rollup_activity")
+            rowids = conn.execute(
+                "SELECT rowid FROM chat_history WHERE timestamp < ? AND rowid <= ? ORDER BY rowid LIMIT ?",
+                (cutoff, rolled_up, BATCH_ROWS)
+            ).fetchall()
+            if not rowids:
+                return 0, False
+            
+            batch = (rowids[0][0], rowids[-1][0], cutoff)
+            with conn:
+                conn.execute("""
+                    INSERT OR IGNORE INTO chat_history_archive (id, user_id, message, is_user, timestamp)
+                    SELECT rowid, user_id, message, is_user, timestamp FROM chat_history
+                    WHERE rowid BETWEEN ? AND ? AND timestamp < ?
+                """, batch)
+                conn.execute("""
+                    INSERT INTO archived_message_counts (user_id, user_messages)
+                    SELECT user_id, SUM(is_user) FROM chat_history
+                    WHERE rowid BETWEEN ? AND ? AND timestamp < ?
+                    GROUP BY user_id
+                    ON CONFLICT (user_id) DO UPDATE SET user_messages = user_messages + excluded.user_messages
+                """, batch)
+                cursor = conn.execute("DELETE FROM chat_history WHERE rowid BETWEEN ? AND ? AND timestamp < ?", batch)
+            return cursor.rowcount, len(rowids) == BATCH_ROWS
+        finally:
+            conn.close()
+    
+    def analyze(self) -> Tuple[int, bool]:
+        """Refresh query planner statistics from a bounded sample"""
+        conn = self._connect()
+        try:
+            conn.execute(f"PRAGMA analysis_limit = {ANALYZE_LIMIT}")
+            conn.execute("ANALYZE")
+            conn.commit()
+            return 1, False
+        finally:
+            conn.close()
+    
+    def incremental_vacuum(self) -> Tuple[int, bool]:
+        """Return free pages to the filesystem, a few at a time"""
+        conn = self._connect()
+        try:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                # Needs a one-time "PRAGMA auto_vacuum = INCREMENTAL; VACUUM;" while the bot is stopped
+                free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                logger.info(f"Incremental vacuum skipped: auto_vacuum isn't INCREMENTAL ({free_pages} free pages)")
+                return 0, False
+            conn.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES})").fetchall()
+            remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            return VACUUM_PAGES, remaining > 0
+        finally:
+            conn.close()
+    
+    def prewarm_history(self) -> Tuple[int, bool]:
+        """Read recently active users' latest messages so the first replies hit a warm page cache"""
+        conn = self._connect()
+        try:
+            users = [
+                row[0] for row in conn.execute(
+                    "SELECT user_id FROM user_activity ORDER BY last_message_at DESC LIMIT ?", (PREWARM_USERS,)
+                ) if owns_user(row[0])
+            ]
+            for user_id in users:
+                conn.execute(
+                    "SELECT message, is_user FROM chat_history WHERE user_id = ? ORDER BY timestamp DESC LIMIT ?",
+                    (user_id, SUMMARY_KEEP_RECENT)
+                ).fetchall()
+            return len(users), False
+        finally:
+            conn.close()
+    
+    def get_stats(self) -> Dict:
+        """Per-job counters and run durations"""
+        return {
+            name: {**stats, "duration": self.durations[name].summary()}
+            for name, stats in self.stats.items()
+        }
+
+# Global maintenance scheduler (scheduled from bot.on_startup)
+maintenance_scheduler = MaintenanceScheduler()
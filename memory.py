@@ -1,29 +1,51 @@
 import sqlite3
+from typing import Optional
+from usage_stats import add_message
 
-db = sqlite3.connect("sextbot.db", check_same_thread=False)
-cursor = db.cursor()
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS users (
-    user_id INTEGER PRIMARY KEY,
-    username TEXT,
-    persona TEXT,
-    paid INTEGER DEFAULT 0
-)
-""")
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS chat_history (
-    user_id INTEGER,
-    message TEXT,
-    is_user INTEGER,
-    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-)
-""")
+DB_PATH = "sextbot.db"
+
+# Shared connection, opened by init_db() at startup so importing this module does no I/O
+db: Optional[sqlite3.Connection] = None
+cursor: Optional[sqlite3.Cursor] = None
+
+def open_db(path: str = DB_PATH):
+    """Open the shared connection (a reopened connection starts with an empty page cache)"""
+    global db, cursor
+    if db is not None:
+        db.close()
+    db = sqlite3.connect(path, check_same_thread=False)
+    cursor = db.cursor()
+
+def init_db():
+    """Open the database and create the user and chat history tables (called from startup)"""
+    open_db()
+    # WAL lets readers run while another connection (or shard worker process) writes
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        persona TEXT,
+        paid INTEGER DEFAULT 0
+    )
+    """)
+    
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS chat_history (
+        user_id INTEGER,
+        message TEXT,
+        is_user INTEGER,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    db.commit()
 
 def save_user(user_id, username, persona):
-    cursor.execute("REPLACE INTO users (user_id, username, persona) VALUES (?, ?, ?)",
-                   (user_id, username, persona))
+    # Upsert so an existing paid flag is kept
+    cursor.execute("""
+        INSERT INTO users (user_id, username, persona) VALUES (?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET username = excluded.username, persona = excluded.persona
+    """, (user_id, username, persona))
     db.commit()
 
 def get_persona(user_id):
@@ -31,9 +53,11 @@ def get_persona(user_id):
     result = cursor.fetchone()
     return result[0] if result else None
 
-def save_message(user_id, message, is_user):
+def save_message(user_id, message, is_user, character_id=None, character_price=0):
     cursor.execute("INSERT INTO chat_history (user_id, message, is_user) VALUES (?, ?, ?)",
                    (user_id, message, is_user))
+    # Daily per-character totals for /stats, committed together with the message
+    add_message(cursor, character_id, character_price, is_user)
     db.commit()
 
 def get_last_messages(user_id, limit=10):
@@ -42,10 +66,19 @@ def get_last_messages(user_id, limit=10):
     return cursor.fetchall()[::-1]  # return in chronological order
 
 def get_user_message_count(user_id):
-    """Get total number of user messages sent"""
-    cursor.execute("SELECT COUNT(*) FROM chat_history WHERE user_id = ? AND is_user = 1", (user_id,))
+    """Get total number of user messages sent (including archived ones, see maintenance.py)"""
+    cursor.execute("""
+        SELECT (SELECT COUNT(*) FROM chat_history WHERE user_id = ? AND is_user = 1)
+             + COALESCE((SELECT user_messages FROM archived_message_counts WHERE user_id = ?), 0)
+    """, (user_id, user_id))
     return cursor.fetchone()[0]
 
+def get_history_summary(user_id):
+    """Summary of the user's older messages, precomputed off-peak (None if there's none yet)"""
+    cursor.execute("SELECT summary FROM history_summaries WHERE user_id = ?", (user_id,))
+    result = cursor.fetchone()
+    return result[0] if result else None
+
 def is_user_paid(user_id):
     """Check if user has paid"""
     cursor.execute("SELECT paid FROM users WHERE user_id = ?", (user_id,))
@@ -54,5 +87,18 @@ def is_user_paid(user_id):
 
 def mark_user_paid(user_id):
     """Mark user as paid"""
-    cursor.execute("UPDATE users SET paid = 1 WHERE user_id = ?", (user_id,))
+    # Users who never went through save_user have no row yet
+    cursor.execute("""
+        INSERT INTO users (user_id, paid) VALUES (?, 1)
+        ON CONFLICT (user_id) DO UPDATE SET paid = 1
+    """, (user_id,))
+    db.commit()
+
+def close_db():
+    """Commit and close the shared connection (on shutdown)"""
+    global db, cursor
+    if db is None:
+        return
     db.commit()
+    db.close()
+    db = cursor = None
@@ -0,0 +1,49 @@
+from collections import deque
+from typing import Dict
+
+# Number of recent samples kept per metric for percentiles
+LATENCY_WINDOW = 1000
+
+class LatencyStats:
+    """Rolling latency samples with totals since startup"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def percentile(self, percentile: float) -> float:
+        """Latency at a percentile (0-100) of the recent samples"""
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+    def summary(self) -> Dict:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_seconds / self.count * 1000, 1) if self.count else 0.0,
+            "p50_ms": round(self.percentile(50) * 1000, 1),
+            "p95_ms": round(self.percentile(95) * 1000, 1),
+            "p99_ms": round(self.percentile(99) * 1000, 1),
+            "max_ms": round(self.max_seconds * 1000, 1)
+        }
+
+_latencies: Dict[str, LatencyStats] = {}
+
+def latency(name: str) -> LatencyStats:
+    """Get (or create) the latency metric with this name"""
+    if name not in _latencies:
+        _latencies[name] = LatencyStats()
+    return _latencies[name]
+
+def get_latency_summaries() -> Dict[str, Dict]:
+    """Summaries of all latency metrics"""
+    return {name: stats.summary() for name, stats in sorted(_latencies.items())}
@@ -0,0 +1,49 @@
+import sqlite3
+import logging
+from typing import List, Union, Callable
+
+logger = logging.getLogger(__name__)
+
+def get_schema_version(conn: sqlite3.Connection, component: str) -> int:
+    """Get the applied schema version of a component (0 if never migrated)"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_versions (
+            component TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    row = conn.execute("SELECT version FROM schema_versions WHERE component = ?", (component,)).fetchone()
+    return row[0] if row else 0
+
+def apply_migrations(db_path: str, component: str, migrations: List[Union[List[str], Callable]]) -> int:
+    """Apply pending migrations for a component, each in its own transaction
+    
+    migrations[0] upgrades to version 1, migrations[1] to version 2, and so on.
+    A migration is a list of SQL statements or a function taking the connection.
+    Returns the schema version after migrating.
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        version = get_schema_version(conn, component)
+        for target, statements in enumerate(migrations[version:], start=version + 1):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if callable(statements):
+                    statements(conn)
+                else:
+                    for statement in statements:
+                        conn.execute(statement)
+                conn.execute(
+                    "INSERT OR REPLACE INTO schema_versions (component, version) VALUES (?, ?)",
+                    (component, target)
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            logger.info(f"Migrated {component} schema to version {target}")
+            version = target
+        return version
+    finally:
+        conn.close()
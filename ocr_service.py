@@ -0,0 +1,129 @@
+import time
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Dict
+from config import OCR_WORKERS, OCR_TIMEOUT, OCR_MAX_QUEUE
+
+logger = logging.getLogger(__name__)
+
+# Recycle worker processes periodically so tesseract/Pillow memory can't grow forever
+OCR_TASKS_PER_WORKER = 200
+
+class OCRJobError(Exception):
+    """Picklable wrapper for errors raised inside OCR worker processes"""
+
+def _run_ocr(image_bytes: bytes, timeout: float) -> str:
+    """OCR job executed inside a worker process"""
+    from payment import extract_text_from_bytes
+    try:
+        return extract_text_from_bytes(image_bytes, timeout)
+    except Exception as e:
+        # Some pytesseract exceptions can't be unpickled in the parent and would break the pool
+        raise OCRJobError(f"{type(e).__name__}: {e}") from None
+
+class OCRService:
+    def __init__(self, workers: int = OCR_WORKERS, timeout: float = OCR_TIMEOUT, max_queue: int = OCR_MAX_QUEUE):
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.max_queue = max_queue
+        self.executor = None
+        self.pending = 0
+        self.stats = {
+            "completed": 0,
+            "failed": 0,
+            "timeouts": 0,
+            "rejected": 0,
+            "total_seconds": 0.0
+        }
+    
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Create the process pool on first use"""
+        if self.executor is None:
+            # spawn keeps workers independent of the bot's event loop and threads
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                max_tasks_per_child=OCR_TASKS_PER_WORKER
+            )
+            logger.info(f"OCR pool started with {self.workers} workers")
+        return self.executor
+    
+    async def extract_text(self, image_bytes: bytes) -> Optional[str]:
+        """Run OCR in the process pool, returns None if the queue is full or the job failed"""
+        if self.pending >= self.max_queue:
+            self.stats["rejected"] += 1
+            logger.warning(f"OCR queue full ({self.pending} jobs), rejecting screenshot")
+            return None
+        
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        
+        def release(_):
+            # Runs in the pool's thread; a stopped loop means the bot is shutting down
+            try:
+                loop.call_soon_threadsafe(self._release)
+            except RuntimeError:
+                pass
+        
+        try:
+            job = self._get_executor().submit(_run_ocr, image_bytes, self.timeout)
+            # The slot stays taken until the job leaves the pool, even if the caller stops waiting
+            self.pending += 1
+            job.add_done_callback(release)
+            # tesseract is killed after timeout inside the worker; the outer wait adds
+            # a margin for queueing behind other jobs and image decoding, and only
+            # stops this caller from waiting (shield keeps the job itself running)
+            text = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(job)), timeout=self.timeout * 2)
+            self.stats["completed"] += 1
+            return text
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            logger.warning(f"OCR job timed out after {time.monotonic() - started:.1f}s (job left in the pool)")
+            return None
+        except OCRJobError as e:
+            # pytesseract raises "RuntimeError: Tesseract process timeout" when it kills tesseract
+            if "timeout" in str(e).lower():
+                self.stats["timeouts"] += 1
+                logger.warning(f"OCR job timed out in worker: {e}")
+            else:
+                self.stats["failed"] += 1
+                logger.error(f"OCR job failed: {e}")
+            return None
+        except BrokenProcessPool as e:
+            # A worker died (e.g. OOM kill); start a fresh pool for the next job
+            self.stats["failed"] += 1
+            logger.error(f"OCR pool broken, restarting: {e}")
+            self.shutdown()
+            return None
+        except Exception as e:
+            self.stats["failed"] += 1
+            logger.error(f"OCR job failed: {e}")
+            return None
+        finally:
+            self.stats["total_seconds"] += time.monotonic() - started
+    
+    def _release(self):
+        self.pending -= 1
+    
+    def get_stats(self) -> Dict:
+        """Get OCR pool metrics"""
+        finished = self.stats["completed"] + self.stats["failed"] + self.stats["timeouts"]
+        return {
+            **self.stats,
+            "pending": self.pending,
+            "workers": self.workers,
+            "avg_seconds": self.stats["total_seconds"] / finished if finished else 0.0
+        }
+    
+    def shutdown(self):
+        """Stop worker processes"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+            logger.info("OCR pool stopped")
+
+# Global OCR service instance
+ocr_service = OCRService()
@@ -1,18 +1,41 @@
 import json
 import os
-from PIL import Image
-import pytesseract
-import difflib
+import logging
+import sqlite3
+import asyncio
 from io import BytesIO
+from typing import Optional, TYPE_CHECKING
 from dotenv import load_dotenv
+from ocr_service import ocr_service
+from payment_matcher import PaymentMatcher
+from screenshot_hashes import screenshot_hash_index, image_hashes
+
+if TYPE_CHECKING:
+    from PIL import Image
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # UPI Payment Configuration
 EXPECTED_UPI_ID = os.getenv("EXPECTED_UPI_ID", "yourupi@upi")  # Replace with your actual UPI ID
 EXPECTED_AMOUNT = int(os.getenv("EXPECTED_AMOUNT", "49"))  # Set the expected amount in INR
 QR_IMAGE_PATH = os.getenv("QR_IMAGE_PATH", "test_qr.png")  # Path to your QR code image
-USER_DB_FILE = "users.json"
+UPI_ID_MAX_EDITS = os.getenv("UPI_ID_MAX_EDITS")  # OCR errors tolerated in the UPI ID (default: 1 per 6 chars)
+USER_DB_FILE = "users.json"  # Legacy store, imported into SQLite on first load
+UPI_DB_PATH = "sextbot.db"
+
+# Experimental OCR preprocessing, opt-in with OCR_PREPROCESS=1. Its accuracy and speed
+# against raw OCR haven't been measured yet; the default path is plain image_to_string
+# until benchmarks/ocr_benchmark.py --corpus shows preprocessed accuracy >= raw
+OCR_PREPROCESS = os.getenv("OCR_PREPROCESS", "0") == "1"
+OCR_MAX_WIDTH = 1000  # Phone screenshots are downscaled to this width before OCR
+OCR_DENSE_ROW_INK = 0.5  # Rows with more ink than this are colored banners (light text on dark)
+OCR_CROP_MARGIN = 10  # Pixels kept around the detected text area
+# Restricted tesseract config: LSTM engine, single column of variable-size text,
+# and only characters that appear in amounts, UPI IDs and transaction details
+OCR_CHAR_WHITELIST = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789@.,:-_/₹"
+OCR_CONFIG = f"--oem 1 --psm 4 -c tessedit_char_whitelist={OCR_CHAR_WHITELIST}"
 
 def get_qr_image_bytes():
     """Get QR image as bytes for sending via Telegram"""
@@ -39,7 +62,7 @@ def get_qr_image_bytes():
             buffer.seek(0)
             return buffer.getvalue()
     except Exception as e:
-        print(f"Error creating QR image: {e}")
+        logger.error(f"Error creating QR image: {e}")
         return None
 
 # User Database for UPI payments
@@ -49,49 +72,272 @@ def load_users():
             return json.load(f)
     return {"paid": [], "pending": []}
 
-def save_users(data):
-    with open(USER_DB_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+class UPIPaymentStore:
+    """UPI paid/pending users kept in memory as sets and persisted to SQLite"""
+    
+    def __init__(self, db_path: str = UPI_DB_PATH):
+        self.db_path = db_path
+        self.paid = None
+        self.pending = None
+    
+    def init_database(self):
+        """Initialize the UPI payments table"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS upi_payments (
+                user_id INTEGER PRIMARY KEY,
+                status TEXT NOT NULL,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        conn.commit()
+        conn.close()
+    
+    def load(self):
+        """Load paid/pending sets once, importing users.json on first run"""
+        if self.paid is not None:
+            return
+        
+        self.init_database()
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT COUNT(*) FROM upi_payments")
+        if cursor.fetchone()[0] == 0 and os.path.exists(USER_DB_FILE):
+            users = load_users()
+            rows = [(int(uid), "pending") for uid in users.get("pending", [])]
+            rows += [(int(uid), "paid") for uid in users.get("paid", [])]
+            # Paid rows come last so they win over stale pending entries
+            cursor.executemany("INSERT OR REPLACE INTO upi_payments (user_id, status) VALUES (?, ?)", rows)
+            conn.commit()
+            logger.info(f"Imported {len(rows)} UPI payment records from {USER_DB_FILE}")
+        
+        cursor.execute("SELECT user_id, status FROM upi_payments")
+        self.paid, self.pending = set(), set()
+        for user_id, status in cursor.fetchall():
+            (self.paid if status == "paid" else self.pending).add(user_id)
+        conn.close()
+    
+    def _set_status(self, user_id: int, status: str):
+        """Persist a user's status in a single atomic statement"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute(
+            "INSERT OR REPLACE INTO upi_payments (user_id, status, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)",
+            (user_id, status)
+        )
+        conn.commit()
+        conn.close()
+    
+    def is_paid(self, user_id: int) -> bool:
+        """In-memory paid check, no filesystem access after the first load"""
+        self.load()
+        return int(user_id) in self.paid
+    
+    def mark_paid(self, user_id: int):
+        """Mark user as paid (clears pending)"""
+        self.load()
+        user_id = int(user_id)
+        if user_id in self.paid:
+            return
+        self._set_status(user_id, "paid")
+        self.paid.add(user_id)
+        self.pending.discard(user_id)
+    
+    def mark_pending(self, user_id: int):
+        """Mark user as waiting for payment verification"""
+        self.load()
+        user_id = int(user_id)
+        if user_id in self.paid or user_id in self.pending:
+            return
+        self._set_status(user_id, "pending")
+        self.pending.add(user_id)
+
+# Global UPI payment store (loaded on first use)
+upi_payment_store = UPIPaymentStore()
 
 # OCR & Matching functions
-def extract_text_from_image(image: Image.Image) -> str:
-    return pytesseract.image_to_string(image)
+def otsu_threshold(gray: "Image.Image") -> int:
+    """Pick the threshold that best separates text from background"""
+    histogram = gray.histogram()
+    total = sum(histogram)
+    sum_all = sum(i * count for i, count in enumerate(histogram))
+    
+    sum_background = 0
+    weight_background = 0
+    best_threshold, best_variance = 127, 0.0
+    for i, count in enumerate(histogram):
+        weight_background += count
+        if weight_background == 0:
+            continue
+        weight_foreground = total - weight_background
+        if weight_foreground == 0:
+            break
+        sum_background += i * count
+        mean_background = sum_background / weight_background
+        mean_foreground = (sum_all - sum_background) / weight_foreground
+        variance = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = i, variance
+    return best_threshold
+
+def binarize(gray: "Image.Image") -> "Image.Image":
+    """Convert a grayscale image to black text on a white background"""
+    from PIL import Image, ImageOps
+    threshold = otsu_threshold(gray)
+    binary = gray.point([255 if i > threshold else 0 for i in range(256)])
+    
+    # Dark-mode screenshots: make the background white
+    background = binary.resize((1, 1), Image.BOX).getpixel((0, 0))
+    if background < 128:
+        binary = ImageOps.invert(binary)
+    return binary
 
-def is_fuzzy_match(text, pattern, threshold=0.6):
-    return difflib.SequenceMatcher(None, text.lower(), pattern.lower()).ratio() > threshold
+def normalize_dense_bands(binary: "Image.Image") -> "Image.Image":
+    """Invert colored banners so their (light) text becomes dark on white"""
+    from PIL import Image, ImageOps
+    width, height = binary.size
+    # Mean brightness of each row; 255 is a blank row
+    row_brightness = list(binary.resize((1, height), Image.BOX).getdata())
+    
+    band_start = None
+    for y, brightness in enumerate(row_brightness + [255]):
+        is_dense = 1 - brightness / 255 > OCR_DENSE_ROW_INK
+        if is_dense and band_start is None:
+            band_start = y
+        elif not is_dense and band_start is not None:
+            box = (0, band_start, width, y)
+            binary.paste(ImageOps.invert(binary.crop(box)), box)
+            band_start = None
+    return binary
+
+def crop_to_text(binary: "Image.Image") -> "Image.Image":
+    """Crop away empty margins around the text
+    
+    Trims to the bounding box of all text, not to the amount and UPI ID
+    lines; on the synthetic receipts this keeps 29-47% of the pixels.
+    """
+    from PIL import ImageOps
+    bbox = ImageOps.invert(binary).getbbox()
+    if not bbox:
+        return binary
+    left, top, right, bottom = bbox
+    width, height = binary.size
+    return binary.crop((
+        max(0, left - OCR_CROP_MARGIN),
+        max(0, top - OCR_CROP_MARGIN),
+        min(width, right + OCR_CROP_MARGIN),
+        min(height, bottom + OCR_CROP_MARGIN)
+    ))
+
+def preprocess_screenshot(image: "Image.Image") -> "Image.Image":
+    """Downscale, grayscale, binarize and crop a payment screenshot for OCR (experimental, see OCR_PREPROCESS)"""
+    from PIL import Image, ImageOps
+    gray = ImageOps.exif_transpose(image).convert("L")
+    
+    if gray.width > OCR_MAX_WIDTH:
+        height = round(gray.height * OCR_MAX_WIDTH / gray.width)
+        gray = gray.resize((OCR_MAX_WIDTH, height), Image.BOX)
+    
+    binary = normalize_dense_bands(binarize(gray))
+    return crop_to_text(binary)
+
+def extract_text_from_image(image: "Image.Image", timeout: float = 0, preprocess: bool = OCR_PREPROCESS) -> str:
+    # Loaded on first OCR job (in the OCR worker processes), not when the bot starts
+    import pytesseract
+    if not preprocess:
+        return pytesseract.image_to_string(image, timeout=timeout)
+    return pytesseract.image_to_string(preprocess_screenshot(image), config=OCR_CONFIG, timeout=timeout)
+
+def extract_text_from_bytes(image_bytes: bytes, timeout: float = 0) -> str:
+    """Run OCR on raw screenshot bytes (also used by the OCR worker processes)"""
+    from PIL import Image
+    return extract_text_from_image(Image.open(BytesIO(image_bytes)), timeout)
+
+payment_matcher = PaymentMatcher(
+    EXPECTED_AMOUNT, EXPECTED_UPI_ID,
+    int(UPI_ID_MAX_EDITS) if UPI_ID_MAX_EDITS else None
+)
 
 def has_paid(text: str) -> bool:
-    amount_match = any(is_fuzzy_match(word.strip("₹₹Rs."), str(EXPECTED_AMOUNT)) for word in text.split())
-    upi_match = is_fuzzy_match(text, EXPECTED_UPI_ID)
-    return amount_match and upi_match
+    return payment_matcher.matches(text)
+
+def verify_payment_text(text: str, user_id: int) -> bool:
+    """Check OCR text from a payment screenshot and mark user as paid if valid"""
+    if has_paid(text):
+        upi_payment_store.mark_paid(user_id)
+        return True
+    return False
+
+def hash_screenshot(image_bytes: bytes):
+    """Perceptual hashes of a screenshot, or None if it can't be decoded"""
+    try:
+        return image_hashes(image_bytes)
+    except Exception as e:
+        logger.warning(f"Error hashing screenshot: {e}")
+        return None
+
+def lookup_screenshot(hashes, user_id: int) -> Optional[bool]:
+    """Answer a screenshot from previously checked ones without OCR
+    
+    A near-duplicate of another user's screenshot is flagged and rejected.
+    Returns None if the screenshot hasn't been seen before.
+    """
+    if hashes is None:
+        return None
+    
+    match = screenshot_hash_index.find(hashes, user_id)
+    if match is None:
+        return None
+    
+    if match["user_id"] != user_id:
+        screenshot_hash_index.flag_reuse(hashes, user_id, match)
+        return False
+    
+    if match["verified"]:
+        upi_payment_store.mark_paid(user_id)
+    return match["verified"]
 
 def verify_payment_screenshot(image_bytes: bytes, user_id: int) -> bool:
     """Verify payment screenshot and mark user as paid if valid"""
     try:
-        image = Image.open(BytesIO(image_bytes))
-        text = extract_text_from_image(image)
+        hashes = hash_screenshot(image_bytes)
+        cached = lookup_screenshot(hashes, user_id)
+        if cached is not None:
+            return cached
         
-        if has_paid(text):
-            users = load_users()
-            user_id_str = str(user_id)
-            if user_id_str not in users["paid"]:
-                users["paid"].append(user_id_str)
-            if user_id_str in users["pending"]:
-                users["pending"].remove(user_id_str)
-            save_users(users)
-            return True
-        return False
+        text = extract_text_from_bytes(image_bytes)
+        verified = verify_payment_text(text, user_id)
+        if hashes is not None:
+            screenshot_hash_index.record(hashes, user_id, verified)
+        return verified
     except Exception as e:
-        print(f"Error verifying payment: {e}")
+        logger.exception(f"Error verifying payment for user {user_id}: {e}")
         return False
 
+async def verify_payment_screenshot_async(image_bytes: bytes, user_id: int) -> Optional[bool]:
+    """Verify payment screenshot in the OCR process pool without blocking the bot
+    
+    Returns None if the screenshot couldn't be checked (OCR busy, timed out or failed).
+    """
+    # Decoding a full screenshot takes ~20ms; keep it off the event loop
+    hashes = await asyncio.to_thread(hash_screenshot, image_bytes)
+    cached = lookup_screenshot(hashes, user_id)
+    if cached is not None:
+        return cached
+    
+    text = await ocr_service.extract_text(image_bytes)
+    if text is None:
+        return None
+    
+    verified = verify_payment_text(text, user_id)
+    if hashes is not None:
+        screenshot_hash_index.record(hashes, user_id, verified)
+    return verified
+
 def create_payment_instructions(user_id: int) -> dict:
     """Create UPI payment instructions instead of Razorpay link"""
-    users = load_users()
-    user_id_str = str(user_id)
-    if user_id_str not in users["pending"]:
-        users["pending"].append(user_id_str)
-        save_users(users)
+    upi_payment_store.mark_pending(user_id)
     
     return {
         "upi_id": EXPECTED_UPI_ID,
@@ -102,5 +348,4 @@ def create_payment_instructions(user_id: int) -> dict:
 
 def is_user_paid_upi(user_id: int) -> bool:
     """Check if user has paid using UPI system"""
-    users = load_users()
-    return str(user_id) in users["paid"]
\ No newline at end of file
+    return upi_payment_store.is_paid(user_id)
\ No newline at end of file
@@ -0,0 +1,130 @@
+import re
+from typing import Optional
+
+# Characters OCR commonly reads in place of digits (only applied to tokens marked as an amount)
+DIGIT_CONFUSIONS = str.maketrans({
+    "O": "0", "o": "0", "D": "0", "Q": "0",
+    "l": "1", "I": "1", "i": "1", "|": "1", "!": "1",
+    "S": "5", "s": "5",
+    "B": "8",
+    "G": "6",
+    "g": "9", "q": "9",
+    "Z": "2", "z": "2"
+})
+
+# Rupee sign variants, including common OCR misreads of ₹
+CURRENCY_PREFIX_RE = re.compile(r"^(?:₹|rs\.?|inr|%|=|\?)+", re.IGNORECASE)
+CURRENCY_TOKEN_RE = re.compile(r"^(?:₹|rs\.?|inr|%|=|\?)+$", re.IGNORECASE)
+# Words that introduce an amount on receipts ("Amount: 49", "Paid ₹49")
+AMOUNT_LABELS = {"amount", "amt", "total", "paid", "sent", "debited", "received"}
+# Characters looked back from a token for the word before it
+LOOKBEHIND_CHARS = 32
+AMOUNT_RE = re.compile(r"^(\d{1,3}(?:,\d{2,3})*|\d+)(?:\.(\d{1,2}))?$")
+# Separators OCR inserts around "@" and symbols it reads instead of it
+AT_SIGN_CHARS = set("@®©")
+AT_SIGN_RE = re.compile(r"\s*[@®©]\s*")
+UPI_HANDLE_RE = re.compile(r"[a-z0-9._-]{2,256}@[a-z0-9]{2,64}")
+TRAILING_PUNCTUATION = ".,:;)]}'\""
+
+# Confusable characters folded together before comparing UPI handles
+HANDLE_CONFUSIONS = str.maketrans({"0": "o", "1": "l", "i": "l", "|": "l", "5": "s"})
+
+def bounded_edit_distance(a: str, b: str, limit: int) -> Optional[int]:
+    """Levenshtein distance between a and b, or None if it exceeds limit"""
+    if abs(len(a) - len(b)) > limit:
+        return None
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b)
+            ))
+        # Every path through this row already costs more than the limit
+        if min(current) > limit:
+            return None
+        previous = current
+    return previous[-1] if previous[-1] <= limit else None
+
+def is_alone_on_line(text: str, start: int, end: int) -> bool:
+    """Whether text[start:end] is the only token on its line"""
+    line_start = text.rfind("\n", 0, start) + 1
+    line_end = text.find("\n", end)
+    line = text[line_start:line_end if line_end != -1 else len(text)]
+    return line.strip() == text[start:end]
+
+class PaymentMatcher:
+    def __init__(self, expected_amount: int, expected_upi_id: str, max_upi_edits: int = None):
+        self.expected_amount = expected_amount
+        # Tokens that can parse to the expected amount contain its digits (commas allowed between)
+        digits = str(int(expected_amount))
+        self.amount_token_re = re.compile(r"\S*" + ",?".join(digits) + r"\S*")
+        self.expected_upi_id = expected_upi_id.lower()
+        self.folded_upi_id = self.expected_upi_id.translate(HANDLE_CONFUSIONS)
+        # Allow roughly one OCR error per 6 characters of the UPI ID
+        self.max_upi_edits = max_upi_edits if max_upi_edits is not None else max(1, len(self.expected_upi_id) // 6)
+    
+    def parse_amount(self, token: str, fix_confusions: bool = True) -> Optional[float]:
+        """Parse a currency amount token, optionally fixing OCR digit confusions"""
+        token = CURRENCY_PREFIX_RE.sub("", token.strip(TRAILING_PUNCTUATION))
+        if not token or not any(c.isdigit() for c in token):
+            return None
+        match = AMOUNT_RE.match(token.translate(DIGIT_CONFUSIONS) if fix_confusions else token)
+        if not match:
+            return None
+        whole, decimals = match.groups()
+        return int(whole.replace(",", "")) + (int(decimals) / 10 ** len(decimals) if decimals else 0)
+    
+    def has_amount(self, text: str) -> bool:
+        """Check for the expected amount among tokens that contain its digits
+        
+        A token counts if it's marked as an amount (a currency sign or an
+        amount label before it), with misread digits fixed, or if it is
+        alone on its line (the amount line when OCR drops the ₹) and made of
+        real digits. Order ids, refs and noise like "4g" or "O49" don't pass.
+        """
+        # Digit confusions map one character to one, so spans line up with the original text
+        for match in self.amount_token_re.finditer(text.translate(DIGIT_CONFUSIONS)):
+            start, end = match.span()
+            token = text[start:end]
+            if self.is_amount_marked(text, start, token):
+                amount = self.parse_amount(token)
+            elif is_alone_on_line(text, start, end):
+                amount = self.parse_amount(token, fix_confusions=False)
+            else:
+                continue
+            if amount == self.expected_amount:
+                return True
+        return False
+    
+    def is_amount_marked(self, text: str, start: int, token: str) -> bool:
+        """Whether a token has a currency prefix or follows a currency sign or amount label"""
+        if CURRENCY_PREFIX_RE.match(token):
+            return True
+        before = text[max(0, start - LOOKBEHIND_CHARS):start].split()
+        if not before:
+            return False
+        previous = before[-1].strip(TRAILING_PUNCTUATION)
+        return bool(CURRENCY_TOKEN_RE.match(previous)) or previous.lower() in AMOUNT_LABELS
+    
+    def has_upi_id(self, text: str) -> bool:
+        """Check for the expected UPI ID among handle-like tokens"""
+        if not AT_SIGN_CHARS.intersection(text):
+            return False
+        normalized = AT_SIGN_RE.sub("@", text.lower())
+        for token in normalized.split():
+            if "@" not in token:
+                continue
+            candidate = UPI_HANDLE_RE.search(token)
+            if not candidate:
+                continue
+            folded = candidate.group().translate(HANDLE_CONFUSIONS)
+            if bounded_edit_distance(folded, self.folded_upi_id, self.max_upi_edits) is not None:
+                return True
+        return False
+    
+    def matches(self, text: str) -> bool:
+        """Check OCR text for both the expected amount and UPI ID"""
+        return self.has_amount(text) and self.has_upi_id(text)
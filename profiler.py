@@ -0,0 +1,281 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+from telegram.ext import Application, ConversationHandler
+from config import PROFILE_DIR, PROFILE_INTERVAL, LOOP_STALL_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+# Frames kept per sampled stack (innermost ones are dropped beyond this)
+MAX_STACK_DEPTH = 64
+# Rows in the summaries sent to the admin
+REPORT_TOP = 8
+
+def frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}"
+
+def collapse_stack(frame) -> List[str]:
+    """Frame names from outermost to innermost"""
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    names.reverse()
+    return names
+
+def format_stack(frame) -> str:
+    """Readable stack for a log line, innermost call last"""
+    lines = []
+    while frame is not None and len(lines) < MAX_STACK_DEPTH:
+        lines.append(f"  {frame.f_code.co_filename}:{frame.f_lineno} in {frame.f_code.co_name}")
+        frame = frame.f_back
+    return "\n".join(reversed(lines))
+
+def thread_cpu_time(ident: int) -> Optional[float]:
+    """CPU seconds used by a thread (None where per-thread clocks aren't available)"""
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(ident))
+    except (AttributeError, OSError):
+        return None
+
+def handler_codes(app: Application) -> Dict:
+    """Code objects of the application's handler callbacks -> callback name"""
+    codes = {}
+    pending = [handler for handlers in app.handlers.values() for handler in handlers]
+    while pending:
+        handler = pending.pop()
+        if isinstance(handler, ConversationHandler):
+            pending.extend(handler.entry_points)
+            pending.extend(handler.fallbacks)
+            for state_handlers in handler.states.values():
+                pending.extend(state_handlers)
+            continue
+        code = getattr(handler.callback, "__code__", None)
+        if code is not None:
+            codes[code] = getattr(handler.callback, "__qualname__", code.co_name)
+    return codes
+
+class SamplingProfiler:
+    """Samples every thread's stack from a background thread for a fixed time
+    
+    Each sample charges the CPU time a thread used since the previous sample
+    to the thread's current stack (idle threads cost nothing), so the output
+    shows where CPU actually went: SQLite calls, prompt building, JSON or the
+    event loop itself. Event-loop CPU is also attributed to the handler
+    callback on the stack. Results are written to PROFILE_DIR as collapsed
+    stacks (<name>.folded, weights in microseconds, for flamegraph.pl or
+    speedscope) and a JSON summary.
+    """
+    
+    def __init__(self, output_dir: str = PROFILE_DIR, interval: float = PROFILE_INTERVAL):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.task: Optional[asyncio.Task] = None
+        self.handlers: Dict = {}
+    
+    def is_running(self) -> bool:
+        return self.task is not None and not self.task.done()
+    
+    def start(self, app: Application, seconds: float) -> Optional[asyncio.Task]:
+        """Profile for `seconds` in the background, the task returns the summary (None if already running)"""
+        if self.is_running():
+            return None
+        self.handlers = handler_codes(app)
+        self.task = asyncio.create_task(self._run(seconds))
+        return self.task
+    
+    async def _run(self, seconds: float) -> Dict:
+        loop_thread = threading.get_ident()
+        stop = threading.Event()
+        result = {}
+        sampler = threading.Thread(
+            target=self._sample, args=(seconds, loop_thread, stop, result), name="sampling-profiler", daemon=True
+        )
+        stalls_before = loop_stall_monitor.stalls
+        logger.info(f"Profiling for {seconds:.0f}s every {self.interval * 1000:.0f}ms")
+        sampler.start()
+        try:
+            await asyncio.to_thread(sampler.join)
+        finally:
+            stop.set()
+        result["loop_stalls"] = loop_stall_monitor.stalls - stalls_before
+        return await asyncio.to_thread(self._write, result)
+    
+    def _sample(self, seconds: float, loop_thread: int, stop: threading.Event, result: Dict):
+        stacks = Counter()
+        handler_cpu = Counter()
+        self_cpu = Counter()
+        thread_cpu = Counter()
+        last_cpu: Dict[int, float] = {}
+        own = {threading.get_ident(), loop_stall_monitor.ident}
+        samples = 0
+        started = time.monotonic()
+        deadline = started + seconds
+        
+        while time.monotonic() < deadline and not stop.is_set():
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident in own:
+                    continue
+                cpu = thread_cpu_time(ident)
+                if cpu is None:
+                    # No per-thread clock: charge wall time to every sample
+                    used = self.interval
+                else:
+                    used = cpu - last_cpu.get(ident, cpu)
+                    last_cpu[ident] = cpu
+                if used <= 0:
+                    continue
+                
+                thread_name = names.get(ident, str(ident))
+                stack = collapse_stack(frame)
+                stacks[";".join([thread_name] + stack)] += used
+                self_cpu[stack[-1] if stack else thread_name] += used
+                thread_cpu[thread_name] += used
+                if ident == loop_thread:
+                    handler = self._handler_on_stack(frame)
+                    handler_cpu[handler or "(event loop, outside handlers)"] += used
+            samples += 1
+            time.sleep(self.interval)
+        
+        result.update({
+            "duration": time.monotonic() - started,
+            "samples": samples,
+            "stacks": stacks,
+            "handler_cpu": handler_cpu,
+            "self_cpu": self_cpu,
+            "thread_cpu": thread_cpu
+        })
+    
+    def _handler_on_stack(self, frame) -> Optional[str]:
+        """Outermost handler callback in a stack"""
+        handler = None
+        while frame is not None:
+            name = self.handlers.get(frame.f_code)
+            if name:
+                handler = name
+            frame = frame.f_back
+        return handler
+    
+    def _write(self, result: Dict) -> Dict:
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+        with open(f"{base}.folded", "w", encoding="utf-8") as folded:
+            for stack, seconds in result["stacks"].most_common():
+                weight = int(seconds * 1_000_000)
+                if weight:
+                    folded.write(f"{stack} {weight}\n")
+        
+        def milliseconds(counter: Counter) -> Dict[str, float]:
+            return {name: round(seconds * 1000, 1) for name, seconds in counter.most_common()}
+        
+        summary = {
+            "pid": os.getpid(),
+            "duration_s": round(result["duration"], 1),
+            "samples": result["samples"],
+            "cpu_ms": round(sum(result["thread_cpu"].values()) * 1000, 1),
+            "loop_stalls": result["loop_stalls"],
+            "handler_cpu_ms": milliseconds(result["handler_cpu"]),
+            "thread_cpu_ms": milliseconds(result["thread_cpu"]),
+            "self_cpu_ms": milliseconds(result["self_cpu"]),
+            "folded": f"{base}.folded",
+            "summary": f"{base}.json"
+        }
+        with open(f"{base}.json", "w", encoding="utf-8") as summary_file:
+            json.dump(summary, summary_file, indent=2)
+        logger.info(f"Profile written to {base}.folded ({summary['cpu_ms']:.0f}ms CPU in {summary['samples']} samples)")
+        return summary
+
+def format_profile(summary: Dict) -> str:
+    """Short profile summary for the admin"""
+    lines = [
+        f"🔬 Profile of pid {summary['pid']}: {summary['duration_s']}s, {summary['cpu_ms']:.0f}ms CPU, "
+        f"{summary['samples']} samples, {summary['loop_stalls']} loop stalls",
+        "",
+        "Event-loop CPU by handler (ms):"
+    ]
+    lines += [f"• {name}: {ms}" for name, ms in list(summary["handler_cpu_ms"].items())[:REPORT_TOP]]
+    lines += ["", "Top functions (self CPU ms):"]
+    lines += [f"• {name}: {ms}" for name, ms in list(summary["self_cpu_ms"].items())[:REPORT_TOP]]
+    lines += ["", f"Flamegraph input: {summary['folded']}", f"Summary: {summary['summary']}"]
+    return "\n".join(lines)
+
+class LoopStallMonitor:
+    """Logs event-loop stalls longer than a threshold with the stack that caused them
+    
+    A callback on the loop stamps a heartbeat every threshold/4 seconds; a
+    watchdog thread that finds the heartbeat late captures the loop thread's
+    stack while it is still blocked, and logs it once the loop recovers
+    (with the stall's full duration).
+    """
+    
+    def __init__(self, threshold: float = LOOP_STALL_THRESHOLD):
+        self.threshold = threshold
+        self.heartbeat = 0.0
+        self.ident: Optional[int] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread: Optional[int] = None
+        self.stop_event = threading.Event()
+        self.stalls = 0
+        self.longest = 0.0
+        # Stacks already logged, so a recurring stall doesn't flood the log
+        self.seen: Set[str] = set()
+    
+    def start(self):
+        """Watch the running loop (no-op when LOOP_STALL_THRESHOLD is 0)"""
+        if self.threshold <= 0 or self.loop is not None:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.stop_event.clear()
+        self._beat()
+        watchdog = threading.Thread(target=self._watch, name="loop-stall-monitor", daemon=True)
+        watchdog.start()
+        self.ident = watchdog.ident
+    
+    def stop(self):
+        self.stop_event.set()
+        self.loop = None
+    
+    def _beat(self):
+        self.heartbeat = time.monotonic()
+        if self.loop is not None and not self.stop_event.is_set():
+            self.loop.call_later(self.threshold / 4, self._beat)
+    
+    def _watch(self):
+        check = self.threshold / 4
+        while not self.stop_event.wait(check):
+            late = time.monotonic() - self.heartbeat
+            if late < self.threshold + check:
+                continue
+            frame = sys._current_frames().get(self.loop_thread)
+            stack = format_stack(frame) if frame is not None else "  (unavailable)"
+            # Wait for the loop to come back to report the whole stall
+            beat = self.heartbeat
+            while self.heartbeat == beat and not self.stop_event.wait(check):
+                pass
+            stalled = self.heartbeat - beat - check
+            self.stalls += 1
+            self.longest = max(self.longest, stalled)
+            leaf = collapse_stack(frame)[-3:] if frame is not None else []
+            key = ";".join(leaf)
+            if key in self.seen:
+                logger.warning(f"Event loop stalled for {stalled * 1000:.0f}ms in {' > '.join(leaf)} (stack logged before)")
+            else:
+                self.seen.add(key)
+                logger.warning(f"Event loop stalled for {stalled * 1000:.0f}ms, loop thread was in:\n{stack}")
+    
+    def get_stats(self) -> Dict:
+        return {"stalls": self.stalls, "longest_ms": round(self.longest * 1000, 1), "threshold_ms": self.threshold * 1000}
+
+# Global profiler (started by the admin /profile command) and stall monitor (started in bot.on_startup)
+sampling_profiler = SamplingProfiler()
+loop_stall_monitor = LoopStallMonitor()
@@ -0,0 +1,174 @@
+import sqlite3
+import logging
+from io import BytesIO
+from typing import Optional, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+HASH_BITS = 64
+# Candidate screenshots are within this many differing bits of the 64-bit dHash
+MAX_HAMMING_DISTANCE = 6
+# The hash is split into 8 bands of 8 bits; two hashes within 7 bits of each
+# other must agree exactly on at least one band, so bands work as lookup keys
+BAND_BITS = 8
+BANDS = HASH_BITS // BAND_BITS
+
+# Receipts from the same app share a layout and collide on the 64-bit hash, so
+# candidates are confirmed with a finer gradient hash that sees the text itself
+FINE_HASH_SIZE = (32, 64)
+FINE_GRADIENT_THRESHOLD = 6  # Ignore brightness steps smaller than this (JPEG noise)
+FINE_MAX_DISTANCE = 40  # Rescaled/re-encoded copies measured <= 21, other receipts with the same layout >= 75
+
+def image_hashes(image_bytes: bytes) -> Tuple[int, int]:
+    """Coarse 64-bit dHash and fine gradient hash of an image"""
+    from PIL import Image
+    
+    # Full decode on purpose: JPEG draft-mode scaling depends on the input size
+    # and made rescaled copies of the same screenshot hash far apart
+    gray = Image.open(BytesIO(image_bytes)).convert("L")
+    
+    coarse = 0
+    pixels = gray.resize((9, 8), Image.BILINEAR).tobytes()
+    for row in range(8):
+        for col in range(8):
+            coarse = (coarse << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    
+    # Two bits per cell: brighter-than-right and darker-than-right
+    width, height = FINE_HASH_SIZE
+    fine = 0
+    pixels = gray.resize((width + 1, height), Image.BOX).tobytes()
+    for row in range(height):
+        for col in range(width):
+            step = pixels[row * (width + 1) + col] - pixels[row * (width + 1) + col + 1]
+            fine = (fine << 2) | ((step > FINE_GRADIENT_THRESHOLD) << 1) | (step < -FINE_GRADIENT_THRESHOLD)
+    return coarse, fine
+
+def _to_signed(value: int) -> int:
+    """SQLite integers are signed 64-bit"""
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+def _to_unsigned(value: int) -> int:
+    return value + (1 << HASH_BITS) if value < 0 else value
+
+def _fine_to_blob(value: int) -> bytes:
+    return value.to_bytes(FINE_HASH_SIZE[0] * FINE_HASH_SIZE[1] // 4, "big")
+
+class ScreenshotHashIndex:
+    def __init__(self, db_path: str = "sextbot.db"):
+        self.db_path = db_path
+        self.entries: List[Dict] = None
+        # (band number, band value) -> entry positions
+        self.bands: Dict[tuple, List[int]] = {}
+    
+    def init_database(self):
+        """Initialize tables for screenshot hashes and reuse flags"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS screenshot_hashes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                dhash INTEGER NOT NULL,
+                fine_hash BLOB NOT NULL,
+                user_id INTEGER NOT NULL,
+                verified INTEGER NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Screenshots submitted by one user that match another user's screenshot
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS screenshot_reuse (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                original_user_id INTEGER NOT NULL,
+                dhash INTEGER NOT NULL,
+                distance INTEGER NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        conn.commit()
+        conn.close()
+    
+    def load(self):
+        """Load all known hashes into memory once"""
+        if self.entries is not None:
+            return
+        
+        self.init_database()
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute("SELECT dhash, fine_hash, user_id, verified FROM screenshot_hashes ORDER BY id")
+        rows = cursor.fetchall()
+        conn.close()
+        
+        self.entries = []
+        for value, fine, user_id, verified in rows:
+            self._add((_to_unsigned(value), int.from_bytes(fine, "big")), user_id, bool(verified))
+        logger.info(f"Loaded {len(self.entries)} screenshot hashes")
+    
+    def _add(self, hashes: Tuple[int, int], user_id: int, verified: bool):
+        """Add a screenshot's hashes to the in-memory index"""
+        value, fine = hashes
+        position = len(self.entries)
+        self.entries.append({"dhash": value, "fine_hash": fine, "user_id": user_id, "verified": verified})
+        for band in range(BANDS):
+            key = (band, (value >> (band * BAND_BITS)) & 0xFF)
+            self.bands.setdefault(key, []).append(position)
+    
+    def find(self, hashes: Tuple[int, int], user_id: int) -> Optional[Dict]:
+        """Find the closest known screenshot, preferring the same user's submissions"""
+        self.load()
+        value, fine = hashes
+        
+        best = None
+        seen = set()
+        for band in range(BANDS):
+            for position in self.bands.get((band, (value >> (band * BAND_BITS)) & 0xFF), ()):
+                if position in seen:
+                    continue
+                seen.add(position)
+                entry = self.entries[position]
+                distance = bin(entry["dhash"] ^ value).count("1")
+                if distance > MAX_HAMMING_DISTANCE:
+                    continue
+                distance = bin(entry["fine_hash"] ^ fine).count("1")
+                if distance > FINE_MAX_DISTANCE:
+                    continue
+                # Rank by (other user?, distance) so a user's own resubmission wins
+                rank = (entry["user_id"] != user_id, distance)
+                if best is None or rank < best[0]:
+                    best = (rank, dict(entry, distance=distance))
+        
+        return best[1] if best else None
+    
+    def record(self, hashes: Tuple[int, int], user_id: int, verified: bool):
+        """Store the verification result for a screenshot"""
+        self.load()
+        value, fine = hashes
+        conn = sqlite3.connect(self.db_path)
+        conn.execute(
+            "INSERT INTO screenshot_hashes (dhash, fine_hash, user_id, verified) VALUES (?, ?, ?, ?)",
+            (_to_signed(value), _fine_to_blob(fine), user_id, int(verified))
+        )
+        conn.commit()
+        conn.close()
+        self._add(hashes, user_id, verified)
+    
+    def flag_reuse(self, hashes: Tuple[int, int], user_id: int, match: Dict):
+        """Record a screenshot that duplicates another user's submission"""
+        logger.warning(
+            f"Screenshot reuse: user {user_id} sent a screenshot matching user {match['user_id']}'s "
+            f"(distance {match['distance']})"
+        )
+        conn = sqlite3.connect(self.db_path)
+        conn.execute(
+            "INSERT INTO screenshot_reuse (user_id, original_user_id, dhash, distance) VALUES (?, ?, ?, ?)",
+            (user_id, match["user_id"], _to_signed(hashes[0]), match["distance"])
+        )
+        conn.commit()
+        conn.close()
+
+# Global screenshot hash index (loaded on first use)
+screenshot_hash_index = ScreenshotHashIndex()
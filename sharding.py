@@ -0,0 +1,338 @@
+import os
+import json
+import time
+import zlib
+import shutil
+import signal
+import asyncio
+import logging
+import tempfile
+import multiprocessing
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+from telegram import Update
+from telegram.ext import Application, ContextTypes, TypeHandler
+from config import SHARD_WORKERS, SHUTDOWN_GRACE_SECONDS, WEBHOOK_MAX_BODY, TELEGRAM_API_BASE_URL
+from traffic_recorder import traffic_recorder
+from logging_pipeline import log_pipeline
+
+logger = logging.getLogger(__name__)
+
+# Seconds between worker health reports
+HEALTH_INTERVAL = 5.0
+# Workers that haven't reported for this long are flagged as unresponsive
+HEALTH_TIMEOUT = 3 * HEALTH_INTERVAL
+# Seconds between worker summaries in the supervisor's log
+STATS_LOG_INTERVAL = 60.0
+# Seconds the supervisor waits for buffered updates to reach the workers when stopping
+FLUSH_TIMEOUT = 5.0
+# Seconds to wait before restarting a worker that exited
+RESTART_DELAY = 1.0
+
+# (worker index, worker count) inside a worker process, None otherwise
+current_shard: Optional[Tuple[int, int]] = None
+
+def shard_for(key: int, workers: int) -> int:
+    """Worker that owns a user (or chat) id"""
+    return zlib.crc32(str(key).encode()) % workers
+
+def owns_user(user_id: int) -> bool:
+    """Whether this process handles the user (always true without sharding)"""
+    return current_shard is None or shard_for(user_id, current_shard[1]) == current_shard[0]
+
+def is_primary_worker() -> bool:
+    """Whether this process runs database-wide jobs (worker 0, or the only process)"""
+    return current_shard is None or current_shard[0] == 0
+
+def update_key(update: Update) -> int:
+    """User id an update is sharded by (chat id for updates without a user)"""
+    if update.effective_user:
+        return update.effective_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    return 0
+
+class WorkerLink:
+    """Supervisor's view of one worker process"""
+    
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[multiprocessing.Process] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        # Serialized updates not yet written to the worker
+        self.pending = deque()
+        self.wakeup = asyncio.Event()
+        self.health: Dict = {}
+        self.last_seen = 0.0
+        self.forwarded = 0
+        self.restarts = 0
+    
+    def queue_depth(self) -> int:
+        """Updates buffered here plus those waiting or running in the worker"""
+        return len(self.pending) + self.health.get("queued", 0) + self.health.get("in_flight", 0)
+    
+    def get_stats(self) -> Dict:
+        return {
+            "pid": self.process.pid if self.process else None,
+            "alive": bool(self.process and self.process.is_alive()),
+            "connected": self.writer is not None,
+            "responsive": time.monotonic() - self.last_seen < HEALTH_TIMEOUT,
+            "forwarded": self.forwarded,
+            "buffered": len(self.pending),
+            "queue_depth": self.queue_depth(),
+            "restarts": self.restarts,
+            **self.health
+        }
+
+class ShardSupervisor:
+    """Ingress process that forwards updates to worker processes by user id
+    
+    The ingress receives updates (polling or webhook) in a handler-less
+    application and writes each one, as a JSON line over a Unix socket, to the
+    worker chosen by shard_for(). Each worker runs the full bot for its users,
+    so a user's updates, conversation state and caches stay in one process.
+    Workers report health every few seconds; dead workers are restarted.
+    Updates are delivered at most once, like polling itself.
+    """
+    
+    def __init__(self, workers: int = SHARD_WORKERS):
+        self.workers = max(1, workers)
+        self.links: List[WorkerLink] = []
+        self.server = None
+        self.socket_dir = None
+        self.socket_path = None
+        self.monitor_task = None
+        self.stopping = False
+    
+    def build_ingress(self, token: str) -> Application:
+        """Application that only receives updates and forwards them"""
+        app = (
+            Application.builder()
+            .token(token)
+            .base_url(TELEGRAM_API_BASE_URL)
+            .post_init(self.start)
+            .post_shutdown(self.stop)
+            .build()
+        )
+        app.add_handler(TypeHandler(Update, self.forward))
+        return app
+    
+    async def forward(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        traffic_recorder.record(update)
+        link = self.links[shard_for(update_key(update), self.workers)]
+        link.pending.append(json.dumps(update.to_dict()).encode() + b"\n")
+        link.forwarded += 1
+        link.wakeup.set()
+    
+    async def start(self, app: Application = None):
+        """Open the IPC socket and start the workers"""
+        self.socket_dir = tempfile.mkdtemp(prefix="sextbot-shards-")
+        self.socket_path = os.path.join(self.socket_dir, "ingress.sock")
+        self.server = await asyncio.start_unix_server(self._handle_worker, self.socket_path, limit=WEBHOOK_MAX_BODY)
+        self.links = [WorkerLink(index) for index in range(self.workers)]
+        for link in self.links:
+            self._spawn(link)
+        self.monitor_task = asyncio.create_task(self._monitor())
+        logger.info(f"Supervisor started {self.workers} workers on {self.socket_path}")
+    
+    def _spawn(self, link: WorkerLink):
+        # spawn keeps workers independent of the ingress event loop and threads
+        link.process = multiprocessing.get_context("spawn").Process(
+            target=run_worker, args=(link.index, self.workers, self.socket_path),
+            name=f"shard-worker-{link.index}", daemon=False
+        )
+        link.process.start()
+        link.last_seen = time.monotonic()
+    
+    async def _handle_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """One worker's connection: updates go out, health reports come in"""
+        try:
+            hello = json.loads(await reader.readline())
+            link = self.links[hello["worker"]]
+        except (ValueError, KeyError, IndexError, TypeError):
+            writer.close()
+            return
+        
+        link.writer = writer
+        link.last_seen = time.monotonic()
+        logger.info(f"Worker {link.index} connected (pid {hello.get('pid')})")
+        sender = asyncio.create_task(self._send_updates(link, writer))
+        try:
+            async for line in reader:
+                message = json.loads(line)
+                if "health" in message:
+                    link.health = message["health"]
+                    link.last_seen = time.monotonic()
+        except (ConnectionError, ValueError) as e:
+            logger.warning(f"Worker {link.index} connection error: {e}")
+        finally:
+            sender.cancel()
+            if link.writer is writer:
+                link.writer = None
+            writer.close()
+            logger.info(f"Worker {link.index} disconnected")
+    
+    async def _send_updates(self, link: WorkerLink, writer: asyncio.StreamWriter):
+        while True:
+            link.wakeup.clear()
+            while link.pending:
+                writer.write(link.pending.popleft())
+                await writer.drain()
+            await link.wakeup.wait()
+    
+    async def _monitor(self):
+        """Restart exited workers and log queue depth"""
+        last_log = time.monotonic()
+        while not self.stopping:
+            await asyncio.sleep(HEALTH_INTERVAL)
+            for link in self.links:
+                if self.stopping:
+                    break
+                if not link.process.is_alive():
+                    logger.error(f"Worker {link.index} exited with code {link.process.exitcode}, restarting")
+                    link.restarts += 1
+                    link.health = {}
+                    await asyncio.sleep(RESTART_DELAY)
+                    self._spawn(link)
+                elif time.monotonic() - link.last_seen > HEALTH_TIMEOUT:
+                    logger.warning(f"Worker {link.index} hasn't reported for {time.monotonic() - link.last_seen:.0f}s")
+            
+            if time.monotonic() - last_log >= STATS_LOG_INTERVAL:
+                last_log = time.monotonic()
+                depths = ", ".join(f"{link.index}: {link.queue_depth()}" for link in self.links)
+                logger.info(f"Worker queue depths: {depths}")
+    
+    async def stop(self, app: Application = None):
+        """Hand buffered updates to the workers, then stop them (each drains its replies)"""
+        self.stopping = True
+        if self.monitor_task is not None:
+            self.monitor_task.cancel()
+        
+        deadline = time.monotonic() + FLUSH_TIMEOUT
+        while any(link.pending and link.writer for link in self.links) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        lost = sum(len(link.pending) for link in self.links)
+        if lost:
+            logger.warning(f"{lost} updates couldn't be handed to a worker before stopping")
+        
+        for link in self.links:
+            if link.process is not None and link.process.is_alive():
+                link.process.terminate()
+        # Workers wait up to SHUTDOWN_GRACE_SECONDS for in-flight replies
+        for link in self.links:
+            if link.process is None:
+                continue
+            await asyncio.to_thread(link.process.join, SHUTDOWN_GRACE_SECONDS + 10)
+            if link.process.is_alive():
+                logger.error(f"Worker {link.index} didn't stop in time, killing it")
+                link.process.kill()
+        
+        if self.server is not None:
+            self.server.close()
+        shutil.rmtree(self.socket_dir, ignore_errors=True)
+        logger.info(f"Supervisor stopped: {self.get_stats()}")
+    
+    def get_stats(self) -> Dict:
+        """Per-worker health and queue depth (also served on the webhook's /health)"""
+        return {"workers": {link.index: link.get_stats() for link in self.links}}
+
+def run_worker(index: int, workers: int, socket_path: str):
+    """Worker process entry point"""
+    # Spawned processes start without the parent's logging setup
+    log_pipeline.start()
+    try:
+        asyncio.run(_worker_main(index, workers, socket_path))
+    except KeyboardInterrupt:
+        pass
+
+async def _worker_main(index: int, workers: int, socket_path: str):
+    global current_shard
+    current_shard = (index, workers)
+    # Imported here: bot imports this module for the supervisor
+    from bot import build_application, updates_in_flight
+    from startup import initialize_services
+    from flood_control import flood_control
+    from ocr_service import ocr_service
+    from shutdown import shutdown_coordinator
+    from update_processor import update_processor
+    
+    initialize_services()
+    # Telegram's global limit and the CPU cores are shared by all workers
+    flood_control.share_global_limit(workers)
+    ocr_service.workers = max(1, ocr_service.workers // workers)
+    app = build_application(updater=False)
+    
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    
+    def on_signal():
+        if stop_event.is_set():
+            # Second signal: stop waiting for replies
+            shutdown_coordinator.grace_seconds = 0
+        stop_event.set()
+    
+    loop.add_signal_handler(signal.SIGTERM, on_signal)
+    # Ctrl+C reaches the whole process group; the supervisor stops workers with SIGTERM
+    loop.add_signal_handler(signal.SIGINT, lambda: None)
+    
+    reader, writer = await asyncio.open_unix_connection(socket_path, limit=WEBHOOK_MAX_BODY)
+    writer.write(json.dumps({"worker": index, "pid": os.getpid()}).encode() + b"\n")
+    await writer.drain()
+    
+    received = 0
+    
+    async def read_updates():
+        nonlocal received
+        async for line in reader:
+            try:
+                update = Update.de_json(json.loads(line), app.bot)
+            except (ValueError, TypeError, KeyError) as e:
+                logger.error(f"Worker {index} got an invalid update: {e}")
+                continue
+            received += 1
+            await app.update_queue.put(update)
+        logger.warning(f"Worker {index} lost the connection to the supervisor")
+    
+    async def report_health():
+        while True:
+            health = {
+                "pid": os.getpid(),
+                "received": received,
+                "queued": app.update_queue.qsize(),
+                "in_flight": update_processor.in_flight,
+                "lanes": len(update_processor.lanes),
+                "send_queue": len(flood_control.waiting)
+            }
+            try:
+                writer.write(json.dumps({"health": health}).encode() + b"\n")
+                await writer.drain()
+            except ConnectionError:
+                return
+            await asyncio.sleep(HEALTH_INTERVAL)
+    
+    async with app:
+        if app.post_init:
+            await app.post_init(app)
+        await app.start()
+        reading = asyncio.create_task(read_updates())
+        reporting = asyncio.create_task(report_health())
+        logger.info(f"Worker {index}/{workers} started (pid {os.getpid()})")
+        
+        # Stop on a signal, or when the supervisor goes away
+        stopped = asyncio.create_task(stop_event.wait())
+        await asyncio.wait({stopped, reading}, return_when=asyncio.FIRST_COMPLETED)
+        stopped.cancel()
+        reading.cancel()
+        
+        await shutdown_coordinator.drain(app, updates_in_flight)
+        reporting.cancel()
+        writer.close()
+        await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+    
+    if app.post_shutdown:
+        await app.post_shutdown(app)
+
+# Global supervisor (used when SHARD_WORKERS > 1)
+shard_supervisor = ShardSupervisor()
@@ -0,0 +1,176 @@
+import time
+import signal
+import sqlite3
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, List
+from telegram.ext import Application
+from config import SHUTDOWN_GRACE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Replies older than this aren't worth sending after a restart
+RESUME_MAX_AGE_MINUTES = 60
+# Replies regenerated at once after a restart
+RESUME_CONCURRENCY = 4
+
+class ShutdownCoordinator:
+    """Drains in-flight work on SIGTERM/SIGINT and resumes unfinished replies on the next start
+    
+    Stopping: stop fetching updates, wait up to grace_seconds for in-flight
+    updates (replies being generated and sent), then cancel the remaining
+    generations and record them in pending_replies. The application's own
+    stop/shutdown then flushes persistence and post_shutdown releases the rest.
+    """
+    
+    def __init__(self, db_path: str = "sextbot.db", grace_seconds: float = SHUTDOWN_GRACE_SECONDS):
+        self.db_path = db_path
+        self.grace_seconds = grace_seconds
+        self.generations: Dict[asyncio.Task, Dict] = {}
+        self.draining = False
+        self.drain_task = None
+        self.resume_task = None
+    
+    def init_database(self):
+        """Initialize table for replies interrupted by a shutdown"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS pending_replies (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                chat_id INTEGER NOT NULL,
+                character_id TEXT,
+                character_price INTEGER DEFAULT 0,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        conn.commit()
+        conn.close()
+    
+    @asynccontextmanager
+    async def generation(self, user_id: int, chat_id: int, character_id: str = None, character_price: int = 0):
+        """Mark a reply being generated and sent, so a shutdown can wait for it or record it"""
+        task = asyncio.current_task()
+        self.generations[task] = {
+            "user_id": user_id,
+            "chat_id": chat_id,
+            "character_id": character_id,
+            "character_price": character_price
+        }
+        try:
+            yield
+        except asyncio.CancelledError:
+            if self.draining:
+                self._record(self.generations[task])
+            raise
+        finally:
+            del self.generations[task]
+    
+    def _record(self, pending: Dict):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute(
+            "INSERT INTO pending_replies (user_id, chat_id, character_id, character_price) VALUES (?, ?, ?, ?)",
+            (pending["user_id"], pending["chat_id"], pending["character_id"], pending["character_price"])
+        )
+        conn.commit()
+        conn.close()
+        logger.info(f"Reply for user {pending['user_id']} recorded to resume after restart")
+    
+    async def drain(self, app: Application, in_flight: Callable[[], int]):
+        """Stop taking updates and wait for in-flight ones, cancelling generations at the deadline"""
+        self.draining = True
+        started = time.monotonic()
+        logger.info(f"Shutting down: waiting up to {self.grace_seconds:.0f}s for {in_flight()} in-flight updates")
+        
+        if app.updater and app.updater.running:
+            await app.updater.stop()
+        
+        # grace_seconds drops to 0 on a second signal
+        while (in_flight() or self.generations) and time.monotonic() < started + self.grace_seconds:
+            await asyncio.sleep(0.1)
+        
+        unfinished = list(self.generations)
+        if unfinished:
+            logger.warning(f"Shutdown deadline reached, cancelling {len(unfinished)} replies")
+            for task in unfinished:
+                task.cancel()
+            await asyncio.gather(*unfinished, return_exceptions=True)
+        
+        logger.info(f"Drained in {time.monotonic() - started:.1f}s, {len(unfinished)} replies left to resume")
+    
+    def install_signal_handlers(self, app: Application, in_flight: Callable[[], int]):
+        """Drain on SIGTERM/SIGINT before the application stops (use with run_polling(stop_signals=None))"""
+        loop = asyncio.get_running_loop()
+        
+        def on_signal():
+            if self.drain_task is not None:
+                # Second signal: stop waiting
+                self.grace_seconds = 0
+                return
+            self.drain_task = asyncio.create_task(self._drain_and_stop(app, in_flight))
+        
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, on_signal)
+    
+    async def _drain_and_stop(self, app: Application, in_flight: Callable[[], int]):
+        try:
+            await self.drain(app, in_flight)
+        finally:
+            app.stop_running()
+    
+    def take_pending(self, owns_user: Callable[[int], bool] = None) -> List[Dict]:
+        """Remove and return recent replies recorded by the last shutdown (one per user)
+        
+        With owns_user, only that process's users are taken (sharded workers).
+        """
+        max_age = f"-{RESUME_MAX_AGE_MINUTES} minutes"
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT user_id, chat_id, character_id, character_price FROM pending_replies
+            WHERE created_at >= datetime('now', ?)
+            GROUP BY user_id
+        """, (max_age,))
+        rows = [row for row in cursor.fetchall() if owns_user is None or owns_user(row[0])]
+        cursor.executemany("DELETE FROM pending_replies WHERE user_id = ?", [(row[0],) for row in rows])
+        cursor.execute("DELETE FROM pending_replies WHERE created_at < datetime('now', ?)", (max_age,))
+        conn.commit()
+        conn.close()
+        return [
+            {"user_id": row[0], "chat_id": row[1], "character_id": row[2], "character_price": row[3]}
+            for row in rows
+        ]
+    
+    async def resume(self, resume_reply: Callable[[Dict], Awaitable], owns_user: Callable[[int], bool] = None,
+                     run_in_lane: Callable[[int, Awaitable], Awaitable] = None):
+        """Finish replies interrupted by the last shutdown
+        
+        With run_in_lane each reply runs in its user's update lane, so a new
+        message from the user waits for the resumed reply instead of racing it.
+        run_in_lane shouldn't also take an update slot: resumed replies wait
+        on RESUME_CONCURRENCY inside the lane and would starve live users.
+        """
+        pending = self.take_pending(owns_user)
+        if not pending:
+            return
+        logger.info(f"Resuming {len(pending)} replies interrupted by the last shutdown")
+        
+        slots = asyncio.Semaphore(RESUME_CONCURRENCY)
+        
+        async def resume_one(item: Dict):
+            async with slots:
+                try:
+                    async with self.generation(**item):
+                        await resume_reply(item)
+                except Exception as e:
+                    logger.error(f"Could not resume reply for user {item['user_id']}: {e}")
+        
+        # The lane is taken before waiting for a resume slot, ahead of any new update
+        await asyncio.gather(*(
+            run_in_lane(item["user_id"], resume_one(item)) if run_in_lane else resume_one(item)
+            for item in pending
+        ))
+
+# Global shutdown coordinator
+shutdown_coordinator = ShutdownCoordinator()
@@ -0,0 +1,295 @@
+import json
+import sqlite3
+import asyncio
+import logging
+from typing import Dict, Optional, Set, Tuple
+from telegram import Update
+from telegram.ext import BasePersistence, ConversationHandler, PersistenceInput
+from config import PERSISTENCE_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+class SQLitePersistence(BasePersistence):
+    """PTB persistence in SQLite that loads lazily and writes only what changed
+    
+    Nothing per user is read at startup: user/chat data is loaded on a user's
+    first update (refresh_*_data) and conversation states through
+    LazyConversationHandler. Changes handed over by the application every
+    update_interval seconds are buffered and written in one transaction;
+    entries whose content didn't change since the last write are skipped.
+    Data is stored as JSON, so keep user_data/chat_data JSON-serializable.
+    """
+    
+    def __init__(self, db_path: str = "sextbot.db", update_interval: float = PERSISTENCE_FLUSH_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=True, chat_data=True, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.db_path = db_path
+        self.loaded_users: Set[int] = set()
+        self.loaded_chats: Set[int] = set()
+        self.loaded_conversations: Set[Tuple[str, str]] = set()
+        # Hash of the JSON last written per entry, to skip unchanged data
+        self.written: Dict[tuple, int] = {}
+        # Pending writes; None means delete
+        self.dirty_users: Dict[int, Optional[str]] = {}
+        self.dirty_chats: Dict[int, Optional[str]] = {}
+        self.dirty_conversations: Dict[Tuple[str, str], Optional[str]] = {}
+        self.dirty_bot_data: Optional[str] = None
+        self.write_task: Optional[asyncio.Task] = None
+        self.stats = {"writes": 0, "rows_written": 0, "skipped_unchanged": 0, "lazy_loads": 0}
+    
+    def init_database(self):
+        """Initialize persistence tables"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ptb_conversations (
+                name TEXT NOT NULL,
+                conversation_key TEXT NOT NULL,
+                state TEXT NOT NULL,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (name, conversation_key)
+            )
+        """)
+        
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ptb_user_data (
+                user_id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ptb_chat_data (
+                chat_id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ptb_bot_data (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                data TEXT NOT NULL
+            )
+        """)
+        
+        conn.commit()
+        conn.close()
+    
+    def _load_json(self, query: str, params: tuple) -> Optional[object]:
+        conn = sqlite3.connect(self.db_path)
+        row = conn.execute(query, params).fetchone()
+        conn.close()
+        return json.loads(row[0]) if row else None
+    
+    def _mark_dirty(self, buffer: Dict, key, entry: tuple, data: Optional[str]):
+        """Buffer a write unless the content matches what was last written"""
+        if data is not None and self.written.get(entry) == hash(data):
+            self.stats["skipped_unchanged"] += 1
+            return
+        buffer[key] = data
+        self._schedule_write()
+    
+    def _schedule_write(self):
+        # The application hands over all changes of one interval in a single
+        # gather(); writing after it finishes turns them into one transaction
+        if self.write_task is None or self.write_task.done():
+            self.write_task = asyncio.create_task(self._write_soon())
+    
+    async def _write_soon(self):
+        await asyncio.sleep(0)
+        batch = self._take_pending()
+        if batch:
+            await self._commit(batch, asyncio.to_thread(self._write_batch, *batch))
+    
+    def _take_pending(self) -> Optional[tuple]:
+        """Take the buffered changes (on the event loop, so none are lost mid-write)"""
+        batch = (self.dirty_users, self.dirty_chats, self.dirty_conversations, self.dirty_bot_data)
+        self.dirty_users, self.dirty_chats, self.dirty_conversations, self.dirty_bot_data = {}, {}, {}, None
+        users, chats, conversations, bot_data = batch
+        if not (users or chats or conversations or bot_data is not None):
+            return None
+        return batch
+    
+    async def _commit(self, batch: tuple, write):
+        users, chats, conversations, bot_data = batch
+        try:
+            await write
+        except Exception as e:
+            logger.error(f"Error writing persistence: {e}")
+            # Put the changes back (unless newer ones arrived meanwhile) for the next write
+            for buffer, changes in ((self.dirty_users, users), (self.dirty_chats, chats),
+                                    (self.dirty_conversations, conversations)):
+                for key, data in changes.items():
+                    buffer.setdefault(key, data)
+            if self.dirty_bot_data is None:
+                self.dirty_bot_data = bot_data
+            return
+        
+        for prefix, changes in (("user", users), ("chat", chats), ("conversation", conversations)):
+            for key, data in changes.items():
+                if data is None:
+                    self.written.pop((prefix, key), None)
+                else:
+                    self.written[(prefix, key)] = hash(data)
+        self.stats["writes"] += 1
+        self.stats["rows_written"] += len(users) + len(chats) + len(conversations) + (bot_data is not None)
+    
+    def _write_batch(self, users: Dict, chats: Dict, conversations: Dict, bot_data: Optional[str]):
+        """Write one batch of changes in a single transaction"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                conn.executemany("""
+                    INSERT INTO ptb_conversations (name, conversation_key, state) VALUES (?, ?, ?)
+                    ON CONFLICT (name, conversation_key) DO UPDATE SET state = excluded.state, updated_at = CURRENT_TIMESTAMP
+                """, [(name, key, state) for (name, key), state in conversations.items() if state is not None])
+                conn.executemany(
+                    "DELETE FROM ptb_conversations WHERE name = ? AND conversation_key = ?",
+                    [(name, key) for (name, key), state in conversations.items() if state is None]
+                )
+                
+                for table, column, changes in (("ptb_user_data", "user_id", users), ("ptb_chat_data", "chat_id", chats)):
+                    conn.executemany(f"""
+                        INSERT INTO {table} ({column}, data) VALUES (?, ?)
+                        ON CONFLICT ({column}) DO UPDATE SET data = excluded.data, updated_at = CURRENT_TIMESTAMP
+                    """, [(key, data) for key, data in changes.items() if data is not None])
+                    conn.executemany(
+                        f"DELETE FROM {table} WHERE {column} = ?",
+                        [(key,) for key, data in changes.items() if data is None]
+                    )
+                
+                if bot_data is not None:
+                    conn.execute("INSERT OR REPLACE INTO ptb_bot_data (id, data) VALUES (1, ?)", (bot_data,))
+        finally:
+            conn.close()
+    
+    # Loading: nothing per user at startup
+    
+    async def get_user_data(self) -> Dict[int, Dict]:
+        return {}
+    
+    async def get_chat_data(self) -> Dict[int, Dict]:
+        return {}
+    
+    async def get_bot_data(self) -> Dict:
+        return self._load_json("SELECT data FROM ptb_bot_data WHERE id = 1", ()) or {}
+    
+    async def get_callback_data(self) -> None:
+        return None
+    
+    async def get_conversations(self, name: str) -> Dict:
+        # States are loaded per key by LazyConversationHandler
+        return {}
+    
+    def load_conversation_state(self, name: str, key: tuple) -> Optional[object]:
+        """Persisted state of one conversation, read at most once per key"""
+        entry = (name, json.dumps(key))
+        if entry in self.loaded_conversations:
+            return None
+        self.loaded_conversations.add(entry)
+        self.stats["lazy_loads"] += 1
+        state = self._load_json(
+            "SELECT state FROM ptb_conversations WHERE name = ? AND conversation_key = ?", entry
+        )
+        if state is not None:
+            self.written[("conversation", entry)] = hash(json.dumps(state))
+        return state
+    
+    async def refresh_user_data(self, user_id: int, user_data: Dict) -> None:
+        if user_id in self.loaded_users:
+            return
+        self.loaded_users.add(user_id)
+        stored = self._load_json("SELECT data FROM ptb_user_data WHERE user_id = ?", (user_id,))
+        if stored:
+            # Keep anything set before the first refresh
+            user_data.update({key: value for key, value in stored.items() if key not in user_data})
+    
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict) -> None:
+        if chat_id in self.loaded_chats:
+            return
+        self.loaded_chats.add(chat_id)
+        stored = self._load_json("SELECT data FROM ptb_chat_data WHERE chat_id = ?", (chat_id,))
+        if stored:
+            chat_data.update({key: value for key, value in stored.items() if key not in chat_data})
+    
+    async def refresh_bot_data(self, bot_data: Dict) -> None:
+        pass
+    
+    # Writing: buffered, unchanged entries skipped
+    
+    async def update_user_data(self, user_id: int, data: Dict) -> None:
+        # Empty data for a user with nothing stored doesn't need a row
+        if not data and ("user", user_id) not in self.written and user_id not in self.dirty_users:
+            return
+        self._mark_dirty(self.dirty_users, user_id, ("user", user_id), json.dumps(data, sort_keys=True))
+    
+    async def update_chat_data(self, chat_id: int, data: Dict) -> None:
+        if not data and ("chat", chat_id) not in self.written and chat_id not in self.dirty_chats:
+            return
+        self._mark_dirty(self.dirty_chats, chat_id, ("chat", chat_id), json.dumps(data, sort_keys=True))
+    
+    async def update_bot_data(self, data: Dict) -> None:
+        serialized = json.dumps(data, sort_keys=True)
+        if self.written.get(("bot", 1)) == hash(serialized):
+            return
+        self.written[("bot", 1)] = hash(serialized)
+        self.dirty_bot_data = serialized
+        self._schedule_write()
+    
+    async def update_callback_data(self, data) -> None:
+        pass
+    
+    async def update_conversation(self, name: str, key: tuple, new_state: Optional[object]) -> None:
+        conversation_key = json.dumps(key)
+        self.loaded_conversations.add((name, conversation_key))
+        self._mark_dirty(
+            self.dirty_conversations, (name, conversation_key), ("conversation", (name, conversation_key)),
+            None if new_state is None else json.dumps(new_state)
+        )
+    
+    async def drop_user_data(self, user_id: int) -> None:
+        self.dirty_users[user_id] = None
+        self._schedule_write()
+    
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self.dirty_chats[chat_id] = None
+        self._schedule_write()
+    
+    async def flush(self) -> None:
+        """Write everything still buffered (called when the application stops)"""
+        if self.write_task is not None and not self.write_task.done():
+            await self.write_task
+        batch = self._take_pending()
+        if batch:
+            await self._commit(batch, asyncio.to_thread(self._write_batch, *batch))
+        logger.info(f"Persistence flushed: {self.stats}")
+
+class LazyConversationHandler(ConversationHandler):
+    """ConversationHandler that restores a conversation's persisted state on its first update
+    
+    Stock persistence loads every conversation at startup; here each state is
+    read from SQLitePersistence the first time its (chat, user) key shows up.
+    """
+    
+    def __init__(self, *args, persistence: SQLitePersistence, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.persistence = persistence
+    
+    def check_update(self, update: object):
+        if isinstance(update, Update) and update.effective_chat and update.effective_user:
+            if not (update.callback_query and not update.callback_query.message):
+                key = self._get_key(update)
+                if key not in self._conversations:
+                    state = self.persistence.load_conversation_state(self.name, key)
+                    if state is not None:
+                        # Not a change, so it isn't written back
+                        self._conversations.update_no_track({key: state})
+        return super().check_update(update)
+
+# Global persistence instance (passed to the application builder in bot.main)
+bot_persistence = SQLitePersistence()
@@ -3,16 +3,60 @@ import sqlite3
 from typing import Optional, Dict
 from telegram import LabeledPrice, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from datetime import datetime
+from migrations import apply_migrations
+from usage_stats import add_revenue, backfill_revenue
 
 logger = logging.getLogger(__name__)
 
+# Stars ledger schema migrations; LEDGER_MIGRATIONS[n] upgrades to version n + 1
+LEDGER_MIGRATIONS = [
+    # 1: columns needed to record unlimited access purchases
+    [
+        "ALTER TABLE stars_transactions ADD COLUMN transaction_type TEXT DEFAULT 'character_unlock'",
+        "ALTER TABLE stars_transactions ADD COLUMN total_amount INTEGER",
+        "ALTER TABLE stars_transactions ADD COLUMN currency TEXT DEFAULT 'XTR'"
+    ],
+    # 2: one row per Telegram charge (keep the first of any duplicates) and indexed lookups
+    [
+        """DELETE FROM stars_transactions
+           WHERE telegram_payment_charge_id IS NOT NULL
+           AND id NOT IN (
+               SELECT MIN(id) FROM stars_transactions
+               WHERE telegram_payment_charge_id IS NOT NULL
+               GROUP BY telegram_payment_charge_id
+           )""",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_stars_transactions_charge ON stars_transactions (telegram_payment_charge_id)",
+        "CREATE INDEX IF NOT EXISTS idx_stars_transactions_user ON stars_transactions (user_id, created_at)"
+    ],
+    # 3: count existing payments in the daily revenue aggregates
+    backfill_revenue
+]
+
 class StarsPaymentManager:
     def __init__(self, db_path: str = "sextbot.db"):
         self.db_path = db_path
         # For digital goods, provider_token should be empty string according to Telegram docs
         self.payment_token = ""  # Empty string for digital goods
     
+    def init_database(self):
+        """Create the Stars ledger and bring its schema up to date"""
+        conn = sqlite3.connect(self.db_path)
+        # Original (version 0) table; later columns and indexes come from migrations
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS stars_transactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                character_id TEXT,
+                stars_amount INTEGER,
+                telegram_payment_charge_id TEXT,
+                status TEXT DEFAULT 'pending',
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        conn.commit()
+        conn.close()
+        apply_migrations(self.db_path, "stars_ledger", LEDGER_MIGRATIONS)
+    
     def create_stars_invoice(self, user_id: int, character_id: str, character_name: str, stars_amount: int) -> Optional[Dict]:
         """Create a Telegram Stars invoice for character unlock (digital goods)"""
         try:
@@ -56,27 +100,62 @@ class StarsPaymentManager:
             logger.error(f"Error creating Stars invoice: {e}")
             return None
     
-    def record_transaction(self, user_id: int, character_id: str, stars_amount: int, 
-                          telegram_payment_charge_id: str) -> bool:
-        """Record a Stars transaction in the database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def record_payment(self, user_id: int, transaction_type: str, stars_amount: int, total_amount: int,
+                       telegram_payment_charge_id: str, character_id: str = None) -> Dict:
+        """Record a Stars payment and grant its entitlement in one transaction
+        
+        Telegram may deliver the same successful payment more than once; a repeated
+        charge ID is ignored and reported as a duplicate.
+        """
+        conn = sqlite3.connect(self.db_path, isolation_level=None)
         
         try:
-            cursor.execute("""
-                INSERT INTO stars_transactions 
-                (user_id, character_id, stars_amount, telegram_payment_charge_id, status)
-                VALUES (?, ?, ?, ?, 'completed')
-            """, (user_id, character_id, stars_amount, telegram_payment_charge_id))
+            conn.execute("BEGIN IMMEDIATE")
+            cursor = conn.execute("""
+                INSERT OR IGNORE INTO stars_transactions
+                (user_id, character_id, stars_amount, total_amount, telegram_payment_charge_id,
+                 transaction_type, status)
+                VALUES (?, ?, ?, ?, ?, ?, 'completed')
+            """, (user_id, character_id, stars_amount, total_amount, telegram_payment_charge_id, transaction_type))
+            
+            if cursor.rowcount == 0:
+                conn.execute("ROLLBACK")
+                conn.close()
+                logger.info(f"Duplicate payment {telegram_payment_charge_id} from user {user_id} ignored")
+                return {"success": True, "duplicate": True}
+            
+            if transaction_type == "character_unlock":
+                conn.execute(
+                    "INSERT OR IGNORE INTO character_unlocks (user_id, character_id) VALUES (?, ?)",
+                    (user_id, character_id)
+                )
+            elif transaction_type == "unlimited_access":
+                conn.execute("""
+                    INSERT INTO users (user_id, paid) VALUES (?, 1)
+                    ON CONFLICT (user_id) DO UPDATE SET paid = 1
+                """, (user_id,))
             
-            conn.commit()
+            add_revenue(conn, transaction_type, character_id, total_amount)
+            
+            conn.execute("COMMIT")
             conn.close()
-            logger.info(f"Transaction recorded: User {user_id} unlocked {character_id}")
-            return True
+            logger.info(f"Transaction recorded: User {user_id} {transaction_type} {character_id or ''} ({total_amount} Stars)")
+            return {"success": True, "duplicate": False}
         except Exception as e:
-            logger.error(f"Error recording transaction: {e}")
+            logger.error(f"Error recording {transaction_type} payment: {e}")
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
             conn.close()
-            return False
+            return {"success": False, "error": str(e)}
+    
+    def record_transaction(self, user_id: int, character_id: str, stars_amount: int, 
+                          telegram_payment_charge_id: str) -> bool:
+        """Record a character unlock Stars transaction and unlock the character"""
+        result = self.record_payment(
+            user_id, "character_unlock", stars_amount, stars_amount,
+            telegram_payment_charge_id, character_id
+        )
+        return result["success"]
     
     def get_transaction_status(self, telegram_payment_charge_id: str) -> Optional[str]:
         """Get transaction status by payment charge ID"""
@@ -178,26 +257,9 @@ class StarsPaymentManager:
             return {"success": False, "error": str(e)}
 
     def record_unlimited_access_transaction(self, user_id: int, stars_amount: int, total_amount: int, charge_id: str) -> bool:
-        """Record unlimited access transaction in database"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                INSERT INTO stars_transactions 
-                (user_id, character_id, stars_amount, total_amount, charge_id, transaction_type, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (user_id, None, stars_amount, total_amount, charge_id, "unlimited_access", datetime.now()))
-            
-            conn.commit()
-            conn.close()
-            
-            logger.info(f"Unlimited access transaction recorded for user {user_id}: {stars_amount} Stars")
-            return True
-            
-        except Exception as e:
-            logger.error(f"Error recording unlimited access transaction: {e}")
-            return False
+        """Record unlimited access transaction and mark the user as paid"""
+        result = self.record_payment(user_id, "unlimited_access", stars_amount, total_amount, charge_id)
+        return result["success"]
 
 # Global Stars payment manager instance
 stars_payment_manager = StarsPaymentManager()
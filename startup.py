@@ -0,0 +1,42 @@
+import time
+import logging
+from typing import Callable, Dict, List, Tuple
+from memory import init_db
+from usage_stats import usage_stats
+from stars_payment import stars_payment_manager
+from token_usage import token_usage_tracker
+from characters import character_manager
+from sqlite_persistence import bot_persistence
+from shutdown import shutdown_coordinator
+from maintenance import maintenance_scheduler
+from broadcast import broadcast_engine
+
+logger = logging.getLogger(__name__)
+
+# Module singletons do no file or database I/O when imported; they are set up
+# here, in order (the Stars ledger migrations backfill the usage aggregates,
+# entitlements read the users table). OCR dependencies load on first use.
+STARTUP_STEPS: List[Tuple[str, Callable[[], None]]] = [
+    ("memory", init_db),
+    ("maintenance", maintenance_scheduler.init_database),
+    ("usage_stats", usage_stats.init_database),
+    ("stars_payment", stars_payment_manager.init_database),
+    ("token_usage", token_usage_tracker.initialize),
+    ("characters", character_manager.initialize),
+    ("sqlite_persistence", bot_persistence.init_database),
+    ("shutdown", shutdown_coordinator.init_database),
+    ("broadcast", broadcast_engine.init_database)
+]
+
+def initialize_services() -> Dict[str, float]:
+    """Initialize the module singletons, returns seconds spent per module"""
+    timings = {}
+    for name, step in STARTUP_STEPS:
+        started = time.perf_counter()
+        step()
+        timings[name] = time.perf_counter() - started
+    
+    total_ms = sum(timings.values()) * 1000
+    slowest = max(timings, key=timings.get)
+    logger.info(f"Services initialized in {total_ms:.0f}ms (slowest: {slowest}, {timings[slowest] * 1000:.0f}ms)")
+    return timings
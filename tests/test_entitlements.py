@@ -0,0 +1,42 @@
+import sqlite3
+import pytest
+from payment import upi_payment_store
+from entitlements import EntitlementService
+
+CHARACTERS = [
+    {"id": "free_char", "is_locked": False},
+    {"id": "paid_char", "is_locked": True}
+]
+LIMIT = 10
+
+@pytest.fixture
+def entitlements(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "test.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE users (user_id INTEGER PRIMARY KEY, paid INTEGER DEFAULT 0)")
+    conn.execute("CREATE TABLE character_unlocks (user_id INTEGER, character_id TEXT)")
+    conn.execute("INSERT INTO users (user_id, paid) VALUES (1, 1)")
+    conn.execute("INSERT INTO character_unlocks (user_id, character_id) VALUES (2, 'paid_char')")
+    conn.commit()
+    conn.close()
+    # UPI store already loaded, with no UPI payers
+    monkeypatch.setattr(upi_payment_store, "paid", set())
+    monkeypatch.setattr(upi_payment_store, "pending", set())
+    return EntitlementService(CHARACTERS, db_path)
+
+def test_locked_character_refused_without_unlock(entitlements):
+    # Unlimited access doesn't unlock a paid character
+    assert not entitlements.can_chat(1, "paid_char", 0, LIMIT)
+    assert not entitlements.can_chat(3, "paid_char", 0, LIMIT)
+
+def test_unlocked_character_allowed(entitlements):
+    assert entitlements.can_chat(2, "paid_char", 0, LIMIT)
+    assert not entitlements.can_chat(2, "paid_char", LIMIT, LIMIT)
+    entitlements.apply_event("character_unlock", 3, "paid_char")
+    assert entitlements.can_chat(3, "paid_char", 0, LIMIT)
+
+def test_free_character_and_default_persona_use_message_limit(entitlements):
+    for character_id in ("free_char", None):
+        assert entitlements.can_chat(3, character_id, LIMIT - 1, LIMIT)
+        assert not entitlements.can_chat(3, character_id, LIMIT, LIMIT)
+        assert entitlements.can_chat(1, character_id, LIMIT, LIMIT)
@@ -0,0 +1,180 @@
+import sqlite3
+import logging
+from collections import deque
+from datetime import date
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Number of recent replies per model kept for the reply-length distribution
+DISTRIBUTION_WINDOW = 500
+
+class TokenUsageTracker:
+    def __init__(self, db_path: str = "sextbot.db"):
+        self.db_path = db_path
+        # model -> recent completion token counts
+        self.reply_lengths: Dict[str, deque] = {}
+        # (user_id, day) -> total tokens used that day
+        self.daily_usage: Dict[tuple, int] = {}
+    
+    def initialize(self):
+        """Create tables and seed reply-length distributions (called from startup)"""
+        self.init_database()
+        self.load_reply_lengths()
+    
+    def init_database(self):
+        """Initialize database tables for LLM token usage"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        # One row per OpenRouter request
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS llm_usage (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                character_id TEXT,
+                model TEXT,
+                prompt_tokens INTEGER,
+                completion_tokens INTEGER,
+                latency_ms INTEGER,
+                max_tokens INTEGER,
+                truncated INTEGER DEFAULT 0,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Incrementally maintained totals per day, user, character and model
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS llm_usage_daily (
+                day TEXT,
+                user_id INTEGER,
+                character_id TEXT,
+                model TEXT,
+                requests INTEGER DEFAULT 0,
+                prompt_tokens INTEGER DEFAULT 0,
+                completion_tokens INTEGER DEFAULT 0,
+                latency_ms INTEGER DEFAULT 0,
+                PRIMARY KEY (day, user_id, character_id, model)
+            )
+        """)
+        
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_llm_usage_model ON llm_usage (model, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_llm_usage_daily_user ON llm_usage_daily (user_id)")
+        
+        conn.commit()
+        conn.close()
+    
+    def load_reply_lengths(self):
+        """Seed reply-length distributions from the most recent requests"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute("SELECT DISTINCT model FROM llm_usage")
+        models = [row[0] for row in cursor.fetchall()]
+        
+        for model in models:
+            cursor.execute(
+                "SELECT completion_tokens, truncated FROM llm_usage WHERE model = ? ORDER BY id DESC LIMIT ?",
+                (model, DISTRIBUTION_WINDOW)
+            )
+            window = self._window(model)
+            for completion_tokens, truncated in reversed(cursor.fetchall()):
+                window.append(self._observed_length(completion_tokens, truncated))
+        conn.close()
+    
+    def _window(self, model: str) -> deque:
+        """Get the reply-length window for a model"""
+        if model not in self.reply_lengths:
+            self.reply_lengths[model] = deque(maxlen=DISTRIBUTION_WINDOW)
+        return self.reply_lengths[model]
+    
+    def _observed_length(self, completion_tokens: int, truncated: bool) -> int:
+        """Truncated replies only give a lower bound, so count them as longer"""
+        return completion_tokens * 2 if truncated else completion_tokens
+    
+    def record_usage(self, user_id: int, character_id: Optional[str], model: str, prompt_tokens: int,
+                     completion_tokens: int, latency_ms: int, max_tokens: int, truncated: bool = False) -> bool:
+        """Record one LLM request and update the daily rollup"""
+        day = date.today().isoformat()
+        character_id = character_id or ""
+        used_today = self.get_tokens_used_today(user_id)
+        
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute("""
+                INSERT INTO llm_usage
+                (user_id, character_id, model, prompt_tokens, completion_tokens, latency_ms, max_tokens, truncated)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (user_id, character_id, model, prompt_tokens, completion_tokens, latency_ms, max_tokens, int(truncated)))
+            
+            cursor.execute("""
+                INSERT INTO llm_usage_daily
+                (day, user_id, character_id, model, requests, prompt_tokens, completion_tokens, latency_ms)
+                VALUES (?, ?, ?, ?, 1, ?, ?, ?)
+                ON CONFLICT (day, user_id, character_id, model) DO UPDATE SET
+                    requests = requests + 1,
+                    prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                    completion_tokens = completion_tokens + excluded.completion_tokens,
+                    latency_ms = latency_ms + excluded.latency_ms
+            """, (day, user_id, character_id, model, prompt_tokens, completion_tokens, latency_ms))
+            
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"Error recording token usage: {e}")
+            conn.close()
+            return False
+        
+        self._window(model).append(self._observed_length(completion_tokens, truncated))
+        self.daily_usage[(user_id, day)] = used_today + prompt_tokens + completion_tokens
+        return True
+    
+    def get_tokens_used_today(self, user_id: int) -> int:
+        """Get total tokens a user has used today"""
+        key = (user_id, date.today().isoformat())
+        if key not in self.daily_usage:
+            # Drop counters from previous days before loading today's
+            for stale in [k for k in self.daily_usage if k[1] != key[1]]:
+                del self.daily_usage[stale]
+            
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT COALESCE(SUM(prompt_tokens + completion_tokens), 0) FROM llm_usage_daily WHERE day = ? AND user_id = ?",
+                (key[1], user_id)
+            )
+            self.daily_usage[key] = cursor.fetchone()[0]
+            conn.close()
+        return self.daily_usage[key]
+    
+    def get_reply_length_percentile(self, model: str, percentile: float, min_samples: int) -> Optional[int]:
+        """Get a percentile of recent reply lengths, or None if there are too few samples"""
+        window = self.reply_lengths.get(model)
+        if not window or len(window) < min_samples:
+            return None
+        lengths = sorted(window)
+        index = min(len(lengths) - 1, int(percentile * len(lengths)))
+        return lengths[index]
+    
+    def get_user_usage_summary(self, user_id: int) -> Dict:
+        """Get a user's totals across all days"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT COALESCE(SUM(requests), 0), COALESCE(SUM(prompt_tokens), 0),
+                   COALESCE(SUM(completion_tokens), 0), COALESCE(SUM(latency_ms), 0)
+            FROM llm_usage_daily WHERE user_id = ?
+        """, (user_id,))
+        requests_count, prompt_tokens, completion_tokens, latency_ms = cursor.fetchone()
+        conn.close()
+        
+        return {
+            "requests": requests_count,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "avg_latency_ms": latency_ms // requests_count if requests_count else 0
+        }
+
+# Global token usage tracker instance
+token_usage_tracker = TokenUsageTracker()
@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Optional
+from telegram import Update
+from config import TRAFFIC_RECORD_PATH, TRAFFIC_RECORD_SALT
+
+logger = logging.getLogger(__name__)
+
+TRACE_VERSION = 1
+# Events written before the file buffer is flushed
+FLUSH_EVERY = 100
+# Numbers this long in callback data or payloads are user ids, never recorded as is
+ID_DIGITS = 6
+
+class TrafficRecorder:
+    """Opt-in recorder of anonymized update traces for benchmarks/replay_traffic.py
+    
+    Each update becomes one JSON line with its arrival offset, a hashed user
+    id and its shape: text length and hash, command, callback data, payment
+    amount and payload. User ids inside callback data and payloads are
+    replaced by "{user}" (the sender's own id) or a hash. Hashes are keyed
+    with TRAFFIC_RECORD_SALT (random per recording when unset), so repeated
+    texts and returning users stay recognizable without being readable.
+    """
+    
+    def __init__(self, path: str = TRAFFIC_RECORD_PATH, salt: str = TRAFFIC_RECORD_SALT):
+        self.path = path
+        self.salt = salt.encode() if salt else os.urandom(16)
+        self.file = None
+        self.started = 0.0
+        self.recorded = 0
+    
+    @property
+    def active(self) -> bool:
+        return self.file is not None
+    
+    def start(self):
+        """Start recording if TRAFFIC_RECORD_PATH is set (appends a new trace to the file)"""
+        if not self.path or self.active:
+            return
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.started = time.monotonic()
+        self._write({"trace": TRACE_VERSION, "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds")})
+        logger.info(f"Recording anonymized traffic to {self.path}")
+    
+    def stop(self):
+        if self.active:
+            self.file.close()
+            self.file = None
+            logger.info(f"Traffic recording stopped after {self.recorded} updates")
+    
+    def _hash(self, value) -> str:
+        return hashlib.blake2b(str(value).encode(), key=self.salt, digest_size=6).hexdigest()
+    
+    def _anonymize_data(self, data: str, user_id: int) -> str:
+        """Callback data or invoice payload with user ids taken out"""
+        parts = []
+        for part in data.split(":"):
+            if part.isdigit() and len(part) >= ID_DIGITS:
+                part = "{user}" if int(part) == user_id else f"#{self._hash(part)}"
+            parts.append(part)
+        return ":".join(parts)
+    
+    def describe(self, update: Update) -> Dict:
+        """Anonymized shape of an update"""
+        user_id = update.effective_user.id if update.effective_user else 0
+        message = update.message
+        if message and message.successful_payment:
+            payment = message.successful_payment
+            return {
+                "kind": "payment", "currency": payment.currency, "amount": payment.total_amount,
+                "payload": self._anonymize_data(payment.invoice_payload, user_id)
+            }
+        if message and message.text:
+            text = message.text
+            if text.startswith("/"):
+                command, *args = text.split()
+                # Deep-link arguments name a character; anything else could be personal
+                return {
+                    "kind": "command", "command": command.split("@")[0],
+                    "args": [arg if arg.startswith("char_") else f"#{self._hash(arg)}" for arg in args]
+                }
+            return {"kind": "text", "length": len(text), "text": self._hash(text)}
+        if message and message.photo:
+            return {"kind": "photo", "size": message.photo[-1].file_size or 0}
+        if message:
+            return {"kind": "message_other"}
+        if update.callback_query:
+            return {"kind": "callback", "data": self._anonymize_data(update.callback_query.data or "", user_id)}
+        if update.pre_checkout_query:
+            query = update.pre_checkout_query
+            return {
+                "kind": "pre_checkout", "currency": query.currency, "amount": query.total_amount,
+                "payload": self._anonymize_data(query.invoice_payload, user_id)
+            }
+        if update.inline_query:
+            query = update.inline_query
+            return {"kind": "inline", "length": len(query.query), "text": self._hash(query.query), "offset": query.offset}
+        kind = next((name for name, value in update.to_dict().items() if name != "update_id" and value), "other")
+        return {"kind": kind}
+    
+    def record(self, update: object):
+        """Append an update as it arrives (no-op unless recording)"""
+        if not self.active or not isinstance(update, Update):
+            return
+        user_id = update.effective_user.id if update.effective_user else 0
+        try:
+            event = self.describe(update)
+        except Exception as e:
+            logger.error(f"Could not record update {update.update_id}: {e}")
+            return
+        self._write({"t": round(time.monotonic() - self.started, 3), "user": self._hash(user_id), **event})
+        self.recorded += 1
+        if self.recorded % FLUSH_EVERY == 0:
+            self.file.flush()
+    
+    def _write(self, event: Dict):
+        self.file.write(json.dumps(event, separators=(",", ":")) + "\n")
+    
+    def get_stats(self) -> Optional[Dict]:
+        return {"path": self.path, "recorded": self.recorded} if self.active else None
+
+# Global recorder (started from bot.main when TRAFFIC_RECORD_PATH is set)
+traffic_recorder = TrafficRecorder()
@@ -0,0 +1,156 @@
+import time
+import asyncio
+import logging
+from contextlib import nullcontext
+from typing import Any, Awaitable, Dict
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from concurrent.futures import ThreadPoolExecutor
+from config import UPDATE_CONCURRENCY
+from metrics import latency
+from traffic_recorder import traffic_recorder
+
+logger = logging.getLogger(__name__)
+
+# Telegram cancels a checkout that isn't answered within 10 seconds
+CHECKOUT_ANSWER_WARNING = 5.0
+# Updates accepted at once, including updates waiting for their lane; only
+# matters for priority updates if the backlog ever reaches it
+MAX_PENDING_UPDATES = 4096
+
+def is_priority_update(update: object) -> bool:
+    """Payment updates that must never wait behind chat generation"""
+    if not isinstance(update, Update):
+        return False
+    if update.pre_checkout_query:
+        return True
+    return bool(update.message and update.message.successful_payment)
+
+class UserLane:
+    """Serializes one user's updates; removed as soon as nothing is queued on it"""
+    
+    __slots__ = ("lock", "users")
+    
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0  # Updates running or waiting in this lane
+
+def lane_key(update: object):
+    """Updates from the same user share a lane (None for updates without a user)"""
+    if isinstance(update, Update):
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return ("chat", update.effective_chat.id)
+    return None
+
+class PriorityUpdateProcessor(BaseUpdateProcessor):
+    """Runs payment updates immediately and other updates in per-user lanes
+    
+    Each user's updates run one at a time in arrival order, which keeps
+    chat_history and the conversation handler's (chat, user) state consistent,
+    while different users are served in parallel up to max_concurrent_users.
+    Pre-checkout queries and successful payments skip the lanes so a slow LLM
+    reply can't make Telegram time out the checkout.
+    """
+    
+    def __init__(self, max_concurrent_users: int = UPDATE_CONCURRENCY,
+                 max_pending_updates: int = MAX_PENDING_UPDATES):
+        super().__init__(max_pending_updates)
+        self.max_concurrent_users = max(1, max_concurrent_users)
+        self.user_slots = asyncio.Semaphore(self.max_concurrent_users)
+        self.lanes: Dict[object, UserLane] = {}
+        self.checkout_latency = latency("checkout_answer")
+        self.payment_latency = latency("successful_payment")
+        self.lane_wait = latency("user_lane_wait")
+        self.stats = {"priority": 0, "normal": 0, "running": 0, "max_lanes": 0}
+        # Updates running or waiting for their lane (checked when shutting down)
+        self.in_flight = 0
+    
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        # Called as updates arrive, before they wait for a lane
+        traffic_recorder.record(update)
+        self.in_flight += 1
+        try:
+            await self._process(update, coroutine)
+        finally:
+            self.in_flight -= 1
+    
+    async def _process(self, update: object, coroutine: Awaitable[Any]) -> None:
+        started = time.monotonic()
+        
+        if is_priority_update(update):
+            self.stats["priority"] += 1
+            try:
+                await coroutine
+            finally:
+                elapsed = time.monotonic() - started
+                if update.pre_checkout_query:
+                    self.checkout_latency.record(elapsed)
+                    if elapsed > CHECKOUT_ANSWER_WARNING:
+                        logger.warning(f"Pre-checkout answered after {elapsed:.1f}s")
+                else:
+                    self.payment_latency.record(elapsed)
+            return
+        
+        await self.run_in_lane(lane_key(update), coroutine, started)
+    
+    async def run_in_lane(self, key, coroutine: Awaitable[Any], started: float = None, take_slot: bool = True) -> None:
+        """Run work in a user's lane (key is the user id), after that user's earlier updates
+        
+        Also used for work that isn't an update, such as replies resumed after
+        a restart, so it can't interleave with the user's new messages. Such
+        work brings its own concurrency limit and passes take_slot=False, so it
+        doesn't hold update slots other users need.
+        """
+        if started is None:
+            started = time.monotonic()
+        # Lanes are taken in call order: this runs without awaiting until lock.acquire()
+        lane = self.lanes.get(key)
+        if lane is None:
+            lane = self.lanes[key] = UserLane()
+            self.stats["max_lanes"] = max(self.stats["max_lanes"], len(self.lanes))
+        lane.users += 1
+        
+        try:
+            async with lane.lock:
+                # Only users at the front of their lane compete for a slot
+                async with self.user_slots if take_slot else nullcontext():
+                    self.lane_wait.record(time.monotonic() - started)
+                    self.stats["normal"] += 1
+                    self.stats["running"] += 1
+                    try:
+                        await coroutine
+                    finally:
+                        self.stats["running"] -= 1
+        finally:
+            lane.users -= 1
+            if lane.users == 0:
+                # Idle user: drop the lane so the table only holds active users
+                del self.lanes[key]
+    
+    async def initialize(self) -> None:
+        # LLM calls run in the default thread pool (asyncio.to_thread); size it so
+        # every concurrent user can have one in flight
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(
+            max_workers=self.max_concurrent_users + 4, thread_name_prefix="update-worker"
+        ))
+    
+    async def shutdown(self) -> None:
+        pass
+    
+    def get_stats(self) -> Dict:
+        """Get lane counters and latencies"""
+        return {
+            **self.stats,
+            "lanes": len(self.lanes),
+            "in_flight": self.in_flight,
+            "max_concurrent_users": self.max_concurrent_users,
+            "checkout_answer": self.checkout_latency.summary(),
+            "successful_payment": self.payment_latency.summary(),
+            "user_lane_wait": self.lane_wait.summary()
+        }
+
+# Global update processor (shared with the application builder in bot.main)
+update_processor = PriorityUpdateProcessor()
@@ -0,0 +1,130 @@
+import sqlite3
+import logging
+from typing import Dict, List
+from ai_models import ai_model_manager
+from migrations import apply_migrations
+
+logger = logging.getLogger(__name__)
+
+# Revenue without a character (unlimited access) is reported under this tier
+UNLIMITED_TIER = "Unlimited Access"
+
+# Daily totals per character, updated in the same transaction as the row they count
+STATS_MIGRATIONS = [
+    [
+        """
+        CREATE TABLE IF NOT EXISTS daily_revenue (
+            day TEXT NOT NULL,
+            character_id TEXT NOT NULL,
+            tier TEXT NOT NULL,
+            transaction_type TEXT NOT NULL,
+            payments INTEGER DEFAULT 0,
+            stars INTEGER DEFAULT 0,
+            PRIMARY KEY (day, character_id, transaction_type)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS daily_messages (
+            day TEXT NOT NULL,
+            character_id TEXT NOT NULL,
+            tier TEXT NOT NULL,
+            user_messages INTEGER DEFAULT 0,
+            bot_messages INTEGER DEFAULT 0,
+            PRIMARY KEY (day, character_id)
+        )
+        """
+    ]
+]
+
+def revenue_tier(character_price: int, character_id: str = None) -> str:
+    """Tier a payment is reported under"""
+    return ai_model_manager._get_tier_name(character_price) if character_id else UNLIMITED_TIER
+
+def add_revenue(conn, transaction_type: str, character_id: str, stars: int, day: str = None):
+    """Count a payment in the daily totals (call inside the payment's transaction)"""
+    conn.execute("""
+        INSERT INTO daily_revenue (day, character_id, tier, transaction_type, payments, stars)
+        VALUES (COALESCE(?, date('now')), ?, ?, ?, 1, ?)
+        ON CONFLICT (day, character_id, transaction_type) DO UPDATE SET
+            payments = payments + 1,
+            stars = stars + excluded.stars
+    """, (day, character_id or "", revenue_tier(stars, character_id), transaction_type, stars))
+
+def add_message(conn, character_id: str, character_price: int, is_user: int):
+    """Count a chat message in the daily totals (call before committing the message)"""
+    conn.execute("""
+        INSERT INTO daily_messages (day, character_id, tier, user_messages, bot_messages)
+        VALUES (date('now'), ?, ?, ?, ?)
+        ON CONFLICT (day, character_id) DO UPDATE SET
+            user_messages = user_messages + excluded.user_messages,
+            bot_messages = bot_messages + excluded.bot_messages
+    """, (character_id or "", ai_model_manager._get_tier_name(character_price), int(bool(is_user)), int(not is_user)))
+
+def backfill_revenue(conn):
+    """Count Stars payments recorded before the aggregates existed (ledger migration)"""
+    rows = conn.execute("""
+        SELECT date(created_at), transaction_type, character_id, stars_amount
+        FROM stars_transactions
+        WHERE status = 'completed'
+    """).fetchall()
+    for day, transaction_type, character_id, stars in rows:
+        add_revenue(conn, transaction_type, character_id, stars or 0, day)
+    if rows:
+        logger.info(f"Backfilled revenue aggregates from {len(rows)} Stars payments")
+
+class UsageStats:
+    def __init__(self, db_path: str = "sextbot.db"):
+        self.db_path = db_path
+    
+    def init_database(self):
+        """Create the aggregate tables (before the Stars ledger migrations, which backfill them)"""
+        apply_migrations(self.db_path, "usage_stats", STATS_MIGRATIONS)
+    
+    def get_summary(self, days: int = 1) -> Dict:
+        """Revenue and message totals for the last N days (including today)
+        
+        Reads only the aggregate rows for those days, so the cost depends on the
+        number of characters, not on the size of the history.
+        """
+        since = f"-{max(1, days) - 1} days"
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            SELECT character_id, tier, SUM(payments), SUM(stars)
+            FROM daily_revenue WHERE day >= date('now', ?)
+            GROUP BY character_id, tier ORDER BY SUM(stars) DESC
+        """, (since,))
+        revenue = [
+            {"character_id": row[0], "tier": row[1], "payments": row[2], "stars": row[3]}
+            for row in cursor.fetchall()
+        ]
+        
+        cursor.execute("""
+            SELECT character_id, tier, SUM(user_messages), SUM(bot_messages)
+            FROM daily_messages WHERE day >= date('now', ?)
+            GROUP BY character_id, tier ORDER BY SUM(user_messages) DESC
+        """, (since,))
+        messages = [
+            {"character_id": row[0], "tier": row[1], "user_messages": row[2], "bot_messages": row[3]}
+            for row in cursor.fetchall()
+        ]
+        conn.close()
+        
+        return {
+            "days": days,
+            "revenue": revenue,
+            "messages": messages,
+            "stars_by_tier": self._totals_by_tier(revenue, "stars"),
+            "messages_by_tier": self._totals_by_tier(messages, "user_messages")
+        }
+    
+    @staticmethod
+    def _totals_by_tier(rows: List[Dict], field: str) -> Dict[str, int]:
+        totals = {}
+        for row in rows:
+            totals[row["tier"]] = totals.get(row["tier"], 0) + row[field]
+        return totals
+
+# Global usage stats instance
+usage_stats = UsageStats()
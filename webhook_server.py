@@ -0,0 +1,201 @@
+import hmac
+import json
+import signal
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Tuple
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+MAX_HEADER_BYTES = 16 * 1024
+# Slow or stalled clients are dropped after this many seconds
+READ_TIMEOUT = 10.0
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    408: "Request Timeout",
+    411: "Length Required",
+    413: "Payload Too Large",
+    431: "Request Header Fields Too Large"
+}
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str = ""):
+        super().__init__(message or REASONS.get(status, ""))
+        self.status = status
+
+class WebhookServer:
+    """Minimal asyncio HTTP server that feeds Telegram webhook updates to the application
+    
+    Meant to listen on localhost behind nginx (which terminates TLS). Serves
+    POST <path> for updates and GET /health for monitoring; every response
+    closes the connection.
+    """
+    
+    def __init__(self, app: Application, host: str, port: int, path: str, secret_token: str, max_body: int,
+                 extra_health: Callable[[], Dict] = None):
+        self.app = app
+        self.extra_health = extra_health
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.max_body = max_body
+        self.server = None
+        self.started_at = time.monotonic()
+        self.stats = {"updates": 0, "rejected": 0, "errors": 0}
+    
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port, limit=MAX_HEADER_BYTES)
+        logger.info(f"Webhook server listening on http://{self.host}:{self.port}{self.path}")
+    
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+            logger.info(f"Webhook server stopped: {self.stats}")
+    
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            try:
+                method, path, headers = await asyncio.wait_for(self._read_head(reader), READ_TIMEOUT)
+                status, body = await self._route(reader, method, path, headers)
+            except HTTPError as e:
+                status, body = e.status, {"ok": False, "error": str(e)}
+                self.stats["rejected"] += 1
+            except asyncio.TimeoutError:
+                status, body = 408, {"ok": False, "error": REASONS[408]}
+                self.stats["rejected"] += 1
+            await self._respond(writer, status, body)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error(f"Webhook request failed: {e}")
+        finally:
+            writer.close()
+    
+    async def _read_head(self, reader: asyncio.StreamReader) -> Tuple[str, str, Dict[str, str]]:
+        """Read the request line and headers"""
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.LimitOverrunError:
+            raise HTTPError(431)
+        lines = head.decode("latin-1").split("\r\n")
+        parts = lines[0].split(" ")
+        if len(parts) != 3:
+            raise HTTPError(400, "Malformed request line")
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        # Drop any query string
+        return parts[0], parts[1].split("?", 1)[0], headers
+    
+    async def _route(self, reader: asyncio.StreamReader, method: str, path: str, headers: Dict[str, str]) -> Tuple[int, Dict]:
+        if path == "/health":
+            if method != "GET":
+                raise HTTPError(405)
+            return 200, self.get_health()
+        
+        if path != self.path:
+            raise HTTPError(404)
+        if method != "POST":
+            raise HTTPError(405)
+        if not hmac.compare_digest(headers.get(SECRET_HEADER, ""), self.secret_token):
+            logger.warning("Webhook request with a wrong secret token rejected")
+            raise HTTPError(403)
+        
+        length = headers.get("content-length")
+        if length is None or not length.isdigit():
+            raise HTTPError(411)
+        if int(length) > self.max_body:
+            raise HTTPError(413)
+        
+        body = await asyncio.wait_for(reader.readexactly(int(length)), READ_TIMEOUT)
+        try:
+            payload = json.loads(body)
+            # Valid JSON that isn't an object ([1, 2], null) would slip past de_json
+            if not isinstance(payload, dict):
+                raise ValueError("not a JSON object")
+            update = Update.de_json(payload, self.app.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            raise HTTPError(400, f"Invalid update: {e}")
+        
+        await self.app.update_queue.put(update)
+        self.stats["updates"] += 1
+        return 200, {"ok": True}
+    
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, body: Dict):
+        payload = json.dumps(body).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + payload
+        )
+        await writer.drain()
+    
+    def get_health(self) -> Dict:
+        """Liveness and queue depth for monitoring"""
+        return {
+            "status": "ok" if self.app.running else "stopping",
+            "uptime_seconds": int(time.monotonic() - self.started_at),
+            "update_queue": self.app.update_queue.qsize(),
+            **self.stats,
+            **(self.extra_health() if self.extra_health else {})
+        }
+
+async def run_webhook(app: Application, host: str, port: int, path: str, secret_token: str,
+                      max_body: int, webhook_url: str = "", before_stop: Callable[[], Awaitable] = None,
+                      extra_health: Callable[[], Dict] = None):
+    """Run the application on the webhook server until SIGINT/SIGTERM
+    
+    When webhook_url is empty the webhook isn't registered with Telegram, so
+    the server can be tested locally by POSTing recorded updates. before_stop
+    runs after the server stops accepting updates, before the application stops;
+    extra_health adds fields to GET /health.
+    """
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    
+    server = WebhookServer(app, host, port, path, secret_token, max_body, extra_health)
+    async with app:
+        if app.post_init:
+            await app.post_init(app)
+        await app.start()
+        await server.start()
+        if webhook_url:
+            await app.bot.set_webhook(
+                url=webhook_url.rstrip("/") + path,
+                secret_token=secret_token,
+                allowed_updates=Update.ALL_TYPES
+            )
+            logger.info(f"Webhook registered at {webhook_url.rstrip('/')}{path}")
+        else:
+            logger.info("WEBHOOK_URL not set, webhook not registered with Telegram (local testing)")
+        
+        await stop_event.wait()
+        
+        await server.stop()
+        if before_stop:
+            await before_stop()
+        await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+    
+    # run_polling calls post_init/post_stop/post_shutdown itself; with a custom server it's up to us
+    if app.post_shutdown:
+        await app.post_shutdown(app)